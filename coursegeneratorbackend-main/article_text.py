@@ -0,0 +1,154 @@
+"""Plain text of fetched Wikipedia articles, without their boilerplate.
+
+An article comes either as the HTML of action=parse or as a plaintext extract
+(prop=extracts). Both are reduced to the blocks of text of its body, one
+paragraph or list item each. Navboxes, infoboxes and other tables, citation
+markers, edit links and the like are dropped, as are whole sections such as
+References or External links. The HTML is parsed with lxml when it is
+installed, with BeautifulSoup's html.parser otherwise. Sentences are split
+one block at a time as the blocks are produced, so no sentence spans two
+paragraphs and the tokenizer never sees a whole article at once.
+"""
+import re
+
+try:
+    import lxml.html
+except ImportError:  # lxml is optional, html.parser is slower but always available
+    lxml = None
+
+# Sections after which an article has no more prose worth checking facts against
+BOILERPLATE_SECTIONS = {
+    'references', 'notes', 'footnotes', 'citations', 'notes and references', 'sources', 'bibliography',
+    'works cited', 'further reading', 'external links', 'see also',
+}
+# Elements dropped wherever they are, by tag or by class (citation markers are <sup class="reference">)
+BOILERPLATE_TAGS = {'table', 'style', 'script', 'figure', 'math'}
+BOILERPLATE_CLASSES = {
+    'navbox', 'navbox-styles', 'infobox', 'sidebar', 'hatnote', 'shortdescription', 'toc', 'thumb',
+    'reference', 'reflist', 'references', 'mw-references-wrap', 'mw-editsection', 'metadata', 'ambox',
+    'noprint', 'sistersitebox', 'mw-empty-elt',
+}
+HEADINGS = {'h1': 1, 'h2': 2, 'h3': 3, 'h4': 4, 'h5': 5, 'h6': 6}
+# Elements whose whole text is one block; the content of any other element is searched for blocks
+BLOCK_TAGS = {'p', 'li', 'dd', 'dt', 'blockquote', 'pre'}
+EXTRACT_HEADING = re.compile(r"^(=+)\s*(.*?)\s*\1$")
+# Bumped whenever the blocks produced for the same page change, so sentences and embeddings
+# cached from an older extraction are not served again (version 1 was the whole-page text)
+EXTRACTION_VERSION = 2
+
+def normalize(text):
+    return " ".join(text.split())
+
+# The few operations the block walk needs, for an lxml and a BeautifulSoup tree
+class LxmlTree:
+    def __init__(self, html):
+        self.root = lxml.html.fromstring(html)
+
+    def name(self, element):
+        return element.tag if isinstance(element.tag, str) else None
+
+    def classes(self, element):
+        return element.get('class', '').split()
+
+    def children(self, element):
+        return [child for child in element if isinstance(child.tag, str)]
+
+    def text(self, element):
+        return element.text_content()
+
+    def elements(self):
+        return [element for element in self.root.iter() if isinstance(element.tag, str)]
+
+    def remove(self, element):
+        # Keeps the text after the element, which belongs to its parent
+        if element.getparent() is not None:
+            element.drop_tree()
+
+class SoupTree:
+    def __init__(self, html):
+        from bs4 import BeautifulSoup
+        self.root = BeautifulSoup(html, 'html.parser')
+
+    def name(self, element):
+        return element.name
+
+    def classes(self, element):
+        return element.get('class') or []
+
+    def children(self, element):
+        return element.find_all(True, recursive=False)
+
+    def text(self, element):
+        return element.get_text()
+
+    def elements(self):
+        # Lazily, so the descendants of an element removed meanwhile are left out
+        return (element for element in self.root.find_all(True) if not element.decomposed)
+
+    def remove(self, element):
+        element.decompose()
+
+def is_boilerplate(tree, element):
+    return (tree.name(element) in BOILERPLATE_TAGS or element.get('id') == 'toc'
+            or not BOILERPLATE_CLASSES.isdisjoint(tree.classes(element)))
+
+def heading(tree, element):
+    """(level, title) of a section heading, also in its newer <div class="mw-heading"> wrapper, or None."""
+    if tree.name(element) in HEADINGS:
+        return HEADINGS[tree.name(element)], normalize(tree.text(element))
+    if 'mw-heading' in tree.classes(element):
+        for child in tree.children(element):
+            if tree.name(child) in HEADINGS:
+                return HEADINGS[tree.name(child)], normalize(tree.text(child))
+    return None
+
+def html_blocks(html):
+    """Yields the blocks of text of an article's HTML in document order."""
+    tree = LxmlTree(html) if lxml is not None else SoupTree(html)
+    for element in tree.elements():
+        if is_boilerplate(tree, element):
+            tree.remove(element)
+    skip_level = None
+    stack = [tree.root]
+    while stack:
+        element = stack.pop()
+        section = heading(tree, element)
+        if section is not None:
+            level, title = section
+            # A boilerplate section ends at the next heading of the same or a higher level
+            if skip_level is not None and level <= skip_level:
+                skip_level = None
+            if skip_level is None and title.lower() in BOILERPLATE_SECTIONS:
+                skip_level = level
+            continue
+        if tree.name(element) in BLOCK_TAGS:
+            if skip_level is None:
+                text = normalize(tree.text(element))
+                if text:
+                    yield text
+        else:
+            # Containers are searched in skipped sections too, the heading that ends the section may be inside one
+            stack.extend(reversed(tree.children(element)))
+
+def extract_blocks(extract):
+    """Yields the blocks of text of a plaintext extract (explaintext with exsectionformat=wiki)."""
+    skip_level = None
+    for line in extract.splitlines():
+        line = line.strip()
+        match = EXTRACT_HEADING.match(line)
+        if match:
+            level, title = len(match.group(1)), match.group(2)
+            if skip_level is not None and level <= skip_level:
+                skip_level = None
+            if skip_level is None and title.lower() in BOILERPLATE_SECTIONS:
+                skip_level = level
+        elif line and skip_level is None:
+            yield line
+
+def iter_sentences(blocks, split_sentences):
+    """Splits the blocks into sentences one block at a time, yielding each sentence as soon as it is split."""
+    for block in blocks:
+        for sentence in split_sentences(block):
+            sentence = sentence.strip()
+            if sentence:
+                yield sentence
@@ -0,0 +1,180 @@
+"""ASGI entry point: the LLM editing endpoints on AsyncOpenAI, everything else on the Flask app.
+
+server.py blocks a worker thread for the whole round-trip of every LLM call. Here the
+shorten/expand/regenerate and course plan endpoints await the call on one event loop
+instead, over pooled keep-alive connections shared by all requests, so one process can
+hold hundreds of them in flight. All other routes (lesson generation, jobs, fact
+checking) are passed through to the Flask app in a thread pool. Run with:
+    hypercorn async_server:app --bind 0.0.0.0:5000
+"""
+import asyncio
+import itertools
+import json
+import os
+import time
+
+import httpx
+from hypercorn.middleware import AsyncioWSGIMiddleware
+from openai import AsyncOpenAI
+from quart import Quart, Response, jsonify, request
+from quart_cors import cors
+
+import observability
+from llm_limiter import acreate_with_limits, asettle_usage
+import server
+
+# Connections open to the OpenAI API; requests beyond this wait for a free connection
+ASYNC_MAX_CONNECTIONS = int(os.getenv("ASYNC_MAX_CONNECTIONS", "256"))
+# The connections are split over several clients of this many connections each. httpx's pool
+# does work quadratic in its size on every request, which at a few hundred connections
+# costs more CPU than the requests themselves.
+ASYNC_CONNECTIONS_PER_CLIENT = int(os.getenv("ASYNC_CONNECTIONS_PER_CLIENT", "16"))
+ASYNC_TIMEOUT = float(os.getenv("ASYNC_TIMEOUT", "600"))
+# Largest request body passed through to the Flask routes (fact checking posts whole lessons)
+PASSTHROUGH_MAX_BODY_MB = int(os.getenv("PASSTHROUGH_MAX_BODY_MB", "16"))
+
+quart_app = cors(Quart(__name__), allow_origin="*")
+
+# Created on the serving event loop, the connection pools are bound to it
+async_clients = []
+next_client = None
+
+@quart_app.before_serving
+async def open_clients():
+    global next_client
+    per_client = max(1, min(ASYNC_CONNECTIONS_PER_CLIENT, ASYNC_MAX_CONNECTIONS))
+    for _ in range(-(-ASYNC_MAX_CONNECTIONS // per_client)):
+        limits = httpx.Limits(max_connections=per_client, max_keepalive_connections=per_client)
+        http_client = httpx.AsyncClient(limits=limits, timeout=ASYNC_TIMEOUT)
+        async_clients.append(AsyncOpenAI(api_key=server.api_key, http_client=http_client, max_retries=0))
+    next_client = itertools.cycle(async_clients).__next__
+
+@quart_app.after_serving
+async def close_clients():
+    for async_client in async_clients:
+        await async_client.close()
+
+# Async counterpart of server.chat_completion, sharing its response cache and usage report.
+# Cache lookups touch SQLite, so they run in a thread rather than on the event loop.
+async def achat_completion(label="chat", bypass_cache=False, **params):
+    start = time.perf_counter()
+    key = server.cache_key(**params)
+    llm_cache = server.llm_cache
+    if llm_cache is not None:
+        if bypass_cache:
+            llm_cache.bypass()
+        else:
+            cached = await asyncio.to_thread(llm_cache.get, key)
+            if cached is not None:
+                server.record_usage(label, params, seconds=time.perf_counter() - start)
+                return cached
+    response, _ = await acreate_with_limits(server.llm_limiter, next_client().chat.completions.create, params,
+                                            server.llm_priority(label))
+    server.record_usage(label, params, response, time.perf_counter() - start, server.cache_status(bypass_cache))
+    content = response.choices[0].message.content
+    if llm_cache is not None:
+        await asyncio.to_thread(llm_cache.put, key, content)
+    return content
+
+# Async counterpart of server.stream_chat_completion
+async def astream_chat_completion(label="chat", bypass_cache=False, **params):
+    start = time.perf_counter()
+    key = server.cache_key(**params)
+    llm_cache = server.llm_cache
+    if llm_cache is not None:
+        if bypass_cache:
+            llm_cache.bypass()
+        else:
+            cached = await asyncio.to_thread(llm_cache.get, key)
+            if cached is not None:
+                server.record_usage(label, params, seconds=time.perf_counter() - start)
+                yield cached
+                return
+    pieces = []
+    usage = None
+    first_token_seconds = None
+    stream, limiter_entry = await acreate_with_limits(server.llm_limiter, next_client().chat.completions.create,
+                                                      dict(params, stream=True, stream_options={"include_usage": True}),
+                                                      server.llm_priority(label))
+    async for chunk in stream:
+        usage = chunk.usage or usage
+        if chunk.choices and chunk.choices[0].delta.content:
+            pieces.append(chunk.choices[0].delta.content)
+            if first_token_seconds is None:
+                first_token_seconds = round(time.perf_counter() - start, 4)
+            yield pieces[-1]
+    content = "".join(pieces)
+    await asettle_usage(server.llm_limiter, limiter_entry, usage)
+    server.record_usage(label, params, server.streamed_response(content, usage), time.perf_counter() - start,
+                        server.cache_status(bypass_cache), first_token_seconds=first_token_seconds)
+    if llm_cache is not None:
+        await asyncio.to_thread(llm_cache.put, key, content)
+
+async def ndjson_stream(pieces):
+    """server.ndjson_stream of server.content_events, for an async stream of text pieces."""
+    content = []
+    try:
+        async for piece in pieces:
+            content.append(piece)
+            yield json.dumps({"type": "delta", "content": piece}) + "\n"
+        yield json.dumps({"type": "done", "content": "".join(content).strip()}) + "\n"
+    except Exception as e:
+        observability.log_error("stream.error", error=str(e))
+        yield json.dumps({"type": "error", "error": str(e)}) + "\n"
+
+async def edit_topic(build_request, bypass_cache_default):
+    data = await request.get_json()
+    content = data.get('content', '').strip()
+
+    if data.get('stream'):
+        pieces = astream_chat_completion(bypass_cache=data.get('bypass_cache', bypass_cache_default), **build_request(content))
+        return Response(ndjson_stream(pieces), mimetype='application/x-ndjson',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    try:
+        edited_content = await achat_completion(bypass_cache=data.get('bypass_cache', bypass_cache_default),
+                                                **build_request(content))
+        return jsonify({"content": edited_content.strip()})
+    except Exception as e:
+        observability.log_error("request.error", endpoint=request.path, error=str(e))
+        return jsonify({"error": str(e)}), 500
+
+@quart_app.route('/regenerate_topic', methods=['POST'])
+async def regenerate_topic():
+    return await edit_topic(server.regenerate_request, True)
+
+@quart_app.route('/shorten_topic', methods=['POST'])
+async def shorten_topic():
+    return await edit_topic(server.shorten_request, False)
+
+@quart_app.route('/expand_topic', methods=['POST'])
+async def expand_topic():
+    return await edit_topic(server.extend_request, False)
+
+@quart_app.route('/generate_course_plan', methods=['POST'])
+async def generate_course_plan():
+    data = await request.get_json()
+    try:
+        with observability.trace(kind="course_plan") as trace:
+            # Selecting the example course plans embeds the request with the sentence model, off the event loop
+            params = await asyncio.to_thread(server.course_plan_request, data)
+            response = await achat_completion(**params)
+            # Repairs and their re-requests are rare, so they run on the synchronous client in a thread
+            course_plan = await asyncio.to_thread(server.complete_course_plan, data, response, params)
+        return jsonify(course_plan), {'X-Trace-Id': trace.id}
+    except server.StructuredOutputError as format_err:
+        observability.log_error("course_plan.format_error", error=str(format_err))
+        return jsonify({"error": str(format_err)}), 500
+    except Exception as e:
+        observability.log_error("request.error", endpoint=request.path, error=str(e))
+        return jsonify({"error": str(e)}), 500
+
+ASYNC_ROUTES = frozenset(str(rule) for rule in quart_app.url_map.iter_rules() if rule.endpoint != 'static')
+
+flask_app = AsyncioWSGIMiddleware(server.app, max_body_size=PASSTHROUGH_MAX_BODY_MB * 1024 * 1024)
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan' or scope.get('path') in ASYNC_ROUTES:
+        await quart_app(scope, receive, send)
+    else:
+        await flask_app(scope, receive, send)
@@ -0,0 +1,74 @@
+"""Preprocessing time of fetched articles: the whole-page BeautifulSoup path against the fast path.
+
+For each saved page (the HTML of action=parse, or a saved action=parse JSON response) the
+old path takes the text of the whole page with html.parser and splits it in one piece. The
+fast path strips boilerplate with article_text (lxml when installed) and splits it one
+paragraph at a time, and the cached path is a sentence cache hit for the page revision.
+Run from the backend directory:
+    python -m benchmarks.article_preprocessing
+    python -m benchmarks.article_preprocessing --pages saved/*.html --repeat 20
+More pages can be saved with e.g.
+    curl 'https://en.wikipedia.org/w/api.php?action=parse&page=Thread_(computing)&prop=text|revid&format=json' > thread.json
+"""
+import argparse
+import glob
+import json
+import os
+import time
+
+from bs4 import BeautifulSoup
+
+import article_text
+import fact_verification
+from fact_verification import cached_sentences, split_sentences, wikipedia_document
+
+DEFAULT_PAGES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "data", "*.html")))
+
+def read_page(path):
+    with open(path, "r", encoding="utf-8") as page_file:
+        text = page_file.read()
+    return json.loads(text)['parse']['text']['*'] if path.endswith(".json") else text
+
+def old_sentences(html):
+    # The preprocessing of fetched pages before article_text
+    return split_sentences(BeautifulSoup(html, 'html.parser').text)
+
+def fast_sentences(pageid, html):
+    return cached_sentences(wikipedia_document(pageid, {'parse': {'revid': 1, 'text': {'*': html}}}))
+
+def timed(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return result, (time.perf_counter() - start) / repeat
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", nargs="+", default=DEFAULT_PAGES)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"parser: {'lxml' if article_text.lxml is not None else 'html.parser'}")
+    split_sentences("Load the tokenizer. Before timing.")
+    totals = [0.0, 0.0, 0.0]
+    for pageid, path in enumerate(args.pages):
+        html = read_page(path)
+        old, old_time = timed(lambda: old_sentences(html), args.repeat)
+        # Every fast run starts from an empty cache, then the last one's sentences are looked up again
+        def fast():
+            fact_verification.sentence_cache = fact_verification.MemoryTier(fact_verification.SENTENCE_CACHE_ENTRIES)
+            return fast_sentences(pageid, html)
+        fast, fast_time = timed(fast, args.repeat)
+        cached, cached_time = timed(lambda: fast_sentences(pageid, html), args.repeat)
+        assert cached == fast
+        totals = [totals[0] + old_time, totals[1] + fast_time, totals[2] + cached_time]
+        print(f"{os.path.basename(path):<32} {len(html) / 1024:7.1f}KB  "
+              f"old {old_time * 1000:7.2f}ms {len(old):5d} sentences {sum(map(len, old)):7d} chars  "
+              f"fast {fast_time * 1000:7.2f}ms {len(fast):5d} sentences {sum(map(len, fast)):7d} chars  x{old_time / fast_time:4.1f}  "
+              f"cached {cached_time * 1000:6.3f}ms")
+    if len(args.pages) > 1:
+        print(f"{'total':<32} old {totals[0] * 1000:7.2f}ms  fast {totals[1] * 1000:7.2f}ms  x{totals[0] / totals[1]:4.1f}  "
+              f"cached {totals[2] * 1000:6.3f}ms")
+
+if __name__ == "__main__":
+    main()
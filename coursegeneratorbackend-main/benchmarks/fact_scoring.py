@@ -0,0 +1,72 @@
+"""Compares the per-sentence scoring loop with the batched scoring engine on a saved article.
+
+Run from the backend directory:
+    python -m benchmarks.fact_scoring
+    python -m benchmarks.fact_scoring --article benchmarks/data/thread_computing.txt --batch-sizes 16 32 64 128
+"""
+import argparse
+import os
+import time
+
+from sentence_transformers import util
+from fact_verification import encode_sentences, score_sentences, sentence_model, split_sentences
+
+DEFAULT_ARTICLE = os.path.join(os.path.dirname(__file__), "data", "thread_computing.txt")
+
+FACTS = [
+    "A thread is the smallest sequence of programmed instructions that can be managed independently by a scheduler.",
+    "Threads of the same process share the same address space.",
+    "Intel added hyper-threading support to the Pentium 4 processor in 2002.",
+    "CPython cannot execute threads in parallel because of the global interpreter lock.",
+]
+
+# The scoring loop analyze_fact_results used before batching, kept here as the reference
+def score_sentences_loop(fact_embedding, sentences):
+    best_similarity = 0
+    best_index = None
+    model = sentence_model.get()
+    for index, sentence in enumerate(sentences):
+        sentence_embedding = model.encode(sentence, convert_to_tensor=True)
+        similarity = util.pytorch_cos_sim(fact_embedding, sentence_embedding).item()
+        if similarity > best_similarity:
+            best_similarity = similarity
+            best_index = index
+    return best_similarity, best_index
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--article", default=DEFAULT_ARTICLE)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[16, 32, 64, 128])
+    args = parser.parse_args()
+
+    with open(args.article, "r", encoding="utf-8") as article_file:
+        sentences = split_sentences(article_file.read())
+    print(f"{len(sentences)} sentences, {len(FACTS)} facts")
+
+    # Warm the model so the first measurement does not include lazy initialisation
+    model = sentence_model.get()
+    model.encode(sentences[:8], convert_to_tensor=True)
+
+    reference = []
+    start = time.perf_counter()
+    for fact in FACTS:
+        fact_embedding = model.encode(fact, convert_to_tensor=True)
+        reference.append(score_sentences_loop(fact_embedding, sentences))
+    loop_time = time.perf_counter() - start
+    print(f"loop:          {loop_time:8.3f}s")
+
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        results = []
+        for fact in FACTS:
+            fact_vector = encode_sentences([fact])[0]
+            results.append(score_sentences(fact_vector, sentences, batch_size)[0])
+        batched_time = time.perf_counter() - start
+
+        same_sentence = sum(index == ref_index for (_, index), (_, ref_index) in zip(results, reference))
+        max_delta = max(abs(score - ref_score) for (score, _), (ref_score, _) in zip(results, reference))
+        print(f"batch={batch_size:<4}    {batched_time:8.3f}s  speedup x{loop_time / batched_time:5.1f}  "
+              f"same best sentence {same_sentence}/{len(FACTS)}  max similarity delta {max_delta:.2e}")
+
+if __name__ == "__main__":
+    main()
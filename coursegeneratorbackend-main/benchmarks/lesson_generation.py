@@ -0,0 +1,71 @@
+"""Compares wall-clock time of sequential and parallel lesson generation against a simulated OpenAI client.
+
+Run from the backend directory:
+    python -m benchmarks.lesson_generation
+    python -m benchmarks.lesson_generation --lessons 12 --latency 0.5 --concurrency 8
+"""
+import argparse
+import ast
+import json
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+import server
+from course_examples import load_examples
+
+# Stand-in for the OpenAI client: sleeps for a fixed latency per call and returns well-formed content
+class SimulatedClient:
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        if kwargs.get('response_format'):
+            # One subtopic for each of the plan's subtopics listed in the topic prompt
+            planned = re.search(r"\* Subtopics: (\[.*\])", kwargs['messages'][-1]['content'])
+            subtopics = [{"title": title, "content": "Content."} for title in ast.literal_eval(planned.group(1))] if planned else []
+            content = json.dumps({"title": "Topic", "content": "Content.", "subtopics": subtopics})
+        else:
+            content = "Summary."
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+def load_course_plan(lessons):
+    return {"course": load_examples()[0]["course"][:lessons]}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lessons", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per simulated LLM call")
+    parser.add_argument("--concurrency", type=int, default=server.LLM_MAX_CONCURRENCY)
+    args = parser.parse_args()
+
+    topics = sum(len(lesson["topics"]) for lesson in load_course_plan(args.lessons)["course"])
+    print(f"{args.lessons} lessons, {topics} topics, {args.latency}s per call")
+
+    runs = [
+        ("sequential", lambda plan: server.generate_course_sequential(plan)),
+        (f"parallel x{args.concurrency}", lambda plan: server.generate_course_parallel(plan, max_concurrency=args.concurrency)),
+    ]
+    # Every run must reach the simulated client, not answer repeated prompts from the response cache
+    server.llm_cache = None
+    timings = {}
+    for name, generate in runs:
+        server.client = SimulatedClient(args.latency)
+        server.llm_usage.clear()
+        start = time.perf_counter()
+        generate(load_course_plan(args.lessons))
+        timings[name] = time.perf_counter() - start
+        prompt_tokens = sum(usage["prompt_tokens"] for usage in server.llm_usage.values())
+        print(f"{name:<16} {timings[name]:8.2f}s  {server.client.calls} calls  ~{prompt_tokens} prompt tokens")
+    sequential, parallel = timings.values()
+    print(f"speedup x{sequential / parallel:.1f}")
+
+if __name__ == "__main__":
+    main()
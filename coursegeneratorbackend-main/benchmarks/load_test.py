@@ -0,0 +1,167 @@
+"""Load test of the shorten/expand/regenerate endpoints against a local mock of the OpenAI API.
+
+Starts the mock API and the backend (the ASGI app in async_server.py under hypercorn, or
+the Flask app), fires --requests requests with --concurrency in flight and reports
+throughput, latency and time-to-first-byte percentiles and errors; with --stream the
+requests ask for token streaming, so the first byte is the first token. Requests bypass
+the response cache, so every one of them costs a call to the mock. Run from the backend directory:
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test --server flask --requests 400 --concurrency 200 --latency 1.0
+    python -m benchmarks.load_test --stream --latency 10
+    python -m benchmarks.load_test --url http://127.0.0.1:5000   # a backend that is already running
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+import httpx
+
+from benchmarks import mock_openai
+
+ENDPOINTS = ["/shorten_topic", "/expand_topic", "/regenerate_topic"]
+CONTENT = ("A thread is the smallest sequence of programmed instructions that can be managed "
+           "independently by a scheduler. Threads of one process share its address space. ") * 4
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_backend(kind, port, mock_url, **extra_env):
+    env = dict(os.environ, OPENAI_BASE_URL=mock_url, API_KEY=os.environ.get("API_KEY", "mock"),
+               LLM_CACHE_DIR="", WARM_UP_MODELS="0", VERIFICATION_WORKERS="0", **extra_env)
+    if kind == "async":
+        command = [sys.executable, "-m", "hypercorn", "async_server:app", "--bind", f"127.0.0.1:{port}"]
+    else:
+        command = [sys.executable, "-m", "flask", "--app", "server", "run", "--port", str(port), "--with-threads"]
+    return subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+async def wait_until_up(client, url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            await client.get(f"{url}/token_usage")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Backend at {url} did not come up within {timeout}s")
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+async def post_json(reader, writer, host, path, body):
+    """Sends one request on an open connection; returns the status and headers of the response."""
+    data = json.dumps(body).encode()
+    writer.write(f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(data)}\r\n\r\n".encode('latin-1') + data)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while (line := await reader.readline()) not in (b'\r\n', b''):
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return status, headers
+
+async def read_body(reader, headers):
+    """Yields the response body in pieces as they arrive."""
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while size := int((await reader.readline()).split(b';')[0], 16):
+            yield await reader.readexactly(size)
+            await reader.readline()
+        await reader.readline()
+    elif 'content-length' in headers:
+        yield await reader.readexactly(int(headers['content-length']))
+    else:
+        while data := await reader.read(65536):
+            yield data
+
+async def run_load(url, requests, concurrency, stream=False):
+    async with httpx.AsyncClient() as client:
+        await wait_until_up(client, url)
+    address = urlsplit(url)
+    latencies = []
+    first_byte = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    # Each simulated user sends its requests one after another over its own connection.
+    # Plain asyncio streams rather than an httpx pool: managing a pool of hundreds of
+    # connections costs the load generator more CPU than the backend spends serving them.
+    async def user():
+        nonlocal errors
+        connection = None
+        for index in remaining:
+            start = time.perf_counter()
+            first_piece = None
+            try:
+                if connection is None:
+                    connection = await asyncio.open_connection(address.hostname, address.port)
+                status, headers = await post_json(*connection, address.netloc, ENDPOINTS[index % len(ENDPOINTS)],
+                                                  {"content": CONTENT, "bypass_cache": True, "stream": stream})
+                async for _ in read_body(connection[0], headers):
+                    first_piece = first_piece or time.perf_counter() - start
+                # A body without length or chunked framing ends when the server closes the connection
+                framed = 'content-length' in headers or headers.get('transfer-encoding', '').lower() == 'chunked'
+                keep_alive = framed and headers.get('connection', '').lower() != 'close'
+            except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+                status, keep_alive = None, False
+            if not keep_alive and connection is not None:
+                connection[1].close()
+                connection = None
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+                first_byte.append(first_piece)
+            else:
+                errors += 1
+        if connection is not None:
+            connection[1].close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return time.perf_counter() - start, latencies, first_byte, errors
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--server", choices=["async", "flask"], default="async")
+    parser.add_argument("--url", help="load an already running backend instead of starting one")
+    parser.add_argument("--requests", type=int, default=600)
+    parser.add_argument("--concurrency", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=1.0, help="seconds per mock completion")
+    parser.add_argument("--stream", action="store_true", help="request token streaming (NDJSON) responses")
+    args = parser.parse_args()
+
+    mock = backend = None
+    url = args.url
+    if url is None:
+        mock = mock_openai.start(args.latency)
+        port = free_port()
+        backend = start_backend(args.server, port, mock.base_url)
+        url = f"http://127.0.0.1:{port}"
+    try:
+        elapsed, latencies, first_byte, errors = asyncio.run(run_load(url, args.requests, args.concurrency, args.stream))
+    finally:
+        if backend is not None:
+            backend.terminate()
+            backend.wait()
+        if mock is not None:
+            mock.shutdown()
+
+    print(f"{args.url or args.server}: {args.requests} {'streaming ' if args.stream else ''}requests, "
+          f"{args.concurrency} concurrent, {args.latency}s mock latency")
+    print(f"throughput {len(latencies) / elapsed:8.1f} req/s  errors {errors}")
+    if latencies:
+        print(f"latency p50 {percentile(latencies, 0.5) * 1000:8.0f}ms  p95 {percentile(latencies, 0.95) * 1000:8.0f}ms  "
+              f"max {max(latencies) * 1000:8.0f}ms")
+        print(f"first byte  p50 {percentile(first_byte, 0.5) * 1000:8.0f}ms  p95 {percentile(first_byte, 0.95) * 1000:8.0f}ms")
+    if mock is not None:
+        print(f"mock API calls {mock.requests}")
+
+if __name__ == "__main__":
+    main()
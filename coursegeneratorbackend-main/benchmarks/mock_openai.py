@@ -0,0 +1,155 @@
+"""Local stand-in for the OpenAI chat completions API, for load tests without network access or API costs.
+
+Every request is answered after a fixed latency with well-formed content: JSON matching
+the lesson format when response_format asks for a JSON object, plain text otherwise.
+With "stream": true the content is sent as server-sent events, one word per chunk,
+spread evenly over the latency.
+It runs on asyncio, so hundreds of open connections cost no threads. Point the backend
+at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1. Run standalone:
+    python -m benchmarks.mock_openai --port 8100 --latency 1.0
+"""
+import argparse
+import asyncio
+import http
+import json
+import threading
+import time
+
+def completion_content(request):
+    if (request.get('response_format') or {}).get('type') == 'json_object':
+        return json.dumps({"title": "Topic", "content": "Content.", "subtopics": []})
+    return "Lorem ipsum dolor sit amet, consectetur adipiscing elit."
+
+def usage(request, content):
+    prompt_tokens = sum(len(message.get('content', '')) for message in request.get('messages', [])) // 4
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4,
+            "total_tokens": prompt_tokens + len(content) // 4}
+
+def completion(request, content=None, token_usage=None):
+    content = completion_content(request) if content is None else content
+    return {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get('model', 'mock'),
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": content}}],
+        "usage": token_usage or usage(request, content),
+    }
+
+def completion_chunks(request, content=None, token_usage=None):
+    """The chunks of a streamed completion, the usage-only chunk last when the request asks for it."""
+    content = completion_content(request) if content is None else content
+    words = content.split(' ')
+    pieces = [word if index == 0 else ' ' + word for index, word in enumerate(words)]
+    chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+             "model": request.get('model', 'mock')}
+    for index, piece in enumerate(pieces):
+        delta = {"role": "assistant", "content": piece} if index == 0 else {"content": piece}
+        finish_reason = "stop" if index == len(pieces) - 1 else None
+        yield dict(chunk, choices=[{"index": 0, "delta": delta, "finish_reason": finish_reason}])
+    if (request.get('stream_options') or {}).get('include_usage'):
+        yield dict(chunk, choices=[], usage=token_usage or usage(request, content))
+
+async def read_request(reader):
+    """Method, path, headers (lower-cased names) and body of the next HTTP/1.1 request on the connection, or None once it is closed."""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return method, path, headers, await reader.readexactly(int(headers.get('content-length', 0)))
+
+def write_event_stream_head(writer):
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+
+def write_event(writer, data):
+    event = f"data: {data}\n\n".encode()
+    writer.write(f"{len(event):x}\r\n".encode('latin-1') + event + b"\r\n")
+
+def write_response(writer, status, body):
+    data = json.dumps(body).encode()
+    writer.write(f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(data)}\r\n\r\n".encode('latin-1') + data)
+
+async def write_stream(writer, chunks, latency):
+    """Sends the chunks as a server-sent event stream, spread evenly over latency seconds."""
+    write_event_stream_head(writer)
+    for chunk in chunks:
+        await asyncio.sleep(latency / len(chunks))
+        write_event(writer, json.dumps(chunk))
+        await writer.drain()
+    write_event(writer, "[DONE]")
+    writer.write(b"0\r\n\r\n")
+
+class MockOpenAI:
+    def __init__(self, latency):
+        self.latency = latency
+        self.requests = 0
+
+    async def handle(self, reader, writer):
+        try:
+            while (received := await read_request(reader)) is not None:
+                method, path, _, body = received
+                if method != 'POST' or not path.endswith('/chat/completions'):
+                    write_response(writer, 404, {"error": {"message": f"Unknown path {path}"}})
+                    await writer.drain()
+                    continue
+                self.requests += 1
+                request = json.loads(body or b"{}")
+                if request.get('stream'):
+                    await write_stream(writer, list(completion_chunks(request)), self.latency)
+                else:
+                    await asyncio.sleep(self.latency)
+                    write_response(writer, 200, completion(request))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, port=0, started=None):
+        server = await asyncio.start_server(self.handle, '127.0.0.1', port, backlog=1024)
+        self.port = server.sockets[0].getsockname()[1]
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        if started is not None:
+            started.set()
+        async with server:
+            await self.stopped.wait()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def shutdown(self):
+        self.loop.call_soon_threadsafe(self.stopped.set)
+
+def start(latency=0.5, port=0):
+    """Serves on its own event loop in a background thread; see .base_url and .shutdown()."""
+    mock = MockOpenAI(latency)
+    started = threading.Event()
+    threading.Thread(target=asyncio.run, args=(mock.serve(port, started),), daemon=True).start()
+    started.wait()
+    return mock
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=1.0, help="seconds per completion")
+    args = parser.parse_args()
+
+    print(f"Mock OpenAI API on http://127.0.0.1:{args.port}/v1, {args.latency}s per completion")
+    try:
+        asyncio.run(MockOpenAI(args.latency).serve(args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
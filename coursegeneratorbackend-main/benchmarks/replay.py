@@ -0,0 +1,247 @@
+"""Record-and-replay stand-in for the OpenAI chat completions API and the Wikipedia/Wikidata APIs.
+
+With --record every request is forwarded to the real API once, and the response is appended
+to a fixtures file (JSON lines) together with the latency it took. Without it the recorded
+responses are served again after their recorded latency (times --latency-scale), streamed
+when the request asks for streaming, so benchmarks cost no API money and need no network.
+A request that was never recorded gets a synthetic answer of the right shape instead
+(a course plan from courseplan_examples.json, a topic with its planned subtopics, facts,
+plain text, the saved article for every Wikipedia page) and is counted as synthetic.
+Point the backend at it with
+    OPENAI_BASE_URL=http://127.0.0.1:<port>/v1
+    WIKIPEDIA_API_URL=http://127.0.0.1:<port>/wikipedia/w/api.php
+    WIKIDATA_API_URL=http://127.0.0.1:<port>/wikidata/w/api.php
+Run standalone from the backend directory:
+    python -m benchmarks.replay --port 8100
+    python -m benchmarks.replay --port 8100 --record   # forwards to the real APIs
+"""
+import argparse
+import ast
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+from urllib.parse import parse_qsl, urlsplit
+
+import httpx
+
+from benchmarks import mock_openai
+from benchmarks.verification_workers import DEFAULT_ARTICLE, article_html, stub_response
+from course_examples import load_examples
+from llm_cache import cache_key
+
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "replay.jsonl")
+UPSTREAMS = {
+    'openai': "https://api.openai.com/v1",
+    'wikipedia': "https://en.wikipedia.org/w/api.php",
+    'wikidata': "https://www.wikidata.org/w/api.php",
+}
+# Latency of synthetic answers: time to the first token plus generation at a typical gpt-4o rate,
+# and one MediaWiki API round-trip
+SYNTHETIC_FIRST_TOKEN_SECONDS = 0.4
+SYNTHETIC_TOKENS_PER_SECOND = 80
+SYNTHETIC_MEDIAWIKI_SECONDS = 0.1
+
+FILLER = ("A thread is the smallest sequence of programmed instructions that can be managed independently "
+          "by a scheduler, which is typically a part of the operating system. ")
+
+def request_key(request):
+    """Recording key of a chat completion request; streamed and plain requests share their recording."""
+    return cache_key(**{name: value for name, value in request.items() if name not in ('stream', 'stream_options')})
+
+def mediawiki_key(query):
+    return json.dumps(sorted(query.items()))
+
+def synthetic_content(request, examples):
+    messages = request.get('messages', [])
+    prompt = "\n".join(message.get('content', '') for message in messages)
+    if (request.get('response_format') or {}).get('type') != 'json_object':
+        return " ".join([FILLER] * 4).strip()
+    if '"learningObjectives"' in prompt:
+        return json.dumps({"course": examples[0]["course"]})
+    if '"facts"' in prompt:
+        # Quoted sentences of the lesson in the user message
+        sentences = re.findall(r"['\"]([^'\"]{40,})['\"]", messages[-1].get('content', ''))
+        return json.dumps({"facts": sentences[:5]})
+    planned = re.search(r"\* Subtopics: (\[.*\])", messages[-1].get('content', ''))
+    subtopics = [{"title": title, "content": FILLER * 3} for title in ast.literal_eval(planned.group(1))] if planned else []
+    return json.dumps({"title": "Topic", "content": FILLER * 4, "subtopics": subtopics})
+
+# Recorded responses, {(service, key): entry}; new recordings are appended to the file
+class Fixtures:
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as fixtures_file:
+                for line in fixtures_file:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[(entry['service'], entry['key'])] = entry
+
+    def get(self, service, key):
+        return self.entries.get((service, key))
+
+    def add(self, entry):
+        with self._lock:
+            self.entries[(entry['service'], entry['key'])] = entry
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as fixtures_file:
+                fixtures_file.write(json.dumps(entry) + "\n")
+
+    def __len__(self):
+        return len(self.entries)
+
+class ReplayServer:
+    def __init__(self, fixtures, record=False, latency_scale=1.0, article_path=DEFAULT_ARTICLE):
+        self.fixtures = fixtures
+        self.record = record
+        self.latency_scale = latency_scale
+        self.examples = load_examples()
+        with open(article_path, "r", encoding="utf-8") as article_file:
+            self.html = article_html(article_file.read())
+        # {(service, "replayed" | "recorded" | "synthetic" | "failed"): responses}
+        self.stats = Counter()
+        self.http = None
+
+    async def handle(self, reader, writer):
+        try:
+            while (received := await mock_openai.read_request(reader)) is not None:
+                method, path, headers, body = received
+                address = urlsplit(path)
+                service = address.path.strip('/').split('/')[0]
+                if method == 'POST' and address.path.endswith('/chat/completions'):
+                    await self.chat(writer, json.loads(body or b"{}"), headers)
+                elif method == 'GET' and service in ('wikipedia', 'wikidata'):
+                    await self.mediawiki(writer, service, dict(parse_qsl(address.query)), headers)
+                else:
+                    mock_openai.write_response(writer, 404, {"error": {"message": f"Unknown path {path}"}})
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def chat(self, writer, request, headers):
+        key = request_key(request)
+        entry = self.fixtures.get('openai', key)
+        if entry is not None:
+            self.stats['openai', 'replayed'] += 1
+            delay = entry['latency'] * self.latency_scale
+        elif self.record:
+            # The upstream call already took its time
+            entry, delay = await self.forward_chat(writer, request, key, headers), 0
+            if entry is None:
+                return
+        else:
+            self.stats['openai', 'synthetic'] += 1
+            content = synthetic_content(request, self.examples)
+            entry = {'response': mock_openai.completion(request, content)}
+            tokens = entry['response']['usage']['completion_tokens']
+            delay = (SYNTHETIC_FIRST_TOKEN_SECONDS + tokens / SYNTHETIC_TOKENS_PER_SECOND) * self.latency_scale
+
+        content = entry['response']['choices'][0]['message']['content']
+        token_usage = entry['response'].get('usage')
+        if request.get('stream'):
+            await mock_openai.write_stream(writer, list(mock_openai.completion_chunks(request, content, token_usage)), delay)
+        else:
+            await asyncio.sleep(delay)
+            mock_openai.write_response(writer, 200, mock_openai.completion(request, content, token_usage))
+
+    async def forward_chat(self, writer, request, key, headers):
+        """Records the upstream answer to a request; errors are passed through and not recorded."""
+        # Streamed requests are recorded as plain ones and streamed from the recording
+        forwarded = {name: value for name, value in request.items() if name not in ('stream', 'stream_options')}
+        start = time.perf_counter()
+        response = await self.http.post(f"{UPSTREAMS['openai']}/chat/completions", json=forwarded,
+                                        headers={'Authorization': headers.get('authorization', '')})
+        if response.status_code != 200:
+            self.stats['openai', 'failed'] += 1
+            mock_openai.write_response(writer, response.status_code, response.json())
+            return None
+        entry = {'service': 'openai', 'key': key, 'latency': round(time.perf_counter() - start, 3),
+                 'request': {'model': request.get('model'), 'messages': request.get('messages')},
+                 'response': response.json()}
+        self.fixtures.add(entry)
+        self.stats['openai', 'recorded'] += 1
+        return entry
+
+    async def mediawiki(self, writer, service, query, headers):
+        key = mediawiki_key(query)
+        entry = self.fixtures.get(service, key)
+        if entry is not None:
+            self.stats[service, 'replayed'] += 1
+            await asyncio.sleep(entry['latency'] * self.latency_scale)
+            body = entry['response']
+        elif self.record:
+            start = time.perf_counter()
+            response = await self.http.get(UPSTREAMS[service], params=query,
+                                           headers={'User-Agent': headers.get('user-agent', 'coursegenerator-benchmark/1.0')})
+            if response.status_code != 200:
+                self.stats[service, 'failed'] += 1
+                mock_openai.write_response(writer, response.status_code, {})
+                return
+            body = response.json()
+            self.fixtures.add({'service': service, 'key': key, 'latency': round(time.perf_counter() - start, 3), 'response': body})
+            self.stats[service, 'recorded'] += 1
+        else:
+            self.stats[service, 'synthetic'] += 1
+            await asyncio.sleep(SYNTHETIC_MEDIAWIKI_SECONDS * self.latency_scale)
+            body = stub_response(query, self.html)
+        mock_openai.write_response(writer, 200, body)
+
+    async def serve(self, port=0, started=None):
+        server = await asyncio.start_server(self.handle, '127.0.0.1', port, backlog=1024)
+        self.port = server.sockets[0].getsockname()[1]
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        self.http = httpx.AsyncClient(timeout=600) if self.record else None
+        if started is not None:
+            started.set()
+        try:
+            async with server:
+                await self.stopped.wait()
+        finally:
+            if self.http is not None:
+                await self.http.aclose()
+
+    def backend_env(self):
+        """Environment pointing the backend at this server."""
+        url = f"http://127.0.0.1:{self.port}"
+        return {'OPENAI_BASE_URL': f"{url}/v1", 'WIKIPEDIA_API_URL': f"{url}/wikipedia/w/api.php",
+                'WIKIDATA_API_URL': f"{url}/wikidata/w/api.php"}
+
+    def shutdown(self):
+        self.loop.call_soon_threadsafe(self.stopped.set)
+
+def start(fixtures_path=DEFAULT_FIXTURES, record=False, latency_scale=1.0, port=0):
+    """Serves on its own event loop in a background thread; see .backend_env(), .stats and .shutdown()."""
+    replay = ReplayServer(Fixtures(fixtures_path), record, latency_scale)
+    started = threading.Event()
+    threading.Thread(target=asyncio.run, args=(replay.serve(port, started),), daemon=True).start()
+    started.wait()
+    return replay
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES)
+    parser.add_argument("--record", action="store_true", help="forward unrecorded requests to the real APIs and record them")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiplier of the recorded latencies")
+    args = parser.parse_args()
+
+    replay = ReplayServer(Fixtures(args.fixtures), args.record, args.latency_scale)
+    print(f"{'Recording' if args.record else 'Replaying'} {len(replay.fixtures)} fixtures from {args.fixtures} "
+          f"on http://127.0.0.1:{args.port}")
+    try:
+        asyncio.run(replay.serve(args.port))
+    except KeyboardInterrupt:
+        pass
+    print(dict(replay.stats))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Measures server startup time and first-request latency of fact scoring, with lazy and warmed-up models.
+
+Every scenario runs in a fresh Python process. Run from the backend directory:
+    python -m benchmarks.startup
+    python -m benchmarks.startup --runs 3
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+FACT = "A thread is the smallest sequence of programmed instructions that can be managed independently by a scheduler."
+ARTICLE = "benchmarks/data/thread_computing.txt"
+
+def child(scenario):
+    start = time.perf_counter()
+    import server
+    import fact_verification
+    timings = {'import': time.perf_counter() - start}
+    if scenario == 'warm':
+        start = time.perf_counter()
+        fact_verification.warm_up()
+        timings['warm_up'] = time.perf_counter() - start
+    with open(ARTICLE, "r", encoding="utf-8") as article_file:
+        text = article_file.read()
+    for name in ('first_request', 'second_request'):
+        start = time.perf_counter()
+        sentences = fact_verification.split_sentences(text)
+        fact_vector = fact_verification.encode_sentences([FACT])[0]
+        fact_verification.score_sentences(fact_vector, sentences)
+        fact_verification.named_entity_recognition(FACT)
+        timings[name] = time.perf_counter() - start
+    print(json.dumps(timings))
+
+def run(scenario):
+    output = subprocess.run([sys.executable, "-m", "benchmarks.startup", "--child", scenario],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--child", choices=["lazy", "warm"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child)
+        return
+
+    for scenario in ("lazy", "warm"):
+        runs = [run(scenario) for _ in range(args.runs)]
+        averages = {key: sum(timings[key] for timings in runs) / len(runs) for key in runs[0]}
+        print(f"{scenario:<5} " + "  ".join(f"{key} {seconds:7.3f}s" for key, seconds in averages.items()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""Offline benchmark suite: scripted workloads against the backend with recorded OpenAI and Wikipedia responses.
+
+Starts the record-and-replay stand-in (benchmarks/replay.py) and the backend, then runs the
+workloads one after another: /generate_course_plan and /generate_lessons (sequential and
+parallel) for the courses of courseplan_examples.json, the shorten/expand/regenerate
+endpoints and /fact_checking. Reports per workload the p50/p95 latency, throughput, errors,
+LLM tokens and the peak memory of the backend process. The backend's response cache is
+off, so every LLM call reaches the stand-in. Run from the backend directory:
+    python -m benchmarks.suite --record          # once, with a real API_KEY: records the fixtures
+    python -m benchmarks.suite                   # replays them
+    python -m benchmarks.suite --workloads edits fact_checking --server async --json results.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+
+import httpx
+
+from benchmarks import replay
+from benchmarks.load_test import free_port, percentile, start_backend, wait_until_up
+from course_examples import example_description, load_examples
+
+WORKLOADS = ("course_plan", "lessons_sequential", "lessons_parallel", "edits", "fact_checking")
+EDIT_ENDPOINTS = ("/shorten_topic", "/expand_topic", "/regenerate_topic")
+
+def course_plan_requests(examples, args):
+    for example in examples:
+        yield "/generate_course_plan", {
+            "course_name": example["Course_title"],
+            "course_description": example_description(example),
+            "prerequisites": example["Prerequisites"],
+            "number_of_lessons": str(len(example["course"])),
+        }
+
+def lesson_requests(generation_mode):
+    def requests(examples, args):
+        for example in examples:
+            yield "/generate_lessons", {"course_plan": {"course": example["course"][:args.lessons]},
+                                        "generation_mode": generation_mode}
+    return requests
+
+def edit_requests(examples, args):
+    # Each edit works on the descriptions of one lesson's topics, cycling through the endpoints
+    lessons = itertools.cycle([lesson for example in examples for lesson in example["course"]])
+    for index, lesson in zip(range(args.edits), lessons):
+        content = " ".join(topic["description"] for topic in lesson["topics"])
+        yield EDIT_ENDPOINTS[index % len(EDIT_ENDPOINTS)], {"content": content}
+
+def fact_checking_requests(examples, args):
+    for example in examples:
+        for lesson in example["course"][:args.lessons]:
+            yield "/fact_checking", lesson
+
+WORKLOAD_REQUESTS = {
+    "course_plan": course_plan_requests,
+    "lessons_sequential": lesson_requests("sequential"),
+    "lessons_parallel": lesson_requests("parallel"),
+    "edits": edit_requests,
+    "fact_checking": fact_checking_requests,
+}
+
+# Peak resident memory of the backend from /proc (Linux); clearing the high-water mark
+# before each workload makes the peak that workload's own
+def reset_peak_memory(pid):
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+
+def peak_memory_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status", "r") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def total_tokens(usage):
+    return sum(counts["prompt_tokens"] + counts["completion_tokens"] for counts in usage.values())
+
+def cached_prompt_tokens(usage):
+    return sum(counts.get("cached_prompt_tokens", 0) for counts in usage.values())
+
+async def run_workload(client, url, requests, concurrency):
+    """Sends the requests with at most concurrency in flight; returns wall time, latencies of the successful ones and errors."""
+    latencies = []
+    errors = 0
+    remaining = iter(requests)
+
+    async def user():
+        nonlocal errors
+        for path, body in remaining:
+            start = time.perf_counter()
+            try:
+                response = await client.post(f"{url}{path}", json=body)
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return time.perf_counter() - start, latencies, errors
+
+async def run_suite(url, pid, workloads, examples, args):
+    results = []
+    async with httpx.AsyncClient(timeout=None) as client:
+        await wait_until_up(client, url)
+        for name in workloads:
+            requests = list(WORKLOAD_REQUESTS[name](examples, args))
+            usage_before = (await client.get(f"{url}/token_usage")).json()
+            reset_peak_memory(pid)
+            elapsed, latencies, errors = await run_workload(client, url, requests, args.concurrency)
+            usage = (await client.get(f"{url}/token_usage")).json()
+            results.append({
+                "workload": name,
+                "requests": len(requests),
+                "errors": errors,
+                "p50_seconds": round(percentile(latencies, 0.5), 3) if latencies else None,
+                "p95_seconds": round(percentile(latencies, 0.95), 3) if latencies else None,
+                "requests_per_second": round(len(latencies) / elapsed, 3),
+                "tokens": total_tokens(usage) - total_tokens(usage_before),
+                # Prompt tokens the API reported as served from its prompt cache (recorded responses only)
+                "cached_prompt_tokens": cached_prompt_tokens(usage) - cached_prompt_tokens(usage_before),
+                "peak_memory_mb": peak_memory_mb(pid),
+            })
+            print(format_result(results[-1]), flush=True)
+    return results
+
+def format_result(result):
+    def seconds(value):
+        return f"{value:8.2f}s" if value is not None else f"{'-':>9}"
+    memory = f"{result['peak_memory_mb']:8.0f}MB" if result['peak_memory_mb'] is not None else f"{'-':>10}"
+    return (f"{result['workload']:<20} {result['requests']:>5} {result['errors']:>6} {seconds(result['p50_seconds'])} "
+            f"{seconds(result['p95_seconds'])} {result['requests_per_second']:>8.2f} {result['tokens']:>9} "
+            f"{result['cached_prompt_tokens']:>9} {memory}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workloads", nargs="+", choices=WORKLOADS, default=list(WORKLOADS))
+    parser.add_argument("--server", choices=["flask", "async"], default="flask")
+    parser.add_argument("--record", action="store_true", help="forward unrecorded requests to the real APIs and record them")
+    parser.add_argument("--fixtures", default=replay.DEFAULT_FIXTURES)
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiplier of the recorded latencies")
+    parser.add_argument("--lessons", type=int, default=2, help="lessons per course for lesson generation and fact checking")
+    parser.add_argument("--edits", type=int, default=30, help="requests of the edits workload")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    examples = load_examples()
+    stand_in = replay.start(args.fixtures, args.record, args.latency_scale)
+    port = free_port()
+    # Every run embeds its evidence pages and sends every LLM call to the stand-in
+    env = dict(stand_in.backend_env(), LLM_CACHE_MEMORY_ENTRIES="0", EMBEDDING_CACHE_DIR="")
+    backend = start_backend(args.server, port, env.pop('OPENAI_BASE_URL'), **env)
+    print(f"{args.server} backend, {len(stand_in.fixtures)} recorded responses from {args.fixtures}"
+          f"{' (recording)' if args.record else ''}, {args.concurrency} concurrent requests")
+    print(f"{'workload':<20} {'reqs':>5} {'errors':>6} {'p50':>9} {'p95':>9} {'req/s':>8} {'tokens':>9} {'cached':>9} {'peak mem':>10}")
+    try:
+        results = asyncio.run(run_suite(f"http://127.0.0.1:{port}", backend.pid, args.workloads, examples, args))
+    finally:
+        backend.terminate()
+        backend.wait()
+        stand_in.shutdown()
+
+    stats = {f"{service} {outcome}": count for (service, outcome), count in sorted(stand_in.stats.items())}
+    print("responses: " + ", ".join(f"{count} {name}" for name, count in stats.items()))
+    if stats.get("openai synthetic") and not args.record:
+        print("Some responses were synthetic; record them with --record for realistic content and latency")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as results_file:
+            json.dump({"server": args.server, "concurrency": args.concurrency, "latency_scale": args.latency_scale,
+                       "workloads": results, "responses": stats}, results_file, indent=2)
+
+if __name__ == "__main__":
+    main()
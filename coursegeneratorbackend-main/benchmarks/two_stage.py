@@ -0,0 +1,76 @@
+"""Recall@1 and latency of two-stage scoring (first-stage pre-filter + transformer re-rank) against full scoring.
+
+For each fact the saved article is treated as a freshly fetched page: full scoring embeds
+every sentence, two-stage scoring embeds only the first-stage candidates. Recall@1 counts
+facts whose best sentence is unchanged; status agreement compares verified/moderate/unverified.
+Run from the backend directory:
+    python -m benchmarks.two_stage
+    python -m benchmarks.two_stage --depths 4 8 16 32 64 --first-stages bm25 minilm
+"""
+import argparse
+import os
+import time
+
+from fact_verification import (encode_sentences, fact_status, first_stage_candidates, rank_sentences,
+                               sentence_model, split_sentences)
+
+DEFAULT_ARTICLE = os.path.join(os.path.dirname(__file__), "data", "thread_computing.txt")
+
+# Facts stated in the article, paraphrased ones and ones the article does not support
+FACTS = [
+    "A thread is the smallest sequence of programmed instructions that can be managed independently by a scheduler.",
+    "Threads of the same process share the same address space.",
+    "Intel added hyper-threading support to the Pentium 4 processor in 2002.",
+    "CPython cannot execute threads in parallel because of the global interpreter lock.",
+    "Switching between threads of one process is cheaper than switching between processes.",
+    "Fibers are scheduled cooperatively and must yield to let another fiber run.",
+    "Each thread has its own stack and registers.",
+    "Processes are heavyweight units of kernel scheduling.",
+    "A race condition can occur when threads update shared data without synchronization.",
+    "The kernel does not know about user threads.",
+    "Mutexes and semaphores are used to coordinate access to shared resources.",
+    "Multithreading on a single processor is implemented by time slicing.",
+    "The Eiffel Tower was completed in 1889.",
+    "Photosynthesis converts light energy into chemical energy.",
+]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--article", default=DEFAULT_ARTICLE)
+    parser.add_argument("--depths", type=int, nargs="+", default=[4, 8, 16, 32, 64])
+    parser.add_argument("--first-stages", nargs="+", default=["bm25", "minilm"])
+    args = parser.parse_args()
+
+    with open(args.article, "r", encoding="utf-8") as article_file:
+        sentences = split_sentences(article_file.read())
+    print(f"{len(sentences)} sentences, {len(FACTS)} facts")
+
+    # Warm the model so the first measurement does not include lazy initialisation
+    sentence_model.get().encode(sentences[:8])
+    fact_vectors = encode_sentences(FACTS)
+
+    reference = []
+    start = time.perf_counter()
+    for fact_vector in fact_vectors:
+        similarity, index = rank_sentences(fact_vector, encode_sentences(sentences))[0]
+        reference.append((similarity, index))
+    full_latency = (time.perf_counter() - start) / len(FACTS)
+    print(f"{'full':<16} recall@1 1.00  status agreement 1.00  {full_latency * 1000:8.1f}ms/fact")
+
+    for first_stage in args.first_stages:
+        # Load the first-stage model outside the timed runs
+        first_stage_candidates(FACTS[:1], sentences, 1, first_stage)
+        for depth in args.depths:
+            same_sentence = same_status = 0
+            start = time.perf_counter()
+            for fact, fact_vector, (ref_similarity, ref_index) in zip(FACTS, fact_vectors, reference):
+                candidates = first_stage_candidates([fact], sentences, depth, first_stage)
+                similarity, position = rank_sentences(fact_vector, encode_sentences([sentences[index] for index in candidates]))[0]
+                same_sentence += candidates[position] == ref_index
+                same_status += fact_status(similarity) == fact_status(ref_similarity)
+            latency = (time.perf_counter() - start) / len(FACTS)
+            print(f"{first_stage + ' depth ' + str(depth):<16} recall@1 {same_sentence / len(FACTS):4.2f}  "
+                  f"status agreement {same_status / len(FACTS):4.2f}  {latency * 1000:8.1f}ms/fact  x{full_latency / latency:4.1f}")
+
+if __name__ == "__main__":
+    main()
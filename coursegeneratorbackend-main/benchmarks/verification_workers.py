@@ -0,0 +1,99 @@
+"""Measures fact-verification throughput (facts/sec) in-process and with 1..N worker processes.
+
+A local stub of the MediaWiki API serves the saved article as a distinct page for every
+fact, so each fact costs one page embedding and no network access is needed.
+Run from the backend directory:
+    python -m benchmarks.verification_workers
+    python -m benchmarks.verification_workers --facts 64 --workers 1 2 4 8
+"""
+import argparse
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+DEFAULT_ARTICLE = os.path.join(os.path.dirname(__file__), "data", "thread_computing.txt")
+
+def article_html(article):
+    return "".join(f"<p>{paragraph}</p>" for paragraph in article.split("\n\n"))
+
+def stub_response(query, html):
+    """MediaWiki API answer of the stub: every search finds a distinct page, every page is the article."""
+    action = query.get('action')
+    if action == 'query' and 'pageids' in query:
+        # The plaintext extract of the article, for WIKIPEDIA_TEXT_SOURCE=extracts
+        page = {'pageid': int(query['pageids']), 'extract': "\n".join(re.findall(r"<p>(.*?)</p>", html)), 'revisions': [{'revid': 1}]}
+        return {'query': {'pages': {query['pageids']: page}}}
+    if action == 'query':
+        return {'query': {'search': [{'pageid': zlib.crc32(query['srsearch'].encode())}]}}
+    if action == 'parse':
+        return {'parse': {'revid': 1, 'text': {'*': html}}}
+    return {'search': []}
+
+def stub_server(article):
+    html = article_html(article)
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            query = {key: values[0] for key, values in parse_qs(urlsplit(self.path).query).items()}
+            data = json.dumps(stub_response(query, html)).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--article", default=DEFAULT_ARTICLE)
+    parser.add_argument("--facts", type=int, default=32, help="at most the number of sentences in the article")
+    parser.add_argument("--workers", type=int, nargs="+", default=None, help="worker counts (default 1, 2, 4, ... up to the core count)")
+    args = parser.parse_args()
+
+    with open(args.article, "r", encoding="utf-8") as article_file:
+        article = article_file.read()
+    server = stub_server(article)
+    os.environ['WIKIPEDIA_API_URL'] = os.environ['WIKIDATA_API_URL'] = f"http://127.0.0.1:{server.server_address[1]}/w/api.php"
+    # Every run must embed its pages, not read them from the embedding store
+    os.environ['EMBEDDING_CACHE_DIR'] = ""
+
+    import fact_verification
+    from verification_pool import VerificationPool
+
+    fact_verification.warm_up()
+    sentences = [sentence for sentence in fact_verification.split_sentences(article) if len(sentence.split()) > 6]
+    # Distinct sentences, so that near-duplicate detection does not shrink the workload
+    facts = sentences[:args.facts]
+    cores = os.cpu_count()
+    workers = args.workers or sorted({2 ** power for power in range(cores.bit_length()) if 2 ** power <= cores} | {cores})
+    print(f"{len(facts)} facts, {cores} cores")
+
+    start = time.perf_counter()
+    fact_verification.verify_facts(facts)
+    baseline = len(facts) / (time.perf_counter() - start)
+    print(f"in-process   {baseline:8.2f} facts/s")
+
+    for count in workers:
+        pool = VerificationPool(count)
+        pool.verify_facts(facts[:count])
+        start = time.perf_counter()
+        pool.verify_facts(facts)
+        throughput = len(facts) / (time.perf_counter() - start)
+        pool.close()
+        shared = "shared models" if pool.shared_models else "models per worker"
+        print(f"{count:>2} workers   {throughput:8.2f} facts/s  x{throughput / baseline:4.1f}  ({shared})")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Few-shot example course plans for /generate_course_plan, picked by semantic similarity.
+
+The example courses of courseplan_examples.json are embedded once and the vectors are kept
+on disk next to a hash of the file, so they are only computed again after the file changes.
+A course plan request gets the top_k examples most similar to its course name, description
+and prerequisites that fit into a token budget; an example larger than what is left of the
+budget is cut to its first lessons.
+"""
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from observability import log_warning
+from rolling_summary import count_tokens
+
+def load_examples(path="courseplan_examples.json"):
+    """The example courses of the file, which holds several JSON documents one after another."""
+    with open(path, "r", encoding="utf-8") as examples_file:
+        text = examples_file.read()
+    decoder = json.JSONDecoder()
+    examples = []
+    position = 0
+    while text[position:].strip():
+        position += len(text[position:]) - len(text[position:].lstrip())
+        document, position = decoder.raw_decode(text, position)
+        examples.extend(document["Example"])
+    return examples
+
+def example_description(example):
+    # The examples spell this key in two ways
+    return example.get("Course_description", example.get("Course description", ""))
+
+def course_text(name, description, prerequisites):
+    """What a course is compared by: the same fields for requests and examples."""
+    return f"{name}. {description} Prerequisites: {prerequisites}"
+
+def example_header(example):
+    return f"Course Name: {example['Course_title']}\nCourse Description: {example_description(example)}\nPrerequisites: {example['Prerequisites']}"
+
+def render_example(example, lessons):
+    return f"{example_header(example)}\nCourse plan: {json.dumps({'course': lessons}, ensure_ascii=False)}"
+
+def file_digest(path):
+    with open(path, "rb") as examples_file:
+        return hashlib.sha256(examples_file.read()).hexdigest()
+
+# Examples with their vectors, and the token counts needed to fit them into a budget
+class ExampleIndex:
+    def __init__(self, examples, vectors):
+        self.examples = examples
+        self.vectors = vectors
+        self.header_tokens = [count_tokens(example_header(example)) for example in examples]
+        self.lesson_tokens = [[count_tokens(json.dumps(lesson, ensure_ascii=False)) for lesson in example["course"]]
+                              for example in examples]
+
+    def fit(self, index, token_budget):
+        """The example's lessons that fit into token_budget (all of them if possible)."""
+        tokens = self.header_tokens[index]
+        lessons = []
+        for lesson, lesson_tokens in zip(self.examples[index]["course"], self.lesson_tokens[index]):
+            if tokens + lesson_tokens > token_budget:
+                break
+            tokens += lesson_tokens
+            lessons.append(lesson)
+        return lessons, tokens
+
+class ExampleLibrary:
+    """Selects example course plans for a course; thread-safe, the index is loaded on first use.
+
+    encode maps a list of texts to unit vectors; model_name tells indexes of different models apart.
+    index_dir keeps the vectors between restarts (None keeps them in memory only).
+    """
+    def __init__(self, path, encode, model_name, index_dir=None, top_k=2, token_budget=4000):
+        self.path = path
+        self.encode = encode
+        self.model_name = model_name
+        self.index_dir = index_dir
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self.index = None
+        self._stat = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        """The index of the file as it is now; a changed file (by mtime and size, then hash) is loaded again.
+
+        While a changed file cannot be read (e.g. half written), the previous index stays in use.
+        """
+        stat = os.stat(self.path)
+        with self._lock:
+            if self.index is None or (stat.st_mtime_ns, stat.st_size) != self._stat:
+                try:
+                    self.index = self.load()
+                    self._stat = (stat.st_mtime_ns, stat.st_size)
+                except (OSError, ValueError, KeyError) as e:
+                    if self.index is None:
+                        raise
+                    log_warning("course_examples.reload_failed", path=self.path, error=str(e))
+            return self.index
+
+    def load(self):
+        examples = load_examples(self.path)
+        digest = file_digest(self.path)
+        vectors = self.read_vectors(digest, len(examples))
+        if vectors is None:
+            vectors = np.asarray(self.encode([course_text(example['Course_title'], example_description(example),
+                                                          example['Prerequisites']) for example in examples]),
+                                 dtype=np.float32)
+            self.write_vectors(digest, vectors)
+        return ExampleIndex(examples, vectors)
+
+    def read_vectors(self, digest, count):
+        if not self.index_dir:
+            return None
+        try:
+            with open(os.path.join(self.index_dir, "meta.json"), "r", encoding="utf-8") as meta_file:
+                meta = json.load(meta_file)
+            if meta != {'source': digest, 'model': self.model_name, 'examples': count}:
+                return None
+            return np.load(os.path.join(self.index_dir, "vectors.npy"))
+        except (OSError, ValueError):
+            return None
+
+    def write_vectors(self, digest, vectors):
+        if not self.index_dir:
+            return
+        os.makedirs(self.index_dir, exist_ok=True)
+        np.save(os.path.join(self.index_dir, "vectors.npy"), vectors)
+        # meta.json is written last and marks the vectors complete
+        with open(os.path.join(self.index_dir, "meta.json"), "w", encoding="utf-8") as meta_file:
+            json.dump({'source': digest, 'model': self.model_name, 'examples': len(vectors)}, meta_file)
+
+    def select(self, name, description, prerequisites, top_k=None, token_budget=None):
+        """[(similarity, example text)] of the most similar examples within the token budget, best first."""
+        top_k = self.top_k if top_k is None else top_k
+        token_budget = self.token_budget if token_budget is None else token_budget
+        if top_k <= 0 or token_budget <= 0 or not os.path.exists(self.path):
+            return []
+        index = self.current()
+        if not len(index.examples):
+            return []
+        query = np.asarray(self.encode([course_text(name, description, prerequisites)]), dtype=np.float32)[0]
+        similarities = index.vectors @ query
+        selected = []
+        for example_index in np.argsort(-similarities, kind='stable')[:top_k]:
+            lessons, tokens = index.fit(example_index, token_budget)
+            if not lessons:
+                continue
+            token_budget -= tokens
+            selected.append((float(similarities[example_index]), render_example(index.examples[example_index], lessons)))
+        return selected
@@ -0,0 +1,283 @@
+"""Persistent store of generated courses, so a course can be opened again without generating it again.
+
+A course is kept in one SQLite file as an index and per-topic records. The index holds the
+course, its lessons and the titles of their topics and subtopics, and is filled from the
+course plan as soon as generation starts. Each generated topic is one compressed record
+(zstd when the zstandard package is installed, gzip otherwise). Reading the index never
+touches a record, and a lesson or topic is decompressed only when it is asked for, so
+opening a course costs the same however many topics it has.
+"""
+import gzip
+import json
+import sqlite3
+import threading
+import time
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, gzip is always available
+    zstandard = None
+
+from observability import log_warning
+
+CODECS = ('zstd', 'gzip', 'none')
+DEFAULT_CODEC = 'zstd' if zstandard is not None else 'gzip'
+
+def compress(codec, data):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=6).compress(data)
+    if codec == 'gzip':
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    return data
+
+def decompress(codec, data):
+    # Records keep the codec they were written with, so a store outlives a change of codec
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("This course was stored with zstd, install the zstandard package to read it")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == 'gzip':
+        return gzip.decompress(data)
+    return data
+
+def topic_titles(topic):
+    # Subtopics are plain titles in the course plan and {"title", "content"} once generated
+    return [subtopic['title'] if isinstance(subtopic, dict) else subtopic for subtopic in topic.get('subtopics') or []]
+
+class CourseStore:
+    def __init__(self, path, codec=None):
+        codec = codec or DEFAULT_CODEC
+        if codec not in CODECS:
+            raise ValueError(f"Unknown course store compression: {codec}")
+        if codec == 'zstd' and zstandard is None:
+            log_warning("course_store.codec_fallback", requested='zstd', codec='gzip')
+            codec = 'gzip'
+        self.path = path
+        self.codec = codec
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS courses (
+                id TEXT PRIMARY KEY,
+                title TEXT,
+                status TEXT NOT NULL,
+                error TEXT,
+                course_plan BLOB NOT NULL,
+                codec TEXT NOT NULL,
+                lessons INTEGER NOT NULL,
+                topics INTEGER NOT NULL,
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS course_lessons (
+                course_id TEXT NOT NULL,
+                lesson_index INTEGER NOT NULL,
+                id TEXT,
+                lesson_title TEXT,
+                lesson_description TEXT,
+                learning_objectives TEXT NOT NULL,
+                PRIMARY KEY (course_id, lesson_index)
+            );
+            CREATE TABLE IF NOT EXISTS course_topics (
+                course_id TEXT NOT NULL,
+                lesson_index INTEGER NOT NULL,
+                topic_index INTEGER NOT NULL,
+                title TEXT,
+                subtopics TEXT NOT NULL,
+                record BLOB,
+                codec TEXT,
+                nbytes INTEGER NOT NULL DEFAULT 0,
+                raw_bytes INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (course_id, lesson_index, topic_index)
+            );
+            """)
+        self._db.commit()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            cursor = self._db.execute(sql, params)
+            self._db.commit()
+            return cursor
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def _record(self, value):
+        raw = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        return compress(self.codec, raw), len(raw)
+
+    def create(self, course_id, course_plan, title=None):
+        """Adds a course and its index from the course plan, before any of it is generated.
+
+        Creating a course that exists (a resumed job) keeps the topics it already has.
+        """
+        lessons = course_plan.get('course', [])
+        plan, _ = self._record(course_plan)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO courses VALUES (?, ?, 'generating', NULL, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET status = 'generating', error = NULL, updated = excluded.updated",
+                (course_id, title or (lessons[0].get('lesson_title') if lessons else None), plan, self.codec,
+                 len(lessons), sum(len(lesson['topics']) for lesson in lessons), now, now))
+            for lesson_index, lesson in enumerate(lessons):
+                self._db.execute("INSERT OR IGNORE INTO course_lessons VALUES (?, ?, ?, ?, ?, ?)",
+                                 (course_id, lesson_index, lesson.get('id'), lesson.get('lesson_title'),
+                                  lesson.get('description'), json.dumps(lesson.get('learningObjectives') or [])))
+                for topic_index, topic in enumerate(lesson['topics']):
+                    self._db.execute("INSERT OR IGNORE INTO course_topics (course_id, lesson_index, topic_index, title, subtopics) "
+                                     "VALUES (?, ?, ?, ?, ?)",
+                                     (course_id, lesson_index, topic_index, topic.get('title'), json.dumps(topic_titles(topic))))
+            self._db.commit()
+
+    def put_topic(self, course_id, lesson_index, topic_index, topic):
+        record, raw_bytes = self._record(topic)
+        self._execute(
+            "INSERT OR REPLACE INTO course_topics VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (course_id, lesson_index, topic_index, topic.get('title'), json.dumps(topic_titles(topic)),
+             record, self.codec, len(record), raw_bytes))
+
+    def put_lesson(self, course_id, lesson_index, lesson):
+        """Stores a finished lesson: its details in the index and every topic as its own record."""
+        records = [(topic_index, topic) + self._record(topic) for topic_index, topic in enumerate(lesson['topics'])]
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO course_lessons VALUES (?, ?, ?, ?, ?, ?)",
+                             (course_id, lesson_index, lesson.get('id'), lesson.get('lesson_title'),
+                              lesson.get('lesson_description'), json.dumps(lesson.get('learning_objectives') or [])))
+            for topic_index, topic, record, raw_bytes in records:
+                self._db.execute("INSERT OR REPLACE INTO course_topics VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                 (course_id, lesson_index, topic_index, topic.get('title'), json.dumps(topic_titles(topic)),
+                                  record, self.codec, len(record), raw_bytes))
+            self._db.execute("UPDATE courses SET updated = ? WHERE id = ?", (time.time(), course_id))
+            self._db.commit()
+
+    def finish(self, course_id, status, error=None):
+        self._execute("UPDATE courses SET status = ?, error = ?, updated = ? WHERE id = ?",
+                      (status, error, time.time(), course_id))
+
+    def delete(self, course_id):
+        with self._lock:
+            deleted = self._db.execute("DELETE FROM courses WHERE id = ?", (course_id,)).rowcount
+            self._db.execute("DELETE FROM course_lessons WHERE course_id = ?", (course_id,))
+            self._db.execute("DELETE FROM course_topics WHERE course_id = ?", (course_id,))
+            self._db.commit()
+        return deleted == 1
+
+    def _summaries(self, where="", params=(), offset=0, limit=-1):
+        # The page of courses is picked first, so only its topics are counted
+        rows = self._query(
+            "SELECT c.id, c.title, c.status, c.error, c.lessons, c.topics, c.created, c.updated, "
+            "(SELECT COUNT(record) FROM course_topics WHERE course_id = c.id), "
+            "(SELECT COALESCE(SUM(nbytes), 0) FROM course_topics WHERE course_id = c.id), "
+            "(SELECT COALESCE(SUM(raw_bytes), 0) FROM course_topics WHERE course_id = c.id) "
+            "FROM (SELECT * FROM courses " + where + " ORDER BY created DESC LIMIT ? OFFSET ?) c ORDER BY c.created DESC",
+            tuple(params) + (limit, offset))
+        return [{
+            'id': course_id, 'title': title, 'status': status, 'error': error, 'lessons': lessons, 'topics': topics,
+            'generated_topics': generated, 'bytes': nbytes, 'raw_bytes': raw_bytes, 'created': created, 'updated': updated,
+        } for course_id, title, status, error, lessons, topics, created, updated, generated, nbytes, raw_bytes in rows]
+
+    def courses(self, offset=0, limit=20):
+        """One page of the stored courses, newest first, and the number of courses."""
+        total = self._query("SELECT COUNT(*) FROM courses")[0][0]
+        return self._summaries(offset=offset, limit=limit), total
+
+    def get(self, course_id):
+        summaries = self._summaries("WHERE id = ?", (course_id,))
+        return summaries[0] if summaries else None
+
+    def course_plan(self, course_id):
+        rows = self._query("SELECT course_plan, codec FROM courses WHERE id = ?", (course_id,))
+        return json.loads(decompress(rows[0][1], rows[0][0])) if rows else None
+
+    def index(self, course_id, offset=0, limit=-1):
+        """The course with one page of its lessons, each with the titles of its topics and subtopics but no content."""
+        course = self.get(course_id)
+        if course is None:
+            return None
+        lessons = self._query(
+            "SELECT lesson_index, id, lesson_title, lesson_description, learning_objectives FROM course_lessons "
+            "WHERE course_id = ? ORDER BY lesson_index LIMIT ? OFFSET ?", (course_id, limit, offset))
+        topics = {}
+        if lessons:
+            for lesson_index, topic_index, title, subtopics, generated in self._query(
+                    "SELECT lesson_index, topic_index, title, subtopics, record IS NOT NULL FROM course_topics "
+                    "WHERE course_id = ? AND lesson_index BETWEEN ? AND ? ORDER BY lesson_index, topic_index",
+                    (course_id, lessons[0][0], lessons[-1][0])):
+                topics.setdefault(lesson_index, []).append({
+                    'topic_index': topic_index, 'title': title, 'generated': bool(generated),
+                    'subtopics': [{'title': subtopic} for subtopic in json.loads(subtopics)],
+                })
+        course['lessons'] = [{
+            'lesson_index': lesson_index, 'id': lesson_id, 'lesson_title': lesson_title,
+            'lesson_description': lesson_description, 'learning_objectives': json.loads(learning_objectives),
+            'topics': topics.get(lesson_index, []),
+        } for lesson_index, lesson_id, lesson_title, lesson_description, learning_objectives in lessons]
+        course['offset'] = offset
+        return course
+
+    def lesson(self, course_id, lesson_index, offset=0, limit=-1):
+        """A lesson in the shape it was generated in, with one page of its topics by topic_index.
+
+        Generated topics are decompressed; a topic not generated yet is a placeholder with the
+        titles of the index. Every topic carries its topic_index and whether it was generated.
+        """
+        rows = self._query(
+            "SELECT id, lesson_title, lesson_description, learning_objectives FROM course_lessons "
+            "WHERE course_id = ? AND lesson_index = ?", (course_id, lesson_index))
+        if not rows:
+            return None
+        lesson_id, lesson_title, lesson_description, learning_objectives = rows[0]
+        total = self._query("SELECT COUNT(*) FROM course_topics WHERE course_id = ? AND lesson_index = ?",
+                            (course_id, lesson_index))[0][0]
+        rows = self._query(
+            "SELECT topic_index, title, subtopics, record, codec FROM course_topics WHERE course_id = ? AND lesson_index = ? "
+            "ORDER BY topic_index LIMIT ? OFFSET ?", (course_id, lesson_index, limit, offset))
+        topics = []
+        for topic_index, title, subtopics, record, codec in rows:
+            if record is None:
+                topic = {'title': title, 'subtopics': [{'title': subtopic} for subtopic in json.loads(subtopics)]}
+            else:
+                topic = json.loads(decompress(codec, record))
+            topics.append(dict(topic, topic_index=topic_index, generated=record is not None))
+        return {
+            'id': lesson_id,
+            'lesson_title': lesson_title,
+            'lesson_description': lesson_description,
+            'learning_objectives': json.loads(learning_objectives),
+            'topics': topics,
+            'lesson_index': lesson_index,
+            'total_topics': total,
+            'offset': offset,
+        }
+
+    def topic(self, course_id, lesson_index, topic_index):
+        rows = self._query(
+            "SELECT record, codec FROM course_topics WHERE course_id = ? AND lesson_index = ? AND topic_index = ? "
+            "AND record IS NOT NULL", (course_id, lesson_index, topic_index))
+        return json.loads(decompress(rows[0][1], rows[0][0])) if rows else None
+
+    def lessons(self, course_id):
+        """Every lesson of the course in order, one at a time, so a whole course is never held in memory."""
+        count = self._query("SELECT COUNT(*) FROM course_lessons WHERE course_id = ?", (course_id,))[0][0]
+        for lesson_index in range(count):
+            lesson = self.lesson(course_id, lesson_index)
+            for key in ('lesson_index', 'total_topics', 'offset'):
+                del lesson[key]
+            lesson['topics'] = [{key: value for key, value in topic.items() if key not in ('topic_index', 'generated')}
+                                for topic in lesson['topics'] if topic['generated']]
+            yield lesson
+
+    def stats(self):
+        courses = self._query("SELECT COUNT(*) FROM courses")[0][0]
+        topics, nbytes, raw_bytes = self._query(
+            "SELECT COUNT(record), COALESCE(SUM(nbytes), 0), COALESCE(SUM(raw_bytes), 0) FROM course_topics")[0]
+        return {
+            'codec': self.codec,
+            'courses': courses,
+            'topics': topics,
+            'bytes': nbytes,
+            'raw_bytes': raw_bytes,
+            'compression_ratio': raw_bytes / nbytes if nbytes else 0.0,
+        }
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+# On-disk store of sentence embeddings, keyed by (page id, revision, model name).
+# Vectors live in one .npy file per page and are memory-mapped on read; a SQLite
+# index keeps the sentences, the file size and the last access time for LRU eviction.
+class EmbeddingStore:
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(directory, "index.sqlite"), check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                page_id TEXT NOT NULL,
+                revision TEXT NOT NULL,
+                model TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                sentences TEXT NOT NULL,
+                nbytes INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (page_id, revision, model)
+            )""")
+        self._db.commit()
+
+    def _filename(self, page_id, revision, model_name):
+        key = f"{page_id}\x00{revision}\x00{model_name}".encode("utf-8")
+        return hashlib.sha1(key).hexdigest() + ".npy"
+
+    def get(self, page_id, revision, model_name):
+        """Returns (sentences, memory-mapped vectors) or None on a miss."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT filename, sentences FROM embeddings WHERE page_id = ? AND revision = ? AND model = ?",
+                (str(page_id), str(revision), model_name)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            filename, sentences = row
+            try:
+                vectors = np.load(os.path.join(self.directory, filename), mmap_mode="r")
+            except (OSError, ValueError):
+                # The vector file is gone or damaged, forget the entry and treat it as a miss
+                self._delete(str(page_id), str(revision), model_name, filename)
+                self.misses += 1
+                return None
+            self._db.execute(
+                "UPDATE embeddings SET last_used = ? WHERE page_id = ? AND revision = ? AND model = ?",
+                (time.time(), str(page_id), str(revision), model_name))
+            self._db.commit()
+            self.hits += 1
+            return json.loads(sentences), vectors
+
+    def put(self, page_id, revision, model_name, sentences, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        filename = self._filename(page_id, revision, model_name)
+        path = os.path.join(self.directory, filename)
+        # Write to a temporary file first so readers never map a half-written array
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as vector_file:
+            np.save(vector_file, vectors)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (str(page_id), str(revision), model_name, filename, json.dumps(sentences),
+                 os.path.getsize(path), time.time()))
+            self._db.commit()
+            self._evict()
+
+    def _delete(self, page_id, revision, model_name, filename):
+        self._db.execute(
+            "DELETE FROM embeddings WHERE page_id = ? AND revision = ? AND model = ?",
+            (page_id, revision, model_name))
+        self._db.commit()
+        try:
+            os.remove(os.path.join(self.directory, filename))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        # Drop least recently used pages until the vector files fit in max_bytes
+        total = self._db.execute("SELECT COALESCE(SUM(nbytes), 0) FROM embeddings").fetchone()[0]
+        while total > self.max_bytes:
+            row = self._db.execute(
+                "SELECT page_id, revision, model, filename, nbytes FROM embeddings ORDER BY last_used LIMIT 1").fetchone()
+            if row is None:
+                break
+            page_id, revision, model_name, filename, nbytes = row
+            self._delete(page_id, revision, model_name, filename)
+            self.evictions += 1
+            total -= nbytes
+
+    def counters(self):
+        return self.hits, self.misses, self.evictions
+
+    def add_counters(self, hits, misses, evictions):
+        """Merges the lookups a forked worker made through its own connection to the same store."""
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.evictions += evictions
+
+    def stats(self):
+        with self._lock:
+            entries, total = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM embeddings").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': entries,
+            'bytes': total,
+            'max_bytes': self.max_bytes,
+        }
@@ -1,135 +1,606 @@
 import json
-import requests
-from sentence_transformers import SentenceTransformer, util
-from bs4 import BeautifulSoup
-import spacy
+import os
+import threading
+import time
+import numpy as np
 import nltk
-
-# Download the NLTK punkt tokenizer
-nltk.download('punkt')
-nltk.download('punkt_tab')
 from nltk.tokenize import sent_tokenize
+from article_text import EXTRACTION_VERSION, extract_blocks, html_blocks, iter_sentences
+from embedding_store import EmbeddingStore
+from knowledge_index import KnowledgeIndex
+from lexical_index import LexicalIndex, top_indices
+from llm_cache import MemoryTier
+from retrieval import RetrievalClient
+from observability import log_event, span
+
+# Sentence transformer model, spaCy NER model and the NLTK tokenizer data they need
+MODEL_NAME = 'all-mpnet-base-v2'
+# Faster model, available as the dense first stage of two-stage scoring
+FIRST_STAGE_MODEL_NAME = 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2'
+SPACY_MODEL = "en_core_web_sm"
+NLTK_RESOURCES = ('tokenizers/punkt', 'tokenizers/punkt_tab')
+
+# A model loaded on first use and then shared by every thread of the process.
+# Importing this module stays cheap; warm_up() loads everything ahead of the first request.
+class LazyResource:
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self.load_seconds = None
+        self._value = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    start = time.perf_counter()
+                    value = self.loader()
+                    self.load_seconds = time.perf_counter() - start
+                    log_event("resource.loaded", resource=self.name, seconds=round(self.load_seconds, 2))
+                    self._value = value
+        return self._value
+
+    @property
+    def loaded(self):
+        return self._value is not None
+
+def load_sentence_model(model_name=MODEL_NAME):
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name)
+
+def load_spacy_model():
+    import spacy
+    try:
+        return spacy.load(SPACY_MODEL)
+    except OSError as e:
+        raise RuntimeError(f"spaCy model {SPACY_MODEL} is not installed; run: python -m spacy download {SPACY_MODEL}") from e
+
+def check_nltk_resources():
+    # The tokenizer data is installed ahead of time, never downloaded while serving
+    missing = []
+    for resource in NLTK_RESOURCES:
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            missing.append(resource.split('/')[-1])
+    if missing:
+        raise RuntimeError(f"NLTK data {', '.join(missing)} is not installed; run: python -m nltk.downloader {' '.join(missing)}")
+    return True
+
+sentence_model = LazyResource(MODEL_NAME, load_sentence_model)
+spacy_model = LazyResource(SPACY_MODEL, load_spacy_model)
+nltk_data = LazyResource("NLTK punkt", check_nltk_resources)
+first_stage_model = LazyResource(FIRST_STAGE_MODEL_NAME, lambda: load_sentence_model(FIRST_STAGE_MODEL_NAME))
+
+def warm_up():
+    """Loads every model now instead of on first use; returns the load time of each in seconds."""
+    resources = (nltk_data, sentence_model, spacy_model)
+    for resource in resources:
+        resource.get()
+    return model_stats()
+
+def model_stats():
+    return {resource.name: {'loaded': resource.loaded, 'load_seconds': resource.load_seconds}
+            for resource in (nltk_data, sentence_model, spacy_model)}
+
+def split_sentences(text):
+    nltk_data.get()
+    return sent_tokenize(text)
+
+def cached_sentences(document):
+    """The sentences of a fetched page, split a paragraph at a time and cached per page revision."""
+    if 'sentences' in document:
+        return document['sentences']
+    key = (document.get('page_id'), document.get('revision'))
+    sentences = sentence_cache.get(key) if None not in key else None
+    if sentences is None:
+        sentences = list(iter_sentences(document['text'].split("\n\n"), split_sentences))
+        if None not in key:
+            sentence_cache.put(key, sentences)
+    return sentences
+
+# Number of sentences sent to the encoder per forward pass
+ENCODE_BATCH_SIZE = int(os.getenv("ENCODE_BATCH_SIZE", "64"))
+
+# Persistent sentence-embedding store keyed by page id, revision and model name (empty dir disables it)
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache")
+EMBEDDING_CACHE_MAX_MB = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "512"))
+
+def open_embedding_store():
+    return EmbeddingStore(EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_MAX_MB * 1024 * 1024) if EMBEDDING_CACHE_DIR else None
+
+embedding_store = open_embedding_store()
+
+# Two-stage scoring of pages that are not in the embedding store: a cheap first stage ("bm25"
+# lexical scores, or "minilm" dense scores from FIRST_STAGE_MODEL_NAME) picks the RERANK_DEPTH
+# most promising sentences per fact, and only those are embedded with MODEL_NAME and re-ranked.
+# A deeper re-rank trades speed for recall; 0 embeds every sentence.
+FIRST_STAGES = ('bm25', 'minilm')
+FIRST_STAGE = os.getenv("FIRST_STAGE", "bm25")
+RERANK_DEPTH = int(os.getenv("RERANK_DEPTH", "32"))
+
+# Facts whose embeddings are at least this similar are verified once and share the result
+FACT_DEDUPE_THRESHOLD = float(os.getenv("FACT_DEDUPE_THRESHOLD", "0.95"))
+
+# Evidence modes: "fast" scores only the pages found for the fact itself and skips the entity
+# lookups; "entity-aware" also scores the pages of the fact's named entities, up to
+# EVIDENCE_BUDGET documents per fact (the fact's own Wikipedia and Wikidata pages included)
+EVIDENCE_MODES = ('fast', 'entity-aware')
+EVIDENCE_MODE = os.getenv("EVIDENCE_MODE", "fast")
+EVIDENCE_BUDGET = int(os.getenv("EVIDENCE_BUDGET", "6"))
+
+# Shared pooled HTTP client for all Wikipedia/Wikidata lookups; the API URLs can point at a local stub server
+WIKIPEDIA_API_URL = os.getenv("WIKIPEDIA_API_URL", "https://en.wikipedia.org/w/api.php")
+WIKIDATA_API_URL = os.getenv("WIKIDATA_API_URL", "https://www.wikidata.org/w/api.php")
+
+# Where the text of a Wikipedia page comes from: "html" strips the action=parse HTML, "extracts" asks
+# for the plaintext extract (prop=extracts), which leaves out the markup altogether; both drop
+# boilerplate sections such as References (see article_text.py)
+WIKIPEDIA_TEXT_SOURCE = os.getenv("WIKIPEDIA_TEXT_SOURCE", "html")
+# Sentence lists of the most recently used page revisions, so a page is extracted and split once per process
+SENTENCE_CACHE_ENTRIES = int(os.getenv("SENTENCE_CACHE_ENTRIES", "512"))
+sentence_cache = MemoryTier(SENTENCE_CACHE_ENTRIES)
 
-# Load the sentence transformer model and spaCy NER model
-model = SentenceTransformer('all-mpnet-base-v2')
-# Faster model
-# model = SentenceTransformer('sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2')
-nlp = spacy.load("en_core_web_sm")
+def new_http_client():
+    return RetrievalClient(
+        max_workers=int(os.getenv("RETRIEVAL_MAX_WORKERS", "16")),
+        per_host=int(os.getenv("RETRIEVAL_PER_HOST", "4")),
+        timeout=float(os.getenv("RETRIEVAL_TIMEOUT", "10")),
+        retries=int(os.getenv("RETRIEVAL_RETRIES", "3")),
+    )
+
+http_client = new_http_client()
+
+def reset_after_fork():
+    """Gives a forked worker process its own HTTP client and SQLite connection; threads and connections do not survive fork."""
+    global http_client, embedding_store
+    http_client = new_http_client()
+    embedding_store = open_embedding_store()
+
+# Where verify_facts looks for evidence: "http" queries the Wikipedia/Wikidata APIs, "local"
+# searches the top KNOWLEDGE_TOP_K sentences of a prebuilt knowledge index (python -m knowledge_index build-index)
+RETRIEVAL_BACKENDS = ('http', 'local')
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "http")
+KNOWLEDGE_INDEX_DIR = os.getenv("KNOWLEDGE_INDEX_DIR", "knowledge_index")
+KNOWLEDGE_TOP_K = int(os.getenv("KNOWLEDGE_TOP_K", "5"))
+knowledge_index = LazyResource(f"knowledge index {KNOWLEDGE_INDEX_DIR}", lambda: KnowledgeIndex(KNOWLEDGE_INDEX_DIR, MODEL_NAME))
+
+def search_wikipedia(query):
+    return http_client.get_json(WIKIPEDIA_API_URL, {'action': 'query', 'list': 'search', 'srsearch': query, 'format': 'json'})
+
+def fetch_wikipedia_page(pageid):
+    if WIKIPEDIA_TEXT_SOURCE == 'extracts':
+        return http_client.get_json(WIKIPEDIA_API_URL, {'action': 'query', 'prop': 'extracts|revisions', 'pageids': pageid, 'explaintext': 1,
+                                                        'exsectionformat': 'wiki', 'rvprop': 'ids', 'format': 'json'})
+    return http_client.get_json(WIKIPEDIA_API_URL, {'action': 'parse', 'pageid': pageid, 'prop': 'text|revid', 'format': 'json'})
+
+def search_wikidata(query):
+    return http_client.get_json(WIKIDATA_API_URL, {'action': 'wbsearchentities', 'search': query, 'language': 'en', 'format': 'json'})
+
+def fetch_wikidata_entity(entity_id):
+    return http_client.get_json(WIKIDATA_API_URL, {'action': 'wbgetentities', 'ids': entity_id, 'languages': 'en', 'format': 'json'})
+
+def wikipedia_page_id(data):
+    if data and data.get('query', {}).get('search'):
+        return data['query']['search'][0]['pageid']
+    return None
+
+def wikidata_entity_id(data):
+    if data and data.get('search'):
+        return data['search'][0]['id']
+    return None
+
+# Fetched pages are returned as documents: {'page_id', 'revision', 'text'}, plus 'sentences' when
+# the sentence cache already has them. Paragraphs of the text are separated by blank lines.
+def wikipedia_document(pageid, data):
+    if data and 'parse' in data:
+        revision = data['parse'].get('revid')
+        blocks = html_blocks(data['parse']['text']['*'])
+    elif data and str(pageid) in data.get('query', {}).get('pages', {}):
+        page = data['query']['pages'][str(pageid)]
+        if 'extract' not in page:
+            return None
+        revision = page['revisions'][0]['revid'] if page.get('revisions') else None
+        blocks = extract_blocks(page['extract'])
+    else:
+        return None
+    # The text source and extraction version are part of the id, since the sentence cache and the
+    # embedding store are keyed by page id and revision
+    document = {'page_id': f"wikipedia:{pageid}:{WIKIPEDIA_TEXT_SOURCE}:v{EXTRACTION_VERSION}", 'revision': revision}
+    # The blocks are generated lazily: a page revision seen before is neither extracted nor split again
+    sentences = sentence_cache.get((document['page_id'], revision)) if revision is not None else None
+    if sentences is not None:
+        return dict(document, text=" ".join(sentences), sentences=sentences)
+    return dict(document, text="\n\n".join(blocks))
+
+def wikidata_document(entity_id, data):
+    if not data or entity_id not in data.get('entities', {}):
+        return None
+    entity = data['entities'][entity_id]
+    return {
+        'page_id': f"wikidata:{entity_id}",
+        'revision': entity.get('lastrevid'),
+        'text': json.dumps(entity, indent=2),
+    }
 
 # Function to get full text from Wikipedia
 def get_full_text_wikipedia(query):
-    url = f"https://en.wikipedia.org/w/api.php?action=query&list=search&srsearch={query}&format=json"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        if data['query']['search']:
-            pageid = data['query']['search'][0]['pageid']
-            return get_wikipedia_content(pageid)
-    return None
+    pageid = wikipedia_page_id(search_wikipedia(query).result())
+    return get_wikipedia_content(pageid) if pageid is not None else None
 
 def get_wikipedia_content(pageid):
-    url = f"https://en.wikipedia.org/w/api.php?action=parse&pageid={pageid}&prop=text&format=json"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        return BeautifulSoup(data['parse']['text']['*'], 'html.parser').text
-    return None
+    return wikipedia_document(pageid, fetch_wikipedia_page(pageid).result())
 
 # Function to get full text from Wikidata
 def get_full_text_wikidata(query):
-    url = f"https://www.wikidata.org/w/api.php?action=wbsearchentities&search={query}&language=en&format=json"
-    response = requests.get(url)
-    if (response.status_code == 200):
-        data = response.json()
-        if data['search']:
-            entity_id = data['search'][0]['id']
-            return get_wikidata_content(entity_id)
-    return None
+    entity_id = wikidata_entity_id(search_wikidata(query).result())
+    return get_wikidata_content(entity_id) if entity_id is not None else None
 
 def get_wikidata_content(entity_id):
-    url = f"https://www.wikidata.org/w/api.php?action=wbgetentities&ids={entity_id}&languages=en&format=json"
-    response = requests.get(url)
-    if (response.status_code == 200):
-        data = response.json()
-        return json.dumps(data['entities'][entity_id], indent=2)
-    return None
+    return wikidata_document(entity_id, fetch_wikidata_entity(entity_id).result())
+
+def lookup_sources(queries):
+    """Fetches the Wikipedia and Wikidata documents for every query.
+
+    All searches are issued together, then all page fetches, so a whole fact list
+    costs two rounds of concurrent requests instead of four sequential calls per query.
+    Returns the documents per query and the number of lookups each query needed.
+    """
+    queries = list(dict.fromkeys(queries))
+    searches = {query: (search_wikipedia(query), search_wikidata(query)) for query in queries}
+    ids = {query: (wikipedia_page_id(wikipedia.result()), wikidata_entity_id(wikidata.result()))
+           for query, (wikipedia, wikidata) in searches.items()}
+
+    pages = {pageid: fetch_wikipedia_page(pageid) for pageid, _ in ids.values() if pageid is not None}
+    entities = {entity_id: fetch_wikidata_entity(entity_id) for _, entity_id in ids.values() if entity_id is not None}
+    pages = {pageid: wikipedia_document(pageid, future.result()) for pageid, future in pages.items()}
+    entities = {entity_id: wikidata_document(entity_id, future.result()) for entity_id, future in entities.items()}
+
+    sources = {
+        query: {
+            'wikipedia': pages.get(pageid),
+            'wikidata': entities.get(entity_id),
+        }
+        for query, (pageid, entity_id) in ids.items()
+    }
+    # Two searches per query plus one page fetch per search hit
+    fetches = {query: 2 + (pageid is not None) + (entity_id is not None) for query, (pageid, entity_id) in ids.items()}
+    return sources, fetches
 
 def named_entity_recognition(text):
-    doc = nlp(text)
+    doc = spacy_model.get()(text)
     return [(ent.text, ent.label_) for ent in doc.ents]
 
+def named_entities(texts, batch_size=64):
+    """NER for many texts in one nlp.pipe pass; returns [(entity, label)] per text."""
+    return [[(ent.text, ent.label_) for ent in doc.ents] for doc in spacy_model.get().pipe(texts, batch_size=batch_size)]
+
 def verify_entities(entities):
-    entity_verification_results = {}
+    sources, _ = lookup_sources([entity for entity, label in entities])
+    return {entity: sources[entity] for entity, label in entities}
+
+def select_entities(fact, entities, evidence_budget):
+    """Keeps the distinct entities whose pages fit in the evidence budget next to the fact's own two pages."""
+    selected = []
     for entity, label in entities:
-        entity_verification_results[entity] = {
-            'wikipedia': get_full_text_wikipedia(entity),
-            'wikidata': get_full_text_wikidata(entity),
-        }
-    return entity_verification_results
+        if entity != fact and entity not in selected:
+            selected.append(entity)
+    return selected[:max(0, (evidence_budget - 2) // 2)]
 
-def verify_fact(fact, max_text_length=300):
-    verification_results = {}
+def verify_fact(fact, max_text_length=300, mode=None, evidence_budget=None, backend=None):
+    return verify_facts([fact], max_text_length, mode, evidence_budget, backend)[0]
 
-    # Run NER and entity verification
-    entities = named_entity_recognition(fact)
-    entity_verifications = verify_entities(entities)
+def fact_status(best_similarity):
+    return 'verified' if best_similarity > 0.8 else 'moderate' if best_similarity > 0.5 else 'unverified'
 
-    verification_results[fact] = {
-        'entities': entities,
-        'entity_verifications': entity_verifications,
-        'wikipedia': get_full_text_wikipedia(fact),
-        'wikidata': get_full_text_wikidata(fact),
-    }
+def normalize_fact(fact):
+    return " ".join(fact.lower().replace('.', ' ').split())
 
-    # Analyze the results
-    best_similarity, best_source, best_text = analyze_fact_results(verification_results, max_text_length)
+def dedupe_facts(facts, fact_vectors, threshold=FACT_DEDUPE_THRESHOLD):
+    """Groups identical and near-identical facts.
 
-    # Determine the status based on similarity
-    status = 'verified' if best_similarity > 0.8 else 'moderate' if best_similarity > 0.5 else 'unverified'
+    Returns the indices of the facts to verify and, for every fact, the position of its
+    representative among them. Facts match when their normalized text is equal or their
+    embeddings reach the similarity threshold.
+    """
+    unique = []
+    assignment = []
+    by_text = {}
+    for index, fact in enumerate(facts):
+        key = normalize_fact(fact)
+        if key not in by_text and unique:
+            similarities = fact_vectors[unique] @ fact_vectors[index]
+            best = int(np.argmax(similarities))
+            if similarities[best] >= threshold:
+                by_text[key] = best
+        if key not in by_text:
+            by_text[key] = len(unique)
+            unique.append(index)
+        assignment.append(by_text[key])
+    return unique, assignment
 
-    return {
-        'fact': fact,
-        'status': status,
-        'best_similarity': best_similarity,
-        'best_source': best_source,
-        'text': best_text
+def verify_facts(facts, max_text_length=300, mode=None, evidence_budget=None, backend=None):
+    return verify_deduplicated_facts(facts, max_text_length, mode, evidence_budget, backend)[0]
+
+def verify_deduplicated_facts(facts, max_text_length=300, mode=None, evidence_budget=None, backend=None):
+    """verify_facts that also returns how many distinct facts were actually verified."""
+    mode = mode or EVIDENCE_MODE
+    if mode not in EVIDENCE_MODES:
+        raise ValueError(f"Unknown evidence mode: {mode}")
+    backend = backend or RETRIEVAL_BACKEND
+    if backend not in RETRIEVAL_BACKENDS:
+        raise ValueError(f"Unknown retrieval backend: {backend}")
+    if not facts:
+        return [], 0
+
+    # Every fact is encoded once; duplicates are verified once and share the result
+    with span("encode_facts", facts=len(facts)):
+        fact_vectors = encode_sentences(facts)
+    unique, assignment = dedupe_facts(facts, fact_vectors)
+    unique_facts = [facts[index] for index in unique]
+    if backend == 'local':
+        unique_results = verify_facts_local(unique_facts, max_text_length, fact_vectors=fact_vectors[unique])
+    else:
+        unique_results = verify_facts_online(unique_facts, fact_vectors[unique], max_text_length, mode, evidence_budget)
+    return [dict(unique_results[position], fact=fact) for fact, position in zip(facts, assignment)], len(unique)
+
+def verify_fact_groups(groups, max_text_length=300, mode=None, evidence_budget=None, backend=None, verify=None):
+    """Verifies several lists of facts (e.g. one per lesson) as a single batch.
+
+    verify defaults to verify_deduplicated_facts in this process (a VerificationPool passes its own).
+    Returns the results per group, in the order of the groups, and throughput stats.
+    """
+    start = time.perf_counter()
+    facts = [fact for group in groups for fact in group]
+    results, unique_facts = (verify or verify_deduplicated_facts)(facts, max_text_length, mode, evidence_budget, backend)
+    elapsed = time.perf_counter() - start
+    grouped = []
+    for group in groups:
+        grouped.append(results[:len(group)])
+        results = results[len(group):]
+    stats = {
+        'facts': len(facts),
+        'unique_facts': unique_facts,
+        'seconds': round(elapsed, 3),
+        'facts_per_second': round(len(facts) / elapsed, 2) if elapsed else None,
     }
+    return grouped, stats
+
+def verify_facts_online(facts, fact_vectors, max_text_length=300, mode=EVIDENCE_MODE, evidence_budget=None):
+    if evidence_budget is None:
+        evidence_budget = EVIDENCE_BUDGET
+
+    # Entities only matter when their pages are scored, so fast mode skips NER and the entity lookups
+    if mode == 'entity-aware':
+        with span("named_entities", facts=len(facts)):
+            fact_entities = named_entities(facts)
+    else:
+        fact_entities = [[] for _ in facts]
+    fact_queries = [[fact] + select_entities(fact, entities, evidence_budget)
+                    for fact, entities in zip(facts, fact_entities)]
+
+    # Look up the facts and all of their selected entities in one batch
+    requests_before = http_client.stats['requests']
+    with span("wikipedia_fetch", facts=len(facts)) as attrs:
+        sources, fetches = lookup_sources([query for queries in fact_queries for query in queries])
+        attrs.update(lookups=sum(fetches.values()), http_requests=http_client.stats['requests'] - requests_before)
+    log_event("facts.evidence", mode=mode, facts=len(facts), lookups=attrs['lookups'], http_requests=attrs['http_requests'])
+
+    fact_evidence = []
+    for fact, queries in zip(facts, fact_queries):
+        evidence = dict(sources[fact])
+        for entity in queries[1:]:
+            for source, document in sources[entity].items():
+                evidence[f"{source} ({entity})"] = document
+        fact_evidence.append(evidence)
+
+    # Pages shared by several facts are split and embedded once, all in shared encoder batches
+    documents = {}
+    for evidence in fact_evidence:
+        for document in evidence.values():
+            if document and document['text']:
+                documents.setdefault(document_key(document), document)
+    with span("embed_evidence", documents=len(documents)):
+        embedded = embed_evidence(facts, fact_evidence, documents)
+
+    with span("score_evidence", facts=len(facts)):
+        best = [best_evidence(fact_vector, evidence, embedded, max_text_length)
+                for fact_vector, evidence in zip(fact_vectors, fact_evidence)]
+    results = []
+    for fact, queries, (best_similarity, best_source, best_text) in zip(facts, fact_queries, best):
+        results.append({
+            'fact': fact,
+            'status': fact_status(best_similarity),
+            'best_similarity': best_similarity,
+            'best_source': best_source,
+            'text': best_text,
+            'evidence_mode': mode,
+            'fetches': sum(fetches[query] for query in queries),
+        })
+    return results
 
-def analyze_fact_results(verification_results, max_text_length):
-    print("it's analyzing")
-    analysis = []
+def verify_facts_local(facts, max_text_length=300, top_k=None, fact_vectors=None):
+    """Checks the facts against the local knowledge index: one batched encode and one index scan, no network."""
+    index = knowledge_index.get()
+    if fact_vectors is None:
+        fact_vectors = encode_sentences(facts)
+    with span("knowledge_index_search", facts=len(facts)):
+        passages = index.passages(fact_vectors, top_k or KNOWLEDGE_TOP_K) if facts else []
+    results = []
+    for fact, fact_passages in zip(facts, passages):
+        for passage in fact_passages:
+            if len(passage['text']) > max_text_length:
+                passage['text'] = passage['text'][:max_text_length] + '...'
+        best = fact_passages[0] if fact_passages else None
+        best_similarity = best['similarity'] if best else 0
+        results.append({
+            'fact': fact,
+            'status': fact_status(best_similarity),
+            'best_similarity': best_similarity,
+            'best_source': f"local ({best['title']})" if best else None,
+            'text': best['text'] if best else None,
+            'evidence_mode': 'local',
+            'fetches': 0,
+            'passages': fact_passages,
+        })
+    return results
+
+# Unit-length embeddings, so cosine similarity is a plain dot product
+def encode_sentences(sentences, batch_size=ENCODE_BATCH_SIZE):
+    return sentence_model.get().encode(sentences, batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True)
+
+def document_key(document):
+    return document.get('page_id') or id(document)
+
+def embed_document(document, batch_size=ENCODE_BATCH_SIZE):
+    """Returns (sentences, sentence vectors) for a fetched page, reusing stored vectors for the same revision."""
+    return embed_documents([document], batch_size)[0]
+
+def stored_embedding(document):
+    page_id, revision = document.get('page_id'), document.get('revision')
+    if embedding_store is not None and page_id is not None and revision is not None:
+        return embedding_store.get(page_id, revision, MODEL_NAME)
+    return None
+
+def embed_documents(documents, batch_size=ENCODE_BATCH_SIZE):
+    """embed_document for many pages: the sentences of every page not in the store go through one encode call."""
+    embedded = [None] * len(documents)
+    pending = []
+    for position, document in enumerate(documents):
+        embedded[position] = stored_embedding(document)
+        if embedded[position] is None:
+            pending.append((position, cached_sentences(document)))
+
+    sentences = [sentence for _, document_sentences in pending for sentence in document_sentences]
+    if sentences:
+        vectors = encode_sentences(sentences, batch_size)
+    else:
+        vectors = np.zeros((0, sentence_model.get().get_sentence_embedding_dimension()), dtype=np.float32)
+    start = 0
+    for position, document_sentences in pending:
+        document_vectors = vectors[start:start + len(document_sentences)]
+        start += len(document_sentences)
+        embedded[position] = (document_sentences, document_vectors)
+        document = documents[position]
+        page_id, revision = document.get('page_id'), document.get('revision')
+        if embedding_store is not None and page_id is not None and revision is not None and document_sentences:
+            embedding_store.put(page_id, revision, MODEL_NAME, document_sentences, document_vectors)
+    return embedded
+
+def first_stage_candidates(facts, sentences, rerank_depth, first_stage=None):
+    """Union of the rerank_depth best first-stage sentences of each fact, as sorted sentence indices."""
+    first_stage = first_stage or FIRST_STAGE
+    if first_stage not in FIRST_STAGES:
+        raise ValueError(f"Unknown first stage: {first_stage}")
+    if len(sentences) <= rerank_depth:
+        return list(range(len(sentences)))
+    if first_stage == 'minilm':
+        model = first_stage_model.get()
+        sentence_vectors = model.encode(sentences, batch_size=ENCODE_BATCH_SIZE, convert_to_numpy=True, normalize_embeddings=True)
+        fact_vectors = model.encode(facts, batch_size=ENCODE_BATCH_SIZE, convert_to_numpy=True, normalize_embeddings=True)
+        rankings = [top_indices(sentence_vectors @ fact_vector, rerank_depth) for fact_vector in fact_vectors]
+    else:
+        index = LexicalIndex(sentences)
+        rankings = [index.top(fact, rerank_depth) for fact in facts]
+    return sorted({int(sentence_index) for ranking in rankings for sentence_index in ranking})
+
+def embed_evidence(facts, fact_evidence, documents, rerank_depth=None, first_stage=None, batch_size=ENCODE_BATCH_SIZE):
+    """Embeddings of the evidence pages, {document key: (sentences, vectors)}.
+
+    Stored pages are used whole. With a re-rank depth, fresh pages only get the first-stage
+    candidates of the facts citing them embedded; a page whose candidates cover at least half
+    of it is embedded whole and stored instead.
+    """
+    if rerank_depth is None:
+        rerank_depth = RERANK_DEPTH
+    if not rerank_depth:
+        return dict(zip(documents, embed_documents(list(documents.values()), batch_size)))
+
+    embedded = {}
+    citing_facts = {}
+    for key, document in documents.items():
+        stored = stored_embedding(document)
+        if stored is not None:
+            embedded[key] = stored
+        else:
+            citing_facts[key] = []
+    for fact, evidence in zip(facts, fact_evidence):
+        for document in evidence.values():
+            if document and document['text'] and document_key(document) in citing_facts:
+                citing_facts[document_key(document)].append(fact)
+
+    candidates = {}
+    complete = set()
+    for key, page_facts in citing_facts.items():
+        sentences = cached_sentences(documents[key])
+        indices = first_stage_candidates(page_facts, sentences, rerank_depth, first_stage)
+        if sentences and len(indices) * 2 >= len(sentences):
+            candidates[key] = sentences
+            complete.add(key)
+        else:
+            candidates[key] = [sentences[index] for index in indices]
+    sentences = [sentence for page_sentences in candidates.values() for sentence in page_sentences]
+    if sentences:
+        vectors = encode_sentences(sentences, batch_size)
+    else:
+        vectors = np.zeros((0, sentence_model.get().get_sentence_embedding_dimension()), dtype=np.float32)
+    start = 0
+    for key, page_sentences in candidates.items():
+        embedded[key] = (page_sentences, vectors[start:start + len(page_sentences)])
+        start += len(page_sentences)
+        document = documents[key]
+        if key in complete and embedding_store is not None and document.get('page_id') is not None and document.get('revision') is not None:
+            embedding_store.put(document['page_id'], document['revision'], MODEL_NAME, *embedded[key])
+    return embedded
+
+# Score all candidate sentences against the fact in one matrix operation
+def rank_sentences(fact_vector, sentence_vectors, top_k=1):
+    """Returns the top_k (similarity, sentence index) pairs, best first."""
+    if len(sentence_vectors) == 0:
+        return []
+    similarities = sentence_vectors @ fact_vector
+    if top_k == 1:
+        best = int(np.argmax(similarities))
+        return [(float(similarities[best]), best)]
+    k = min(top_k, len(similarities))
+    top = np.argpartition(-similarities, k - 1)[:k]
+    top = top[np.argsort(-similarities[top], kind='stable')]
+    return [(float(similarities[index]), int(index)) for index in top]
+
+def score_sentences(fact_vector, sentences, batch_size=ENCODE_BATCH_SIZE, top_k=1):
+    if not sentences:
+        return []
+    return rank_sentences(fact_vector, encode_sentences(sentences, batch_size), top_k)
+
+def best_evidence(fact_vector, evidence, embedded, max_text_length):
+    """Best matching sentence over a fact's evidence documents as (similarity, source, text), or (0, None, None)."""
+    best = (0, None, None)
+    for source, document in evidence.items():
+        if not document or not document['text']:
+            continue
+        sentences, sentence_vectors = embedded[document_key(document)]
+        ranked = rank_sentences(fact_vector, sentence_vectors)
+        if ranked and ranked[0][0] > best[0]:
+            similarity, index = ranked[0]
+            text = sentences[index]
+            if len(text) > max_text_length:
+                text = text[:max_text_length] + '...'
+            best = (similarity, source, text)
+    return best
+
+def analyze_fact_results(verification_results, max_text_length, batch_size=ENCODE_BATCH_SIZE):
+    """Best evidence sentence over {fact: {source: document}} as (similarity, source, text)."""
+    best = (0, None, None)
     for fact, sources in verification_results.items():
-        fact_embedding = model.encode(fact, convert_to_tensor=True)
-        for source, text in sources.items():
+        evidence = {}
+        for source, document in sources.items():
             if source in ['entities', 'entity_verifications']:
                 continue
-            if text:
-                sentences = sent_tokenize(text)
-                best_similarity = 0
-                best_sentence = ""
-                for sentence in sentences:
-                    sentence_embedding = model.encode(sentence, convert_to_tensor=True)
-                    similarity = util.pytorch_cos_sim(fact_embedding, sentence_embedding).item()
-                    if similarity > best_similarity:
-                        best_similarity = similarity
-                        best_sentence = sentence
-                if best_sentence:
-                    if len(best_sentence) > max_text_length:
-                        best_sentence = best_sentence[:max_text_length] + '...'
-                    analysis.append({
-                        'fact': fact,
-                        'source': source,
-                        'similarity': best_similarity,
-                        'text': best_sentence
-                    })
-    print("done analyzing all sources")
-    # Determine the best result from analysis
-    if analysis:
-        best_result = max(analysis, key=lambda x: x['similarity'])
-        print (best_result['similarity'])
-        print(best_result['source'])
-        print(best_result['text'])
-        return best_result['similarity'], best_result['source'], best_result['text']
-    else:
-        return 0, None, None  # Default values if no suitable analysis found
-
+            evidence[source] = {'text': document} if isinstance(document, str) else document
+        documents = [document for document in evidence.values() if document and document['text']]
+        embedded = {document_key(document): result for document, result in zip(documents, embed_documents(documents, batch_size))}
+        result = best_evidence(encode_sentences([fact])[0], evidence, embedded, max_text_length)
+        if result[0] > best[0]:
+            best = result
+    return best
@@ -0,0 +1,231 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from observability import log_error, log_event
+
+TERMINAL_STATUSES = ('completed', 'failed')
+
+# SQLite-backed store for generation jobs. Every finished topic and lesson is
+# checkpointed together with the running summaries, so a job interrupted by a
+# client disconnect or a worker restart can resume from its last completed topic.
+class JobStore:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                request TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                worker TEXT,
+                lease_expires REAL,
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS topic_checkpoints (
+                job_id TEXT NOT NULL,
+                lesson_index INTEGER NOT NULL,
+                topic_index INTEGER NOT NULL,
+                topic TEXT NOT NULL,
+                previous_sections_summary TEXT,
+                previous_lessons_summary TEXT,
+                PRIMARY KEY (job_id, lesson_index, topic_index)
+            );
+            CREATE TABLE IF NOT EXISTS transition_checkpoints (
+                job_id TEXT NOT NULL,
+                lesson_index INTEGER NOT NULL,
+                transition TEXT NOT NULL,
+                PRIMARY KEY (job_id, lesson_index)
+            );
+            CREATE TABLE IF NOT EXISTS lesson_checkpoints (
+                job_id TEXT NOT NULL,
+                lesson_index INTEGER NOT NULL,
+                lesson TEXT NOT NULL,
+                previous_lessons_summary TEXT,
+                PRIMARY KEY (job_id, lesson_index)
+            );
+            """)
+        # Job files created before leases existed
+        if 'lease_expires' not in [row[1] for row in self._db.execute("PRAGMA table_info(jobs)")]:
+            self._db.execute("ALTER TABLE jobs ADD COLUMN lease_expires REAL")
+        self._db.commit()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            cursor = self._db.execute(sql, params)
+            self._db.commit()
+            return cursor
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def create(self, kind, request):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._execute("INSERT INTO jobs (id, kind, status, request, created, updated) VALUES (?, ?, 'queued', ?, ?, ?)",
+                      (job_id, kind, json.dumps(request), now, now))
+        return job_id
+
+    def claim(self, job_id, worker, previous_worker, lease_seconds):
+        """Atomically takes ownership of a job for lease_seconds; returns False if another worker got there first."""
+        now = time.time()
+        cursor = self._execute(
+            "UPDATE jobs SET worker = ?, lease_expires = ?, status = 'queued', updated = ? "
+            "WHERE id = ? AND worker IS ? AND status NOT IN ('completed', 'failed')",
+            (worker, now + lease_seconds, now, job_id, previous_worker))
+        return cursor.rowcount == 1
+
+    def renew_leases(self, worker, lease_seconds):
+        """Extends the lease of every unfinished job the worker owns."""
+        self._execute("UPDATE jobs SET lease_expires = ? WHERE worker = ? AND status NOT IN ('completed', 'failed')",
+                      (time.time() + lease_seconds, worker))
+
+    def start(self, job_id):
+        self._execute("UPDATE jobs SET status = 'running', updated = ? WHERE id = ?", (time.time(), job_id))
+
+    def finish(self, job_id, result=None, error=None):
+        status = 'failed' if error is not None else 'completed'
+        self._execute("UPDATE jobs SET status = ?, result = ?, error = ?, updated = ? WHERE id = ?",
+                      (status, json.dumps(result) if result is not None else None, error, time.time(), job_id))
+
+    def get(self, job_id):
+        rows = self._query("SELECT id, kind, status, request, result, error, worker, created, updated FROM jobs WHERE id = ?", (job_id,))
+        if not rows:
+            return None
+        job_id, kind, status, request, result, error, worker, created, updated = rows[0]
+        return {
+            'id': job_id,
+            'kind': kind,
+            'status': status,
+            'request': json.loads(request),
+            'result': json.loads(result) if result is not None else None,
+            'error': error,
+            'worker': worker,
+            'created': created,
+            'updated': updated,
+        }
+
+    def orphaned(self):
+        """(job id, worker) of the unfinished jobs whose worker stopped renewing its lease, or that never had one."""
+        return self._query("SELECT id, worker FROM jobs WHERE status IN ('queued', 'running') AND "
+                           "(lease_expires IS NULL OR lease_expires < ?) ORDER BY created", (time.time(),))
+
+    def checkpoint_topic(self, job_id, lesson_index, topic_index, topic, previous_sections_summary, previous_lessons_summary):
+        self._execute("INSERT OR REPLACE INTO topic_checkpoints VALUES (?, ?, ?, ?, ?, ?)",
+                      (job_id, lesson_index, topic_index, json.dumps(topic), previous_sections_summary, previous_lessons_summary))
+
+    def checkpoint_transition(self, job_id, lesson_index, transition):
+        self._execute("INSERT OR REPLACE INTO transition_checkpoints VALUES (?, ?, ?)", (job_id, lesson_index, transition))
+
+    def checkpoint_lesson(self, job_id, lesson_index, lesson, previous_lessons_summary):
+        self._execute("INSERT OR REPLACE INTO lesson_checkpoints VALUES (?, ?, ?, ?)",
+                      (job_id, lesson_index, json.dumps(lesson), previous_lessons_summary))
+
+    def load_checkpoint(self, job_id):
+        """Returns the saved progress of a job in the shape the course generators resume from."""
+        lessons = self._query("SELECT lesson_index, lesson, previous_lessons_summary FROM lesson_checkpoints WHERE job_id = ? ORDER BY lesson_index", (job_id,))
+        topics = self._query("SELECT lesson_index, topic_index, topic, previous_sections_summary, previous_lessons_summary FROM topic_checkpoints WHERE job_id = ? ORDER BY lesson_index, topic_index", (job_id,))
+        checkpoint = {
+            'lessons': {lesson_index: json.loads(lesson) for lesson_index, lesson, _ in lessons},
+            'topics': {},
+            'transitions': self.transitions(job_id),
+            'previous_sections_summary': {},
+            'previous_lessons_summary': lessons[-1][2] if lessons else "",
+        }
+        # Topics of completed lessons are covered by the lesson record
+        for lesson_index, topic_index, topic, previous_sections_summary, _ in topics:
+            if lesson_index in checkpoint['lessons']:
+                continue
+            checkpoint['topics'][(lesson_index, topic_index)] = json.loads(topic)
+            # Rows are ordered, so each lesson ends up with the summary after its last completed topic
+            checkpoint['previous_sections_summary'][lesson_index] = previous_sections_summary
+        return checkpoint
+
+    def topics(self, job_id):
+        """Every checkpointed topic of a job as generated, {(lesson index, topic index): topic}, for incremental regeneration."""
+        rows = self._query("SELECT lesson_index, topic_index, topic FROM topic_checkpoints WHERE job_id = ?", (job_id,))
+        return {(lesson_index, topic_index): json.loads(topic) for lesson_index, topic_index, topic in rows}
+
+    def transitions(self, job_id):
+        rows = self._query("SELECT lesson_index, transition FROM transition_checkpoints WHERE job_id = ?", (job_id,))
+        return dict(rows)
+
+    def progress(self, job_id):
+        lessons = self._query("SELECT COUNT(*) FROM lesson_checkpoints WHERE job_id = ?", (job_id,))[0][0]
+        topics = self._query("SELECT COUNT(*) FROM topic_checkpoints WHERE job_id = ?", (job_id,))[0][0]
+        return {'completed_lessons': lessons, 'completed_topics': topics}
+
+# Runs jobs on a local thread pool. Runners are registered per job kind and are
+# called as runner(job_id, request, checkpoint); their return value is the job result.
+# A worker owns its jobs through a lease it renews every lease_seconds / 3 while it runs;
+# the jobs of a worker that stopped renewing (a crashed process or a replaced container,
+# whatever its hostname) are taken over once the lease expires.
+class JobManager:
+    def __init__(self, store, runners, max_workers=2, lease_seconds=30):
+        self.store = store
+        self.runners = runners
+        self.lease_seconds = lease_seconds
+        # Unique per process start: host names and PIDs are reused across container restarts
+        self.worker = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="jobs")
+        self._heartbeat = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Resumes orphaned jobs now, then keeps renewing this worker's leases and taking over expired ones."""
+        if self._heartbeat is not None:
+            return
+        self.resume_unfinished()
+        self._heartbeat = threading.Thread(target=self._renew, name="jobs-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _renew(self):
+        while not self._stopped.wait(self.lease_seconds / 3):
+            try:
+                self.store.renew_leases(self.worker, self.lease_seconds)
+                self.resume_unfinished()
+            except Exception as e:
+                log_error("jobs.heartbeat_failed", worker=self.worker, error=str(e))
+
+    def submit(self, kind, request):
+        if kind not in self.runners:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = self.store.create(kind, request)
+        if self.store.claim(job_id, self.worker, None, self.lease_seconds):
+            self.executor.submit(self._run, job_id)
+        return job_id
+
+    def resume_unfinished(self):
+        """Picks up jobs whose lease expired, e.g. after a restart. Returns the resumed job ids."""
+        resumed = []
+        for job_id, worker in self.store.orphaned():
+            if self.store.claim(job_id, self.worker, worker, self.lease_seconds):
+                log_event("jobs.resumed", job_id=job_id, previous_worker=worker, worker=self.worker)
+                self.executor.submit(self._run, job_id)
+                resumed.append(job_id)
+        return resumed
+
+    def _run(self, job_id):
+        self.store.start(job_id)
+        job = self.store.get(job_id)
+        try:
+            result = self.runners[job['kind']](job_id, job['request'], self.store.load_checkpoint(job_id))
+        except Exception as e:
+            log_error("jobs.failed", job_id=job_id, kind=job['kind'], error=str(e))
+            self.store.finish(job_id, error=str(e))
+        else:
+            self.store.finish(job_id, result=result)
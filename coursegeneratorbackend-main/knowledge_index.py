@@ -0,0 +1,228 @@
+"""Local sentence-level vector index used to verify facts without the Wikipedia/Wikidata APIs.
+
+Build it once from a Wikipedia/Wikidata extract or any directory of text files:
+    python -m knowledge_index build-index --input extracts/ --output knowledge_index
+    python -m knowledge_index search --index knowledge_index "Threads of a process share its address space."
+
+JSON lines input (WikiExtractor --json output, a Wikidata entity dump, optionally .gz/.bz2)
+needs one document per line with "id", "title" and "text", or a Wikidata entity with labels.
+"""
+import argparse
+from array import array
+import bz2
+import gzip
+import json
+import os
+import time
+
+import numpy as np
+
+TEXT_SUFFIXES = ('.txt', '.md')
+JSONL_SUFFIXES = ('.jsonl', '.json', '.ndjson')
+
+def open_text(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+def is_jsonl(path):
+    name = os.path.basename(path)
+    for compression in ('.gz', '.bz2'):
+        if name.endswith(compression):
+            name = name[:-len(compression)]
+    # WikiExtractor writes JSON lines to files named wiki_00, wiki_01, ...
+    return name.endswith(JSONL_SUFFIXES) or name.startswith('wiki_')
+
+def wikidata_text(entity):
+    label = entity.get('labels', {}).get('en', {}).get('value', entity.get('id', ''))
+    description = entity.get('descriptions', {}).get('en', {}).get('value', '')
+    aliases = [alias['value'] for alias in entity.get('aliases', {}).get('en', [])]
+    text = f"{label} is {description}." if description else f"{label}."
+    if aliases:
+        text += f" {label} is also known as {', '.join(aliases)}."
+    return label, text
+
+def iter_jsonl_documents(path):
+    with open_text(path) as jsonl_file:
+        for line in jsonl_file:
+            # Wikidata dumps are one big JSON array with one entity per line
+            line = line.strip().rstrip(',')
+            if not line or line in ('[', ']'):
+                continue
+            record = json.loads(line)
+            if 'labels' in record:
+                title, text = wikidata_text(record)
+                yield f"wikidata:{record['id']}", title, text
+            elif record.get('text'):
+                yield f"wikipedia:{record.get('id', record.get('title'))}", record.get('title', ''), record['text']
+
+def iter_documents(input_path, input_format='auto'):
+    """Yields (document id, title, text) for every document under input_path."""
+    paths = [input_path]
+    if os.path.isdir(input_path):
+        paths = sorted(os.path.join(root, name) for root, _, names in os.walk(input_path) for name in names)
+    for path in paths:
+        if input_format == 'jsonl' or (input_format == 'auto' and is_jsonl(path)):
+            yield from iter_jsonl_documents(path)
+        elif input_format == 'text' or path.endswith(TEXT_SUFFIXES):
+            with open_text(path) as text_file:
+                relative_path = os.path.relpath(path, input_path) if os.path.isdir(input_path) else os.path.basename(path)
+                title = os.path.splitext(os.path.basename(path))[0].replace('_', ' ')
+                yield f"file:{relative_path}", title, text_file.read()
+
+def build_index(documents, output_dir, encode, split_sentences, model_name, batch_size=4096, min_words=3):
+    """Splits, embeds and writes every document's sentences to output_dir.
+
+    Vectors are appended to a raw float32 file as each batch is encoded, so memory use
+    does not depend on the corpus size. meta.json is written last and marks the index complete.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    meta_path = os.path.join(output_dir, "meta.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    start = time.perf_counter()
+    offsets = array('q', [0])
+    sentence_documents = array('i')
+    pending = []
+    dimension = None
+    document_count = 0
+    with open(os.path.join(output_dir, "vectors.f32"), "wb") as vector_file, \
+            open(os.path.join(output_dir, "sentences.txt"), "wb") as sentence_file, \
+            open(os.path.join(output_dir, "documents.jsonl"), "w", encoding="utf-8") as document_file:
+
+        def flush():
+            nonlocal dimension
+            if not pending:
+                return
+            vectors = np.ascontiguousarray(encode(pending), dtype=np.float32)
+            dimension = vectors.shape[1]
+            vector_file.write(vectors.tobytes())
+            pending.clear()
+
+        for document_id, title, text in documents:
+            document_file.write(json.dumps({'id': document_id, 'title': title}) + "\n")
+            document_count += 1
+            for sentence in split_sentences(text):
+                sentence = " ".join(sentence.split())
+                if len(sentence.split()) < min_words:
+                    continue
+                encoded = sentence.encode("utf-8") + b"\n"
+                sentence_file.write(encoded)
+                offsets.append(offsets[-1] + len(encoded))
+                sentence_documents.append(document_count - 1)
+                pending.append(sentence)
+                if len(pending) >= batch_size:
+                    flush()
+                    print(f"Indexed {len(sentence_documents)} sentences from {document_count} documents")
+        flush()
+
+    np.save(os.path.join(output_dir, "offsets.npy"), np.frombuffer(offsets, dtype=np.int64))
+    np.save(os.path.join(output_dir, "sentence_documents.npy"), np.frombuffer(sentence_documents, dtype=np.int32))
+    meta = {
+        'model': model_name,
+        'dimension': dimension or 0,
+        'sentences': len(sentence_documents),
+        'documents': document_count,
+        'build_seconds': round(time.perf_counter() - start, 1),
+    }
+    with open(meta_path, "w", encoding="utf-8") as meta_file:
+        json.dump(meta, meta_file)
+    return meta
+
+# Read side of the index: vectors and sentence offsets are memory-mapped, so opening an
+# index is cheap and several worker processes share the same pages of the OS cache.
+class KnowledgeIndex:
+    def __init__(self, directory, model_name=None):
+        self.directory = directory
+        meta_path = os.path.join(directory, "meta.json")
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError(f"No complete knowledge index in {directory}; build it with: python -m knowledge_index build-index")
+        with open(meta_path, "r", encoding="utf-8") as meta_file:
+            self.meta = json.load(meta_file)
+        if model_name is not None and self.meta['model'] != model_name:
+            raise ValueError(f"Knowledge index was built with {self.meta['model']}, not {model_name}")
+        count, dimension = self.meta['sentences'], self.meta['dimension']
+        self.vectors = np.memmap(os.path.join(directory, "vectors.f32"), dtype=np.float32, mode="r",
+                                 shape=(count, dimension)) if count else np.zeros((0, dimension), dtype=np.float32)
+        self.offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode="r")
+        self.sentence_documents = np.load(os.path.join(directory, "sentence_documents.npy"), mmap_mode="r")
+        with open(os.path.join(directory, "documents.jsonl"), "r", encoding="utf-8") as document_file:
+            self.documents = [json.loads(line) for line in document_file]
+        self._sentences = open(os.path.join(directory, "sentences.txt"), "rb")
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def sentence(self, index):
+        start, end = int(self.offsets[index]), int(self.offsets[index + 1])
+        return os.pread(self._sentences.fileno(), end - start, start).decode("utf-8").rstrip("\n")
+
+    def document(self, index):
+        return self.documents[int(self.sentence_documents[index])]
+
+    def search(self, query_vectors, top_k=5, block_size=262144):
+        """Exact top_k search by dot product (cosine for unit vectors), one block of the index at a time.
+
+        Returns, per query, a list of (similarity, sentence index) pairs, best first.
+        """
+        query_vectors = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+        queries = len(query_vectors)
+        best_scores = np.empty((queries, 0), dtype=np.float32)
+        best_indices = np.empty((queries, 0), dtype=np.int64)
+        for start in range(0, len(self.vectors), block_size):
+            scores = query_vectors @ self.vectors[start:start + block_size].T
+            k = min(top_k, scores.shape[1])
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+            best_indices = np.concatenate([best_indices, top + start], axis=1)
+            if best_scores.shape[1] > top_k:
+                keep = np.argpartition(-best_scores, top_k - 1, axis=1)[:, :top_k]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_indices = np.take_along_axis(best_indices, keep, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_indices = np.take_along_axis(best_indices, order, axis=1)
+        return [[(float(score), int(index)) for score, index in zip(scores, indices)]
+                for scores, indices in zip(best_scores, best_indices)]
+
+    def passages(self, query_vectors, top_k=5):
+        """Top_k sentences per query as {'similarity', 'text', 'document_id', 'title'} dicts."""
+        return [[{
+            'similarity': similarity,
+            'text': self.sentence(index),
+            'document_id': self.document(index)['id'],
+            'title': self.document(index)['title'],
+        } for similarity, index in hits] for hits in self.search(query_vectors, top_k)]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build-index", help="embed a text corpus into a local index")
+    build.add_argument("--input", required=True, help="directory of text files or JSON lines extracts, or a single file")
+    build.add_argument("--output", default="knowledge_index")
+    build.add_argument("--format", choices=["auto", "text", "jsonl"], default="auto")
+    build.add_argument("--batch-size", type=int, default=4096, help="sentences per encode call")
+    search = commands.add_parser("search", help="print the top passages for a sentence")
+    search.add_argument("--index", default="knowledge_index")
+    search.add_argument("--top-k", type=int, default=5)
+    search.add_argument("query")
+    args = parser.parse_args()
+
+    # The encoder and sentence splitter are the ones fact verification uses at query time
+    from fact_verification import MODEL_NAME, encode_sentences, split_sentences
+    if args.command == "build-index":
+        meta = build_index(iter_documents(args.input, args.format), args.output, encode_sentences,
+                           split_sentences, MODEL_NAME, args.batch_size)
+        print(f"Built index of {meta['sentences']} sentences from {meta['documents']} documents in {meta['build_seconds']}s")
+    else:
+        index = KnowledgeIndex(args.index, MODEL_NAME)
+        start = time.perf_counter()
+        passages = index.passages(encode_sentences([args.query]), args.top_k)[0]
+        print(f"{len(index)} sentences searched in {(time.perf_counter() - start) * 1000:.1f}ms")
+        for passage in passages:
+            print(f"{passage['similarity']:.3f}  [{passage['title']}]  {passage['text']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import math
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"\w+")
+STOPWORDS = frozenset("""
+a an and are as at be been but by can for from has have in into is it its of on or that the their
+them then there these they this to was were which while who will with
+""".split())
+
+def tokenize(text):
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        # Crude plural folding so that "threads" matches "thread"
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+# BM25 index over the sentences of one page, used as the cheap first stage before the
+# sentence transformer: only the top candidates for a fact get embedded and re-ranked.
+class LexicalIndex:
+    def __init__(self, sentences, k1=1.5, b=0.75):
+        self.k1 = k1
+        term_counts = [Counter(tokenize(sentence)) for sentence in sentences]
+        lengths = np.array([sum(counts.values()) for counts in term_counts], dtype=np.float32)
+        average_length = lengths.mean() if len(lengths) and lengths.mean() > 0 else 1.0
+        self.length_norm = k1 * (1 - b + b * lengths / average_length)
+        postings = defaultdict(lambda: ([], []))
+        for index, counts in enumerate(term_counts):
+            for term, count in counts.items():
+                postings[term][0].append(index)
+                postings[term][1].append(count)
+        count = len(sentences)
+        self.postings = {
+            term: (np.array(indices), np.array(frequencies, dtype=np.float32),
+                   math.log(1 + (count - len(indices) + 0.5) / (len(indices) + 0.5)))
+            for term, (indices, frequencies) in postings.items()
+        }
+        self.size = count
+
+    def scores(self, query):
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            indices, frequencies, idf = self.postings[term]
+            scores[indices] += idf * frequencies * (self.k1 + 1) / (frequencies + self.length_norm[indices])
+        return scores
+
+    def top(self, query, k):
+        """Indices of the k best-scoring sentences, best first."""
+        return top_indices(self.scores(query), k)
+
+def top_indices(scores, k):
+    if len(scores) <= k:
+        return list(np.argsort(-scores, kind='stable'))
+    top = np.argpartition(-scores, k - 1)[:k]
+    return list(top[np.argsort(-scores[top], kind='stable')])
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+def cache_key(model, messages, **params):
+    """Content address of a chat completion request: a hash of the model, messages and sampling parameters."""
+    payload = json.dumps({'model': model, 'messages': messages, 'params': params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+# In-process LRU tier
+class MemoryTier:
+    def __init__(self, max_entries=256, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, created = entry
+            if self.ttl and time.time() - created > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, created=None):
+        with self._lock:
+            self._entries[key] = (value, created or time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+# SQLite tier shared by all processes using the same directory, bounded in bytes with LRU eviction
+class DiskTier:
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, ttl=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(directory, "responses.sqlite"), check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                nbytes INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        self._db.commit()
+
+    def get(self, key):
+        """Returns (value, created) or None on a miss."""
+        with self._lock:
+            row = self._db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if self.ttl and time.time() - created > self.ttl:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            self._db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            return json.loads(value), created
+
+    def put(self, key, value, created=None):
+        data = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                             (key, data, len(data.encode("utf-8")), created or now, now))
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        if self.ttl:
+            self._db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+        total = self._db.execute("SELECT COALESCE(SUM(nbytes), 0) FROM responses").fetchone()[0]
+        while total > self.max_bytes:
+            row = self._db.execute("SELECT key, nbytes FROM responses ORDER BY last_used LIMIT 1").fetchone()
+            if row is None:
+                break
+            self._db.execute("DELETE FROM responses WHERE key = ?", (row[0],))
+            self.evictions += 1
+            total -= row[1]
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+# Two-tier cache of LLM responses keyed by cache_key(). Lookups try memory first, then
+# disk; a disk hit is promoted to memory. Either tier can be left out.
+class ResponseCache:
+    def __init__(self, memory=None, disk=None):
+        self.memory = memory
+        self.disk = disk
+        self.hits = {'memory': 0, 'disk': 0}
+        self.misses = 0
+        self.bypassed = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        value = self.memory.get(key) if self.memory is not None else None
+        if value is not None:
+            self._count('memory')
+            return value
+        entry = self.disk.get(key) if self.disk is not None else None
+        if entry is not None:
+            value, created = entry
+            if self.memory is not None:
+                self.memory.put(key, value, created)
+            self._count('disk')
+            return value
+        self._count(None)
+        return None
+
+    def put(self, key, value):
+        if self.memory is not None:
+            self.memory.put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def _count(self, tier):
+        with self._lock:
+            if tier is None:
+                self.misses += 1
+            else:
+                self.hits[tier] += 1
+
+    def bypass(self):
+        # The caller wants a fresh response; it is still stored for later lookups
+        with self._lock:
+            self.bypassed += 1
+
+    def stats(self):
+        with self._lock:
+            hits = sum(self.hits.values())
+            lookups = hits + self.misses
+            return {
+                'hits': hits,
+                'memory_hits': self.hits['memory'],
+                'disk_hits': self.hits['disk'],
+                'misses': self.misses,
+                'bypassed': self.bypassed,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'memory_entries': len(self.memory) if self.memory is not None else 0,
+                'disk_entries': len(self.disk) if self.disk is not None else 0,
+                'evictions': sum(tier.evictions for tier in (self.memory, self.disk) if tier is not None),
+            }
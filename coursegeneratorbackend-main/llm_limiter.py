@@ -0,0 +1,369 @@
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+
+import openai
+
+import observability
+from rolling_summary import count_tokens
+
+# Priorities: a waiting interactive call always goes before waiting bulk calls
+INTERACTIVE, BULK = 0, 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+# Completion tokens counted for a call that does not set max_tokens
+DEFAULT_COMPLETION_TOKENS = 1024
+# Transient failures retried with plain exponential backoff, without slowing other calls down
+TRANSIENT_ERRORS = (openai.APIConnectionError, openai.InternalServerError)
+
+def estimate_tokens(params):
+    """Tokens a call counts against the per-minute budget before its usage is known: the prompt plus max_tokens."""
+    prompt_tokens = sum(count_tokens(message.get('content') or '') for message in params.get('messages', []))
+    return prompt_tokens + (params.get('max_tokens') or DEFAULT_COMPLETION_TOKENS)
+
+def retry_after(error):
+    """Seconds the API asked us to wait in a 429 response, or None."""
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except ValueError:
+        pass
+    return None
+
+def quota_exhausted(error):
+    """A 429 for an exhausted quota, which no amount of waiting fixes."""
+    return getattr(error, 'code', None) == 'insufficient_quota'
+
+# Calls started in the last period in this process: [start time, tokens, still in window]
+class LocalWindow:
+    def __init__(self, period=60.0):
+        self.period = period
+        self.cooldown_until = 0.0
+        self._entries = deque()
+        self._tokens = 0
+
+    def _purge(self, now):
+        while self._entries and now - self._entries[0][0] >= self.period:
+            entry = self._entries.popleft()
+            entry[2] = False
+            self._tokens -= entry[1]
+
+    def try_add(self, now, tokens, max_requests, max_tokens):
+        """Counts a call if it fits both budgets; returns (entry, 0) or (None, seconds until it may fit)."""
+        self._purge(now)
+        wait = wait_for_room(self._entries, self._tokens, now, self.period, tokens, max_requests, max_tokens)
+        if wait:
+            return None, wait
+        entry = [now, tokens, True]
+        self._entries.append(entry)
+        self._tokens += tokens
+        return entry, 0
+
+    def adjust(self, entry, tokens):
+        if entry[2]:
+            self._tokens += tokens - entry[1]
+        entry[1] = tokens
+
+    def usage(self, now):
+        self._purge(now)
+        return len(self._entries), self._tokens
+
+    def get_cooldown(self):
+        return self.cooldown_until
+
+    def set_cooldown(self, until):
+        self.cooldown_until = max(self.cooldown_until, until)
+
+# The same window in a SQLite file, shared by every process (server workers, job runners)
+# pointing at it, so that together they stay within the account's limits
+class SQLiteWindow:
+    def __init__(self, path, period=60.0):
+        self.period = period
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS calls (id INTEGER PRIMARY KEY AUTOINCREMENT, started REAL NOT NULL, tokens INTEGER NOT NULL);
+            CREATE INDEX IF NOT EXISTS calls_started ON calls (started);
+            CREATE TABLE IF NOT EXISTS state (name TEXT PRIMARY KEY, value REAL NOT NULL);
+            """)
+
+    def try_add(self, now, tokens, max_requests, max_tokens):
+        # BEGIN IMMEDIATE takes the write lock, so checking and counting are atomic across processes
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            self._db.execute("DELETE FROM calls WHERE started <= ?", (now - self.period,))
+            entries = self._db.execute("SELECT started, tokens FROM calls ORDER BY started").fetchall()
+            wait = wait_for_room(entries, sum(entry_tokens for _, entry_tokens in entries), now, self.period,
+                                 tokens, max_requests, max_tokens)
+            entry = None
+            if not wait:
+                entry = self._db.execute("INSERT INTO calls (started, tokens) VALUES (?, ?)", (now, tokens)).lastrowid
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        return entry, wait
+
+    def adjust(self, entry, tokens):
+        self._db.execute("UPDATE calls SET tokens = ? WHERE id = ?", (tokens, entry))
+
+    def usage(self, now):
+        requests, tokens = self._db.execute("SELECT COUNT(*), COALESCE(SUM(tokens), 0) FROM calls WHERE started > ?",
+                                            (now - self.period,)).fetchone()
+        return requests, tokens
+
+    def get_cooldown(self):
+        row = self._db.execute("SELECT value FROM state WHERE name = 'cooldown_until'").fetchone()
+        return row[0] if row else 0.0
+
+    def set_cooldown(self, until):
+        self._db.execute("INSERT INTO state (name, value) VALUES ('cooldown_until', ?) "
+                         "ON CONFLICT(name) DO UPDATE SET value = MAX(value, excluded.value)", (until,))
+
+def wait_for_room(entries, used_tokens, now, period, tokens, max_requests, max_tokens):
+    """Seconds until a call of tokens fits next to the calls in the window, 0 if it fits now.
+
+    entries are (start, tokens, ...) of the calls in the window, oldest first.
+    """
+    wait = 0.0
+    if max_requests and len(entries) >= max_requests:
+        wait = entries[len(entries) - max_requests][0] + period - now
+    # A call larger than the whole budget goes through once nothing else is in the window
+    if max_tokens and entries and used_tokens + tokens > max_tokens:
+        freed = 0
+        for entry in entries:
+            start, entry_tokens = entry[0], entry[1]
+            freed += entry_tokens
+            if used_tokens - freed + tokens <= max_tokens or freed == used_tokens:
+                wait = max(wait, start + period - now)
+                break
+    return max(wait, 0.001) if wait else 0.0
+
+# Process-wide admission control for OpenAI calls. Every call first reserves room in the
+# requests-per-minute and tokens-per-minute budgets (prompt plus max_tokens, corrected to
+# the reported usage afterwards); calls that do not fit wait in a queue ordered by priority,
+# then arrival. A 429 pauses all calls for the time the API asks for (or an exponential
+# backoff) and halves the effective budgets, which then recover with every successful call.
+class LLMRateLimiter:
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, window=None, max_retries=5, backoff=1.0,
+                 min_rate_factor=0.1, recovery=0.05):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window = window or LocalWindow()
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.min_rate_factor = min_rate_factor
+        self.recovery = recovery
+        self.rate_factor = 1.0
+        self._rate_limit_streak = 0
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._counts = {"calls": 0, "rate_limited": 0, "retries": 0}
+        self._waited = {name: {"calls": 0, "seconds": 0.0, "max_seconds": 0.0} for name in PRIORITY_NAMES.values()}
+
+    def _limits(self):
+        def scaled(limit):
+            return max(1, int(limit * self.rate_factor)) if limit else None
+        return scaled(self.requests_per_minute), scaled(self.tokens_per_minute)
+
+    def _try_acquire(self, ticket, tokens):
+        """With the lock held: (window entry, 0) once the call may start, else (None, seconds to wait at most)."""
+        if self._waiting[0] != ticket:
+            return None, 0.1
+        now = time.time()
+        cooldown = self.window.get_cooldown() - now
+        if cooldown > 0:
+            return None, cooldown
+        entry, wait = self.window.try_add(now, tokens, *self._limits())
+        if entry is None:
+            return None, wait
+        heapq.heappop(self._waiting)
+        self._counts["calls"] += 1
+        self._changed.notify_all()
+        return entry, 0
+
+    def _leave_queue(self, ticket):
+        with self._lock:
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._changed.notify_all()
+
+    def _record_wait(self, priority, seconds):
+        name = PRIORITY_NAMES[priority]
+        with self._lock:
+            waited = self._waited[name]
+            waited["calls"] += 1
+            waited["seconds"] += seconds
+            waited["max_seconds"] = max(waited["max_seconds"], seconds)
+        observability.llm_queue_seconds.observe(seconds, priority=name)
+
+    def acquire(self, tokens, priority=BULK):
+        """Blocks until the call may start; returns the window entry to settle() with the actual usage."""
+        start = time.perf_counter()
+        with self._lock:
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._waiting, ticket)
+        try:
+            with self._lock:
+                while True:
+                    entry, wait = self._try_acquire(ticket, tokens)
+                    if entry is not None:
+                        break
+                    self._changed.wait(wait)
+        except BaseException:
+            self._leave_queue(ticket)
+            raise
+        self._record_wait(priority, time.perf_counter() - start)
+        return entry
+
+    def _attempt(self, ticket, tokens):
+        with self._lock:
+            return self._try_acquire(ticket, tokens)
+
+    async def off_loop(self, function, *args):
+        """Runs function(*args) in a thread when it may wait on the SQLite window's write lock, which
+        another process can hold for up to the connection timeout, so the event loop is never blocked."""
+        if isinstance(self.window, SQLiteWindow):
+            return await asyncio.to_thread(function, *args)
+        return function(*args)
+
+    async def acquire_async(self, tokens, priority=BULK):
+        """acquire for the event loop: polls instead of blocking a thread per waiting call."""
+        start = time.perf_counter()
+        with self._lock:
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._waiting, ticket)
+        try:
+            while True:
+                entry, wait = await self.off_loop(self._attempt, ticket, tokens)
+                if entry is not None:
+                    break
+                await asyncio.sleep(min(wait, 0.1))
+        except BaseException:
+            self._leave_queue(ticket)
+            raise
+        self._record_wait(priority, time.perf_counter() - start)
+        return entry
+
+    def settle(self, entry, tokens):
+        """Replaces the estimated tokens of a started call with its reported usage."""
+        with self._lock:
+            self.window.adjust(entry, tokens)
+            self._changed.notify_all()
+
+    def succeeded(self):
+        with self._lock:
+            self._rate_limit_streak = 0
+            self.rate_factor = min(1.0, self.rate_factor + self.recovery)
+
+    def rate_limited(self, error):
+        """Backs every caller off after a 429; returns the pause in seconds."""
+        with self._lock:
+            self._counts["rate_limited"] += 1
+            self._rate_limit_streak += 1
+            self.rate_factor = max(self.min_rate_factor, self.rate_factor / 2)
+            delay = retry_after(error)
+            if delay is None:
+                delay = self.backoff * 2 ** (self._rate_limit_streak - 1) * (1 + random.random())
+            self.window.set_cooldown(time.time() + delay)
+            self._changed.notify_all()
+        observability.llm_rate_limited.inc()
+        observability.log_warning("llm.rate_limited", pause_seconds=round(delay, 2), rate_factor=round(self.rate_factor, 3))
+        return delay
+
+    def transient_failure(self, attempt):
+        with self._lock:
+            self._counts["retries"] += 1
+        return self.backoff * 2 ** attempt * (1 + random.random())
+
+    def stats(self):
+        with self._lock:
+            requests, tokens = self.window.usage(time.time())
+            max_requests, max_tokens = self._limits()
+            waiting = {name: sum(1 for priority, _ in self._waiting if priority == value) for value, name in PRIORITY_NAMES.items()}
+            stats = dict(self._counts, requests_last_minute=requests, tokens_last_minute=tokens,
+                         requests_per_minute=max_requests, tokens_per_minute=max_tokens,
+                         rate_factor=round(self.rate_factor, 3),
+                         cooldown_seconds=round(max(0.0, self.window.get_cooldown() - time.time()), 3),
+                         waiting=waiting, waited={name: dict(waited) for name, waited in self._waited.items()})
+        for waited in stats["waited"].values():
+            waited["seconds"] = round(waited["seconds"], 3)
+            waited["max_seconds"] = round(waited["max_seconds"], 3)
+        return stats
+
+def settle_usage(limiter, entry, usage):
+    if usage is not None and getattr(usage, 'total_tokens', None) is not None:
+        limiter.settle(entry, usage.total_tokens)
+
+async def asettle_usage(limiter, entry, usage):
+    await limiter.off_loop(settle_usage, limiter, entry, usage)
+
+def create_with_limits(limiter, create, params, priority=BULK):
+    """create(**params) within the limiter's budgets, retrying 429s and transient errors.
+
+    Returns the response and its window entry; a non-streamed response is settled here,
+    a stream is settled by the caller once its usage chunk has arrived.
+    """
+    tokens = estimate_tokens(params)
+    for attempt in itertools.count():
+        entry = limiter.acquire(tokens, priority)
+        try:
+            response = create(**params)
+        except openai.RateLimitError as e:
+            if attempt >= limiter.max_retries or quota_exhausted(e):
+                raise
+            limiter.rate_limited(e)
+            continue
+        except TRANSIENT_ERRORS:
+            if attempt >= limiter.max_retries:
+                raise
+            time.sleep(limiter.transient_failure(attempt))
+            continue
+        limiter.succeeded()
+        if not params.get('stream'):
+            settle_usage(limiter, entry, getattr(response, 'usage', None))
+        return response, entry
+
+async def acreate_with_limits(limiter, create, params, priority=BULK):
+    """create_with_limits for an async create."""
+    tokens = estimate_tokens(params)
+    for attempt in itertools.count():
+        entry = await limiter.acquire_async(tokens, priority)
+        try:
+            response = await create(**params)
+        except openai.RateLimitError as e:
+            if attempt >= limiter.max_retries or quota_exhausted(e):
+                raise
+            await limiter.off_loop(limiter.rate_limited, e)
+            continue
+        except TRANSIENT_ERRORS:
+            if attempt >= limiter.max_retries:
+                raise
+            await asyncio.sleep(limiter.transient_failure(attempt))
+            continue
+        limiter.succeeded()
+        if not params.get('stream'):
+            await asettle_usage(limiter, entry, getattr(response, 'usage', None))
+        return response, entry
+
+def limiter_from_env():
+    """LLMRateLimiter configured from LLM_RPM_LIMIT, LLM_TPM_LIMIT, LLM_MAX_RETRIES and LLM_LIMITER_DB."""
+    path = os.getenv("LLM_LIMITER_DB", "")
+    return LLMRateLimiter(
+        requests_per_minute=int(os.getenv("LLM_RPM_LIMIT", "0")) or None,
+        tokens_per_minute=int(os.getenv("LLM_TPM_LIMIT", "0")) or None,
+        window=SQLiteWindow(path) if path else None,
+        max_retries=int(os.getenv("LLM_MAX_RETRIES", "5")),
+    )
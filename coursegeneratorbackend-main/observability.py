@@ -0,0 +1,328 @@
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Finished and running traces kept in memory for /traces, oldest dropped first
+TRACE_HISTORY = int(os.getenv("TRACE_HISTORY", "200"))
+# Spans listed one by one in a trace report; stage totals always cover all of them
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "5000"))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Metrics in the Prometheus text exposition format, without the client library:
+# counters and histograms keyed by their label values, rendered on every scrape.
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in sorted(self._values.items())]
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # {label values: [count per bucket..., count, sum]}
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            counts = self._values.setdefault(key, [0] * (len(self.buckets) + 2))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, list(counts)) for key, counts in self._values.items())
+        samples = []
+        for key, counts in values:
+            for bound, count in zip(self.buckets, counts):
+                samples.append((f"{self.name}_bucket", key + (format_value(bound),), count))
+            samples.append((f"{self.name}_bucket", key + ('+Inf',), counts[-2]))
+            samples.append((f"{self.name}_count", key, counts[-2]))
+            samples.append((f"{self.name}_sum", key, counts[-1]))
+        return samples
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, labelnames=()):
+        self.metrics.append(Counter(name, help, labelnames))
+        return self.metrics[-1]
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.metrics.append(Histogram(name, help, labelnames, buckets))
+        return self.metrics[-1]
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            labelnames = metric.labelnames + (('le',) if metric.kind == 'histogram' else ())
+            for name, key, value in metric.samples():
+                labels = ','.join(f'{label}="{escape_label(part)}"' for label, part in zip(labelnames, key))
+                lines.append(f"{name}{{{labels}}} {format_value(value)}" if labels else f"{name} {format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+llm_requests = registry.counter("coursegen_llm_requests_total", "LLM calls by call label and response cache status", ("label", "cache"))
+llm_tokens = registry.counter("coursegen_llm_tokens_total", "Tokens billed for LLM calls (cached_prompt: prompt tokens reused from the API's prompt cache)", ("label", "type"))
+llm_cost = registry.counter("coursegen_llm_cost_usd_total", "Estimated cost of LLM calls in USD", ("label",))
+llm_seconds = registry.histogram("coursegen_llm_request_seconds", "Latency of LLM calls, cache lookup included", ("label", "cache"))
+stage_seconds = registry.histogram("coursegen_stage_seconds", "Duration of fact-verification and other pipeline stages", ("stage",))
+stage_errors = registry.counter("coursegen_stage_errors_total", "Stages that raised an exception", ("stage",))
+llm_queue_seconds = registry.histogram("coursegen_llm_queue_seconds", "Time LLM calls waited for the rate limiter", ("priority",))
+llm_rate_limited = registry.counter("coursegen_llm_rate_limited_total", "429 responses from the OpenAI API")
+http_seconds = registry.histogram("coursegen_http_request_seconds", "Time to the response of HTTP requests (headers, for streamed responses)", ("endpoint", "status"))
+
+# One JSON object per line on stderr for every LLM call and stage
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {"time": round(record.created, 3), "level": record.levelname, "event": record.getMessage()}
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+logger = logging.getLogger("coursegen")
+if not logger.handlers:
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+def log_event(event, level=logging.INFO, exc_info=None, **fields):
+    logger.log(level, event, exc_info=exc_info, extra={'fields': fields})
+
+def log_warning(event, **fields):
+    log_event(event, logging.WARNING, **fields)
+
+def log_error(event, **fields):
+    """An ERROR event with the traceback of the exception being handled."""
+    log_event(event, logging.ERROR, exc_info=True, **fields)
+
+# A trace collects the spans of one course plan, lesson generation or fact-checking request.
+# The active trace is a context variable, so it follows the request into the threads of a
+# TaskScheduler (which copies the context) but not into unrelated requests.
+class Trace:
+    def __init__(self, trace_id=None, kind="request"):
+        self.id = trace_id or uuid.uuid4().hex
+        self.kind = kind
+        self.started = time.time()
+        self.finished = None
+        self.status = "running"
+        self.error = None
+        self.spans = []
+        self.span_count = 0
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, started, attrs):
+        stage = f"llm.{attrs['label']}" if name == 'llm' else name
+        with self._lock:
+            self.span_count += 1
+            if len(self.spans) < TRACE_MAX_SPANS:
+                self.spans.append(dict(attrs, stage=stage, offset=round(started - self.started, 3), seconds=round(seconds, 4)))
+            totals = self.stages.setdefault(stage, {"count": 0, "seconds": 0.0})
+            totals["count"] += 1
+            totals["seconds"] += seconds
+            for field in ("prompt_tokens", "cached_prompt_tokens", "completion_tokens", "cost_usd"):
+                if field in attrs:
+                    totals[field] = totals.get(field, 0) + attrs[field]
+            if attrs.get('cache') == 'hit':
+                totals["cached"] = totals.get("cached", 0) + 1
+
+    def finish(self, error=None, status=None):
+        self.finished = time.time()
+        self.status = status or ("failed" if error is not None else "completed")
+        self.error = str(error) if error is not None else None
+
+    def summary(self):
+        return {"trace_id": self.id, "kind": self.kind, "status": self.status, "started": self.started,
+                "seconds": round((self.finished or time.time()) - self.started, 3), "spans": self.span_count}
+
+    def report(self):
+        """Where the time and tokens of the traced request went, per stage and in total.
+
+        Stage seconds are summed over spans, so with concurrent calls they add up to more than the wall time.
+        """
+        with self._lock:
+            stages = {stage: dict(totals) for stage, totals in self.stages.items()}
+            spans = list(self.spans)
+        totals = {"llm_calls": 0, "cached": 0, "prompt_tokens": 0, "cached_prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0}
+        for stage, stage_totals in stages.items():
+            stage_totals["seconds"] = round(stage_totals["seconds"], 3)
+            if stage.startswith("llm."):
+                totals["llm_calls"] += stage_totals["count"]
+                for field in ("cached", "prompt_tokens", "cached_prompt_tokens", "completion_tokens", "cost_usd"):
+                    totals[field] += stage_totals.get(field, 0)
+            if "cost_usd" in stage_totals:
+                stage_totals["cost_usd"] = round(stage_totals["cost_usd"], 6)
+        totals["cost_usd"] = round(totals["cost_usd"], 6)
+        report = self.summary()
+        report.update(error=self.error, totals=totals,
+                      stages=dict(sorted(stages.items(), key=lambda item: -item[1]["seconds"])),
+                      span_list=spans)
+        return report
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+traces = OrderedDict()
+traces_lock = threading.Lock()
+
+def start_trace(trace_id=None, kind="request"):
+    trace = Trace(trace_id, kind)
+    with traces_lock:
+        traces[trace.id] = trace
+        while len(traces) > TRACE_HISTORY:
+            traces.popitem(last=False)
+    return trace
+
+def get_trace(trace_id):
+    with traces_lock:
+        return traces.get(trace_id)
+
+def list_traces():
+    with traces_lock:
+        return [trace.summary() for trace in reversed(traces.values())]
+
+@contextmanager
+def activate(trace):
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        current_trace.reset(token)
+
+@contextmanager
+def trace(trace_id=None, kind="request"):
+    """Starts a trace and makes it the active one for the enclosed block."""
+    new_trace = start_trace(trace_id, kind)
+    with activate(new_trace):
+        try:
+            yield new_trace
+        except Exception as e:
+            new_trace.finish(e)
+            raise
+    new_trace.finish()
+
+def traced_events(trace, events):
+    """Runs a generator of events with trace active, one step at a time.
+
+    A streamed response may be iterated from different threads or contexts (e.g. under
+    the ASGI server), so the trace is set and reset around every step instead of once.
+    """
+    iterator = iter(events)
+    try:
+        while True:
+            with activate(trace):
+                try:
+                    event = next(iterator)
+                except StopIteration:
+                    trace.finish()
+                    return
+            yield event
+    except Exception as e:
+        trace.finish(e)
+        raise
+    finally:
+        if trace.status == "running":
+            trace.finish(status="cancelled")
+
+def record_span(name, seconds, started, attrs, log=True):
+    """Records a finished span in the metrics, the active trace (if any) and the log.
+
+    name 'llm' marks an LLM call; its attrs carry the label, cache status, tokens and cost.
+    """
+    if name == 'llm':
+        llm_requests.inc(label=attrs['label'], cache=attrs['cache'])
+        llm_seconds.observe(seconds, label=attrs['label'], cache=attrs['cache'])
+        llm_tokens.inc(attrs.get('prompt_tokens', 0), label=attrs['label'], type='prompt')
+        llm_tokens.inc(attrs.get('cached_prompt_tokens', 0), label=attrs['label'], type='cached_prompt')
+        llm_tokens.inc(attrs.get('completion_tokens', 0), label=attrs['label'], type='completion')
+        llm_cost.inc(attrs.get('cost_usd', 0), label=attrs['label'])
+    else:
+        stage_seconds.observe(seconds, stage=name)
+        if 'error' in attrs:
+            stage_errors.inc(stage=name)
+    active = current_trace.get()
+    if active is not None:
+        active.add(name, seconds, started, attrs)
+    collected = collected_spans.get()
+    if collected is not None:
+        collected.append((name, seconds, started, attrs))
+    if log:
+        fields = dict(attrs, seconds=round(seconds, 4))
+        if active is not None:
+            fields['trace_id'] = active.id
+        log_event(name, **fields)
+
+@contextmanager
+def span(name, **attrs):
+    """Times the enclosed block as a stage; attributes added to the yielded dict are recorded with it."""
+    started = time.time()
+    start = time.perf_counter()
+    try:
+        yield attrs
+    except Exception as e:
+        attrs['error'] = str(e)
+        raise
+    finally:
+        record_span(name, time.perf_counter() - start, started, attrs)
+
+# Spans recorded in a worker process are sent back with its results and replayed in the
+# parent, whose metrics and traces are the ones served.
+collected_spans = contextvars.ContextVar("collected_spans", default=None)
+
+@contextmanager
+def collect_spans():
+    spans = []
+    token = collected_spans.set(spans)
+    try:
+        yield spans
+    finally:
+        collected_spans.reset(token)
+
+def replay_spans(spans):
+    for name, seconds, started, attrs in spans:
+        record_span(name, seconds, started, attrs, log=False)
+
+def render_metrics():
+    return registry.render()
@@ -0,0 +1,142 @@
+"""Incremental regeneration of a course after edits to its course plan.
+
+Each topic is fingerprinted by what its prompt is made of: its own title, description and
+subtopics, and its continuity context, i.e. the titles and descriptions of the topics before
+it in its lesson and of the lessons before it (what the plan outline of parallel mode and
+the summaries of sequential mode are made of). A topic of the edited plan whose fingerprints
+match a topic of a previous result is taken over as it is; every other topic, and the
+transition of every lesson whose first topic or neighbouring lesson changed, is generated
+again. Which calls that saves is known before anything runs.
+"""
+import hashlib
+import json
+
+import prompts
+from rolling_summary import count_tokens
+
+# Tokens of a transition prompt's lesson titles and start of the lesson (1500 characters), and of
+# the paragraph it asks for (at most 80 words)
+TRANSITION_PROMPT_TOKENS = 420
+TRANSITION_TOKENS = 110
+
+def fingerprint(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+def topic_fingerprints(course_plan):
+    """{(lesson index, topic index): (own fingerprint, context fingerprint)} of every topic of the plan.
+
+    Context fingerprints are chained, so a change upstream reaches every topic after it and no other.
+    """
+    fingerprints = {}
+    lessons_context = fingerprint()
+    for lesson_index, lesson in enumerate(course_plan['course']):
+        topics_context = fingerprint()
+        for topic_index, topic in enumerate(lesson['topics']):
+            own = fingerprint(topic.get('title'), topic.get('description'), topic.get('subtopics'))
+            fingerprints[lesson_index, topic_index] = (own, fingerprint(lessons_context, topics_context))
+            topics_context = fingerprint(topics_context, topic.get('title'), topic.get('description'))
+        lessons_context = fingerprint(lessons_context, lesson.get('lesson_title'), lesson.get('description'))
+    return fingerprints
+
+def transition_fingerprint(course_plan, lesson_index, first_topic):
+    previous_lesson = course_plan['course'][lesson_index - 1]
+    return fingerprint(previous_lesson.get('lesson_title'), previous_lesson.get('description'),
+                       course_plan['course'][lesson_index].get('lesson_title'), first_topic)
+
+def plan_regeneration(previous_plan, previous_topics, previous_transitions, course_plan, continuity_pass=True,
+                      regenerate_context_changes=True):
+    """Compares course_plan with the plan of a previous result and decides what can be reused.
+
+    previous_topics holds the previous result's topics as generated, {(lesson index, topic index):
+    topic}, without transitions, which come separately as {lesson index: text}. Topics are matched
+    by fingerprint, not position, so moved lessons and topics are found as long as their context is
+    the same. With regenerate_context_changes off, a topic is also reused when only its context changed.
+
+    Returns {"topics": {(lesson index, topic index): reused topic}, "transitions": {lesson index: reused
+    transition}, "changes": [{"lesson_index", "topic_index", "status", "reused"}]} where status is
+    "unchanged", "changed", "context_changed", "new" or "failed" (no usable previous topic).
+    """
+    previous_fingerprints = topic_fingerprints(previous_plan)
+    by_fingerprints = {}
+    by_own = {}
+    for key, (own, context) in previous_fingerprints.items():
+        topic = previous_topics.get(key)
+        if topic is not None and 'generation_error' not in topic:
+            by_fingerprints.setdefault((own, context), key)
+            by_own.setdefault(own, key)
+    old_transitions = {}
+    for lesson_index, transition in previous_transitions.items():
+        if (lesson_index, 0) in previous_fingerprints:
+            first_topic = previous_fingerprints[lesson_index, 0][0]
+            old_transitions[transition_fingerprint(previous_plan, lesson_index, first_topic)] = transition
+
+    fingerprints = topic_fingerprints(course_plan)
+    reused_topics = {}
+    changes = []
+    for (lesson_index, topic_index), (own, context) in fingerprints.items():
+        source = by_fingerprints.get((own, context))
+        previous = previous_fingerprints.get((lesson_index, topic_index))
+        if source is not None:
+            status = "unchanged"
+        elif own in by_own:
+            status = "context_changed"
+            if not regenerate_context_changes:
+                source = by_own[own]
+        elif previous is not None and previous[0] == own:
+            status = "failed"
+        elif previous is not None:
+            status = "changed"
+        else:
+            status = "new"
+        if source is not None:
+            reused_topics[lesson_index, topic_index] = previous_topics[source]
+        changes.append({"lesson_index": lesson_index, "topic_index": topic_index, "status": status,
+                        "reused": source is not None})
+
+    # A transition is written from the lesson's first topic, so it is only reused along with that topic
+    reused_transitions = {}
+    if continuity_pass:
+        for lesson_index in range(1, len(course_plan['course'])):
+            if (lesson_index, 0) not in reused_topics:
+                continue
+            transition = old_transitions.get(transition_fingerprint(course_plan, lesson_index, fingerprints[lesson_index, 0][0]))
+            if transition is not None:
+                reused_transitions[lesson_index] = transition
+    return {"topics": reused_topics, "transitions": reused_transitions, "changes": changes}
+
+def estimate(course_plan, plan, previous_topics, cost, continuity_pass=True):
+    """LLM calls, tokens and cost of the incremental run against generating the whole course again,
+    both in parallel mode (one call per topic and transition).
+
+    Prompt tokens are counted on the topic prompts with the plan outline as continuity context;
+    completion tokens are those of the previous topic at the same place, or their average for new ones.
+    """
+    topic_tokens = [count_tokens(json.dumps(topic)) for topic in previous_topics.values() if 'generation_error' not in topic]
+    average_tokens = sum(topic_tokens) // len(topic_tokens) if topic_tokens else 1500
+    system_tokens = count_tokens(prompts.TOPIC_SYSTEM)
+    totals = {"full": [0, 0, 0], "incremental": [0, 0, 0]}
+
+    def add(regenerated, prompt_tokens, completion_tokens):
+        for run in ("full", "incremental") if regenerated else ("full",):
+            totals[run][0] += 1
+            totals[run][1] += prompt_tokens
+            totals[run][2] += completion_tokens
+
+    lessons = course_plan['course']
+    for lesson_index, lesson in enumerate(lessons):
+        previous_lessons = prompts.plan_outline(lessons[:lesson_index], 'lesson_title')
+        for topic_index, topic in enumerate(lesson['topics']):
+            previous_sections = prompts.plan_outline(lesson['topics'][:topic_index], 'title')
+            previous = previous_topics.get((lesson_index, topic_index))
+            add((lesson_index, topic_index) not in plan['topics'],
+                system_tokens + count_tokens(prompts.topic_prompt(topic, previous_sections, previous_lessons)),
+                count_tokens(json.dumps(previous)) if previous is not None else average_tokens)
+        if continuity_pass and lesson_index > 0 and lesson['topics']:
+            add(lesson_index not in plan['transitions'], count_tokens(prompts.TRANSITION_SYSTEM) + TRANSITION_PROMPT_TOKENS, TRANSITION_TOKENS)
+
+    report = {}
+    for run, (calls, prompt_tokens, completion_tokens) in totals.items():
+        report[run] = {"calls": calls, "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                       "cost_usd": round(cost(prompt_tokens, completion_tokens), 4)}
+    report["saved"] = {field: round(report["full"][field] - report["incremental"][field], 4) for field in report["full"]}
+    return report
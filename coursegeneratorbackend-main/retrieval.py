@@ -0,0 +1,85 @@
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from observability import log_warning
+
+# Status codes worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Thread-pool HTTP client shared by all Wikipedia/Wikidata lookups. It keeps one
+# keep-alive session, limits the number of concurrent requests per host, retries
+# transient failures with exponential backoff and collapses identical in-flight requests.
+class RetrievalClient:
+    def __init__(self, max_workers=16, per_host=4, timeout=10, retries=3, backoff=0.5,
+                 user_agent="coursegenerator-factcheck/1.0"):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.per_host = per_host
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = user_agent
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="retrieval")
+        self.stats = {'requests': 0, 'retries': 0, 'deduplicated': 0, 'failures': 0}
+        self._lock = threading.Lock()
+        self._host_slots = defaultdict(lambda: threading.BoundedSemaphore(self.per_host))
+        self._in_flight = {}
+
+    def get_json(self, url, params=None):
+        """Schedules a GET request and returns a Future resolving to the decoded JSON body, or None on failure."""
+        key = (url, tuple(sorted((params or {}).items())))
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.stats['deduplicated'] += 1
+                return future
+            future = self.executor.submit(self._fetch, url, params)
+            self._in_flight[key] = future
+        future.add_done_callback(lambda _: self._forget(key))
+        return future
+
+    def _forget(self, key):
+        with self._lock:
+            self._in_flight.pop(key, None)
+
+    def _fetch(self, url, params):
+        with self._lock:
+            slots = self._host_slots[urlsplit(url).netloc]
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            with slots:
+                with self._lock:
+                    self.stats['requests'] += 1
+                try:
+                    response = self.session.get(url, params=params, timeout=self.timeout)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    log_warning("http.request_failed", url=url, attempt=attempt, error=str(e))
+                else:
+                    if response.status_code == 200:
+                        try:
+                            return response.json()
+                        except ValueError:
+                            log_warning("http.invalid_json", url=url)
+                            break
+                    if response.status_code not in RETRY_STATUSES:
+                        break
+                    retry_after = response.headers.get('Retry-After')
+            if attempt < self.retries:
+                with self._lock:
+                    self.stats['retries'] += 1
+                delay = self.backoff * 2 ** attempt * (1 + random.random())
+                if retry_after and retry_after.isdigit():
+                    delay = max(delay, int(retry_after))
+                time.sleep(delay)
+        with self._lock:
+            self.stats['failures'] += 1
+        return None
@@ -0,0 +1,73 @@
+import json
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _encoding = None
+
+def count_tokens(text):
+    """Token count of text for the gpt-4o tokenizer; estimated from its length when tiktoken is not installed."""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+# Running summary with a fixed token budget. New material is added as a short segment
+# (only the new material gets summarized); once the segments exceed the budget the
+# oldest ones are folded into a digest, so the context handed to later prompts stays
+# bounded however long the course grows. A fold brings the summary down to half the
+# budget, so the adds after it fit without another fold.
+class RollingSummary:
+    def __init__(self, summarize, token_budget=600):
+        # summarize(text, max_tokens) -> str condenses text to roughly max_tokens
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.digest = ""
+        self.segments = []
+        self.folds = 0
+
+    def add(self, segment):
+        segment = segment.strip()
+        if segment:
+            self.segments.append(segment)
+            self._fold()
+
+    def _fold(self):
+        if self.tokens() <= self.token_budget:
+            return
+        # One summarize call per fold: the newest segments that fit in a quarter of the budget
+        # stay verbatim and everything older is condensed into the rest of the half budget
+        keep, kept_tokens = len(self.segments), 0
+        while keep > 0 and kept_tokens + count_tokens(self.segments[keep - 1]) <= self.token_budget // 4:
+            keep -= 1
+            kept_tokens += count_tokens(self.segments[keep])
+        folded, self.segments = self.segments[:keep], self.segments[keep:]
+        self.digest = self.summarize(" ".join([self.digest] + folded).strip(), self.token_budget // 2 - kept_tokens).strip()
+        self.folds += 1
+
+    def text(self):
+        return " ".join(part for part in [self.digest] + self.segments if part)
+
+    def tokens(self):
+        return count_tokens(self.text())
+
+    def state(self):
+        """Serialized form stored in job checkpoints."""
+        return json.dumps({'digest': self.digest, 'segments': self.segments})
+
+    @classmethod
+    def restore(cls, state, summarize, token_budget=600):
+        summary = cls(summarize, token_budget)
+        if not state:
+            return summary
+        try:
+            saved = json.loads(state)
+        except json.JSONDecodeError:
+            # Checkpoints written before rolling summaries hold the plain summary text
+            summary.add(state)
+            return summary
+        summary.digest = saved['digest']
+        summary.segments = saved['segments']
+        return summary
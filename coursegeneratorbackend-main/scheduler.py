@@ -0,0 +1,88 @@
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Blocks callers so that at most `requests_per_minute` calls start in any 60 second window
+class RateLimiter:
+    def __init__(self, requests_per_minute=None, period=60.0):
+        self.requests_per_minute = requests_per_minute
+        self.period = period
+        self._starts = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.requests_per_minute:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._starts and now - self._starts[0] >= self.period:
+                    self._starts.popleft()
+                if len(self._starts) < self.requests_per_minute:
+                    self._starts.append(now)
+                    return
+                wait_time = self.period - (now - self._starts[0])
+            time.sleep(wait_time)
+
+# Runs a graph of tasks (typically one LLM call each) on a thread pool. A task starts
+# once all of its dependencies have finished and receives their results as positional
+# arguments, followed by its own arguments. Results are keyed by task, so callers can
+# assemble output in a deterministic order whatever the completion order was.
+# Tasks run in a copy of the caller's context, so context variables such as the
+# active trace carry over into the pool threads.
+class TaskScheduler:
+    def __init__(self, max_concurrency=4, requests_per_minute=None):
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = RateLimiter(requests_per_minute)
+        self.tasks = {}
+        self.results = {}
+
+    def add(self, key, fn, *args, depends_on=()):
+        if key in self.tasks:
+            raise ValueError(f"Duplicate task: {key}")
+        for dependency in depends_on:
+            if dependency not in self.tasks:
+                raise ValueError(f"Task {key} depends on unknown task {dependency}")
+        self.tasks[key] = (fn, args, tuple(depends_on))
+        return key
+
+    def _call(self, key):
+        fn, args, depends_on = self.tasks[key]
+        self.rate_limiter.acquire()
+        return fn(*[self.results[dependency] for dependency in depends_on], *args)
+
+    def run(self):
+        """Runs every task and returns {key: result}; the first task error is re-raised."""
+        for _ in self.iter_results():
+            pass
+        return self.results
+
+    def iter_results(self):
+        """Runs every task, yielding (key, result) pairs in completion order.
+
+        At most max_concurrency tasks are submitted at a time. When a task fails or the
+        generator is closed early (e.g. the client of a stream went away), no further
+        task starts and the calls already in flight are left to finish in the background.
+        """
+        pending = dict(self.tasks)
+        running = {}
+        executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        try:
+            while pending or running:
+                for key in list(pending):
+                    if len(running) >= self.max_concurrency:
+                        break
+                    if all(dependency in self.results for dependency in pending[key][2]):
+                        del pending[key]
+                        running[executor.submit(contextvars.copy_context().run, self._call, key)] = key
+                if not running:
+                    raise RuntimeError(f"Unresolvable task dependencies: {list(pending)}")
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = running.pop(future)
+                    self.results[key] = future.result()
+                    yield key, self.results[key]
+        finally:
+            executor.shutdown(wait=not running, cancel_futures=True)
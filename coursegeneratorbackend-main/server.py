@@ -1,57 +1,372 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 import os
 import json
 from openai import OpenAI
 from dotenv import load_dotenv
-import logging
+import threading
 import time
-from fact_verification import verify_fact
+import uuid
+from types import SimpleNamespace
+import fact_verification
+from fact_verification import verify_facts, verify_fact_groups, warm_up, model_stats, encode_sentences, MODEL_NAME, EVIDENCE_MODE, EVIDENCE_MODES, RETRIEVAL_BACKEND, RETRIEVAL_BACKENDS
+from scheduler import TaskScheduler
+from verification_pool import VerificationPool
+from jobs import JobManager, JobStore, TERMINAL_STATUSES
+from llm_cache import DiskTier, MemoryTier, ResponseCache, cache_key
+from rolling_summary import RollingSummary, count_tokens
+from course_examples import ExampleLibrary
+from course_store import CourseStore
+from structured_output import OutputStats, StructuredOutputError, failed_items, parse_structured, parses_to, schema_from_example, validate
+import observability
+import prompts
+import regeneration
+from llm_limiter import BULK, INTERACTIVE, create_with_limits, limiter_from_env, settle_usage
 
 load_dotenv()
 
 api_key = os.getenv("API_KEY")
-client = OpenAI(api_key=api_key)
+# Retries of 429s and transient errors are left to llm_limiter, which coordinates them across requests
+client = OpenAI(api_key=api_key, max_retries=0)
 
 gpt_model = "gpt-4o-2024-08-06"
+# USD per million prompt and completion tokens of gpt_model, for the cost estimates in /metrics and /traces;
+# prompt tokens of a prefix the API had cached are billed at LLM_CACHED_INPUT_PRICE
+LLM_INPUT_PRICE = float(os.getenv("LLM_INPUT_PRICE", "2.50"))
+LLM_CACHED_INPUT_PRICE = float(os.getenv("LLM_CACHED_INPUT_PRICE", "1.25"))
+LLM_OUTPUT_PRICE = float(os.getenv("LLM_OUTPUT_PRICE", "10.00"))
+
+# /generate_lessons runs topics one after another ("sequential") or concurrently from the course plan ("parallel")
+GENERATION_MODE = os.getenv("GENERATION_MODE", "sequential")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "0")) or None
+
+# Process-wide OpenAI budgets shared by all requests (LLM_RPM_LIMIT, LLM_TPM_LIMIT, LLM_MAX_RETRIES;
+# LLM_LIMITER_DB shares them between processes). Calls with these labels are queued ahead of the rest.
+llm_limiter = limiter_from_env()
+INTERACTIVE_LABELS = ("regenerate", "extend", "shorten", "course_plan")
+
+def llm_priority(label):
+    return INTERACTIVE if label in INTERACTIVE_LABELS else BULK
+
+# Background generation jobs, checkpointed to a SQLite file so they survive restarts
+JOBS_DB = os.getenv("JOBS_DB", "jobs.sqlite")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+# Seconds a worker owns a job without renewing it; the jobs of a server that is gone are resumed after that
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "30"))
+
+# Cache of LLM responses keyed by model, messages and sampling parameters (memory LRU + SQLite on disk)
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "256"))
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "llm_cache")
+LLM_CACHE_MAX_MB = int(os.getenv("LLM_CACHE_MAX_MB", "256"))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600))) or None
+
+# Token budgets of the rolling summaries passed to topic prompts in sequential mode,
+# and the length of the summary written for each new topic and lesson
+TOPIC_CONTEXT_TOKENS = int(os.getenv("TOPIC_CONTEXT_TOKENS", "500"))
+LESSON_CONTEXT_TOKENS = int(os.getenv("LESSON_CONTEXT_TOKENS", "800"))
+TOPIC_SUMMARY_WORDS = int(os.getenv("TOPIC_SUMMARY_WORDS", "120"))
+LESSON_SUMMARY_WORDS = int(os.getenv("LESSON_SUMMARY_WORDS", "150"))
+
+# Fact-checking models load on first use; set WARM_UP_MODELS=1 to load them in the background at startup
+WARM_UP_MODELS = os.getenv("WARM_UP_MODELS", "0") == "1"
+# Number of fact-verification worker processes sharing the models loaded at startup (0 verifies in the request thread)
+VERIFICATION_WORKERS = int(os.getenv("VERIFICATION_WORKERS", "0"))
+
+# Example course plans added to each course plan prompt: the COURSE_EXAMPLES_TOP_K most similar ones of
+# COURSE_EXAMPLES_PATH within COURSE_EXAMPLES_TOKEN_BUDGET tokens (0 disables them), embedded with the
+# fact-checking sentence model; COURSE_EXAMPLES_INDEX_DIR keeps their vectors until the file changes
+COURSE_EXAMPLES_PATH = os.getenv("COURSE_EXAMPLES_PATH", "courseplan_examples.json")
+COURSE_EXAMPLES_TOP_K = int(os.getenv("COURSE_EXAMPLES_TOP_K", "2"))
+COURSE_EXAMPLES_TOKEN_BUDGET = int(os.getenv("COURSE_EXAMPLES_TOKEN_BUDGET", "4000"))
+COURSE_EXAMPLES_INDEX_DIR = os.getenv("COURSE_EXAMPLES_INDEX_DIR", "course_examples_index")
+
+# Generated courses are saved to COURSE_STORE_PATH (empty disables it) with one compressed record per
+# topic; COURSE_STORE_COMPRESSION is zstd (needs the zstandard package), gzip or none, zstd if available
+COURSE_STORE_PATH = os.getenv("COURSE_STORE_PATH", "courses.sqlite")
+COURSE_STORE_COMPRESSION = os.getenv("COURSE_STORE_COMPRESSION") or None
+COURSE_PAGE_SIZE = int(os.getenv("COURSE_PAGE_SIZE", "20"))
+
+# Rounds of re-requests for the invalid parts of a topic or course plan before giving up on it
+STRUCTURED_OUTPUT_RETRIES = int(os.getenv("STRUCTURED_OUTPUT_RETRIES", "2"))
 
-with open("courseplan_format.json", "r") as json_file:
-    example_format = json_file.read()
 with open("lessoncontent_format.json", "r") as json_file:
     lesson_format = json_file.read()
 
+# Expected structure of a course plan, one lesson of it and one generated topic, from the format examples
+course_plan_schema = schema_from_example(json.loads(prompts.example_format))
+lesson_plan_schema = course_plan_schema['course'][0]
+topic_schema = schema_from_example(json.loads(lesson_format))['topics'][0]
+subtopic_schema = topic_schema['subtopics'][0]
+structured_output_stats = OutputStats()
+course_examples = ExampleLibrary(COURSE_EXAMPLES_PATH, encode_sentences, MODEL_NAME, COURSE_EXAMPLES_INDEX_DIR or None,
+                                 COURSE_EXAMPLES_TOP_K, COURSE_EXAMPLES_TOKEN_BUDGET)
+course_store = CourseStore(COURSE_STORE_PATH, COURSE_STORE_COMPRESSION) if COURSE_STORE_PATH else None
+
 app = Flask(__name__)
 CORS(app)
 
-def generate_topic_content(prompt):
-    response = client.chat.completions.create(
+# The pool is created by the first fact-checking request of the process that serves them, so
+# neither the debug reloader's parent nor an import by tooling or benchmarks forks idle workers
+verification_pool = None
+verification_pool_lock = threading.Lock()
+
+def get_verification_pool():
+    global verification_pool
+    if not VERIFICATION_WORKERS:
+        return None
+    with verification_pool_lock:
+        if verification_pool is None:
+            verification_pool = VerificationPool(VERIFICATION_WORKERS)
+    return verification_pool
+
+if WARM_UP_MODELS:
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+# Latency of the first request served by each endpoint, which includes any lazy model loading
+first_request_seconds = {}
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_first_request(response):
+    if request.endpoint and 'request_started' in g:
+        seconds = time.perf_counter() - g.request_started
+        observability.http_seconds.observe(seconds, endpoint=request.endpoint, status=response.status_code)
+        if request.endpoint not in first_request_seconds:
+            first_request_seconds[request.endpoint] = round(seconds, 3)
+    return response
+
+llm_cache = ResponseCache(
+    memory=MemoryTier(LLM_CACHE_MEMORY_ENTRIES, LLM_CACHE_TTL) if LLM_CACHE_MEMORY_ENTRIES else None,
+    disk=DiskTier(LLM_CACHE_DIR, LLM_CACHE_MAX_MB * 1024 * 1024, LLM_CACHE_TTL) if LLM_CACHE_DIR else None,
+)
+
+# Token usage per kind of LLM call: {label: {"calls", "cached", "prompt_tokens", "cached_prompt_tokens",
+# "completion_tokens", "cost_usd"}}; cached counts calls answered from llm_cache, cached_prompt_tokens the
+# prompt tokens the API reused from its own prompt cache
+llm_usage = {}
+llm_usage_lock = threading.Lock()
+
+def llm_cost(prompt_tokens, completion_tokens, cached_prompt_tokens=0):
+    return ((prompt_tokens - cached_prompt_tokens) * LLM_INPUT_PRICE + cached_prompt_tokens * LLM_CACHED_INPUT_PRICE
+            + completion_tokens * LLM_OUTPUT_PRICE) / 1_000_000
+
+def cached_tokens(usage):
+    """Prompt tokens served from the API's prompt cache, which only some responses report."""
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return getattr(details, 'cached_tokens', None) or 0
+
+def cache_status(bypass_cache):
+    """Response cache status of an LLM call that was not answered from the cache."""
+    return "off" if llm_cache is None else "bypass" if bypass_cache else "miss"
+
+# Every LLM call ends here, answered from the cache (response None) or not. Besides the
+# usage report it records the call in the metrics, the active trace and the JSON log.
+def record_usage(label, params, response=None, seconds=0.0, cache="hit", **attrs):
+    cached_prompt_tokens = 0
+    if response is None:
+        prompt_tokens = completion_tokens = 0
+    elif getattr(response, 'usage', None) is not None:
+        prompt_tokens, completion_tokens = response.usage.prompt_tokens, response.usage.completion_tokens
+        cached_prompt_tokens = cached_tokens(response.usage)
+    else:
+        # Clients without usage reporting (e.g. the benchmark stand-in): estimate from the text
+        prompt_tokens = sum(count_tokens(message['content']) for message in params['messages'])
+        completion_tokens = count_tokens(response.choices[0].message.content)
+    cost = llm_cost(prompt_tokens, completion_tokens, cached_prompt_tokens)
+    with llm_usage_lock:
+        usage = llm_usage.setdefault(label, {"calls": 0, "cached": 0, "prompt_tokens": 0, "cached_prompt_tokens": 0,
+                                             "completion_tokens": 0, "cost_usd": 0.0})
+        usage["calls"] += 1
+        usage["cached"] += response is None
+        usage["prompt_tokens"] += prompt_tokens
+        usage["cached_prompt_tokens"] += cached_prompt_tokens
+        usage["completion_tokens"] += completion_tokens
+        usage["cost_usd"] += cost
+    observability.record_span("llm", seconds, time.time() - seconds, dict(
+        attrs, label=label, model=params.get('model'), cache="hit" if response is None else cache,
+        prompt_tokens=prompt_tokens, cached_prompt_tokens=cached_prompt_tokens, completion_tokens=completion_tokens,
+        cost_usd=cost))
+
+# Every LLM call goes through here. Returns the message content; identical requests are
+# answered from llm_cache unless bypass_cache is set (the fresh response is still stored).
+# label names the kind of call in the token usage report.
+def chat_completion(label="chat", bypass_cache=False, **params):
+    start = time.perf_counter()
+    key = cache_key(**params)
+    if llm_cache is not None:
+        if bypass_cache:
+            llm_cache.bypass()
+        else:
+            cached = llm_cache.get(key)
+            if cached is not None:
+                record_usage(label, params, seconds=time.perf_counter() - start)
+                return cached
+    response, _ = create_with_limits(llm_limiter, client.chat.completions.create, params, llm_priority(label))
+    record_usage(label, params, response, time.perf_counter() - start, cache_status(bypass_cache))
+    content = response.choices[0].message.content
+    if llm_cache is not None:
+        llm_cache.put(key, content)
+    return content
+
+def streamed_response(content, usage=None):
+    """The completed response a stream of chunks adds up to, for record_usage."""
+    return SimpleNamespace(usage=usage, choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+# Streaming variant of chat_completion: yields the message content piece by piece as the
+# tokens arrive. A cached response comes back as one piece; a complete response is cached.
+def stream_chat_completion(label="chat", bypass_cache=False, **params):
+    start = time.perf_counter()
+    key = cache_key(**params)
+    if llm_cache is not None:
+        if bypass_cache:
+            llm_cache.bypass()
+        else:
+            cached = llm_cache.get(key)
+            if cached is not None:
+                record_usage(label, params, seconds=time.perf_counter() - start)
+                yield cached
+                return
+    pieces = []
+    usage = None
+    first_token_seconds = None
+    stream, limiter_entry = create_with_limits(llm_limiter, client.chat.completions.create,
+                                               dict(params, stream=True, stream_options={"include_usage": True}),
+                                               llm_priority(label))
+    # The last chunk carries the token usage of the whole stream
+    for chunk in stream:
+        usage = getattr(chunk, 'usage', None) or usage
+        if chunk.choices and chunk.choices[0].delta.content:
+            pieces.append(chunk.choices[0].delta.content)
+            if first_token_seconds is None:
+                first_token_seconds = round(time.perf_counter() - start, 4)
+            yield pieces[-1]
+    content = "".join(pieces)
+    settle_usage(llm_limiter, limiter_entry, usage)
+    record_usage(label, params, streamed_response(content, usage), time.perf_counter() - start, cache_status(bypass_cache),
+                 first_token_seconds=first_token_seconds)
+    if llm_cache is not None:
+        llm_cache.put(key, content)
+
+def content_events(pieces):
+    """NDJSON events of a streamed edit: a delta per piece of text, then the complete content."""
+    content = []
+    for piece in pieces:
+        content.append(piece)
+        yield {"type": "delta", "content": piece}
+    yield {"type": "done", "content": "".join(content).strip()}
+
+def topic_request(prompt):
+    return dict(
+        label="topic",
         response_format={"type": "json_object"},
         model=gpt_model,
-        messages=[
-            {"role": "system", "content": "You are a content generation system specialized in creating comprehensive and well-structured educational materials for higher education. Your task is to generate detailed and organized content for the given topic and its subtopics, who provides responses in JSON format."},
-            {"role": "user", "content": prompt}
-        ],
+        messages=prompts.topic_messages(prompt),
         temperature=0.7,
         max_tokens=4096,
         top_p=1
     )
-    return response.choices[0].message.content.strip()
 
-def summarize_content(content):
-    response = client.chat.completions.create(
+def generate_subtopic_content(topic, subtopic_title, topic_content):
+    """Asks for one subtopic of a topic whose generated JSON lacked it."""
+    response = chat_completion(
+        label="topic_retry",
+        bypass_cache=True,
+        response_format={"type": "json_object"},
         model=gpt_model,
-        messages=[
-            {"role": "system", "content": "You are a highly experienced academic course designer who summarizes content."},
-            {"role": "user", "content": f"Summarize the following content:\n\n{content}"}
-        ],
+        messages=prompts.subtopic_messages(topic, subtopic_title, topic_content[:1500]),
+        temperature=0.7,
+        max_tokens=2048,
+        top_p=1
+    )
+    return response.strip()
+
+# A response that needed repairs is replaced in the cache by its repaired form, so that the
+# same request does not go through the repairs, and their re-requests, again
+def cache_repaired(request, value):
+    if llm_cache is not None:
+        llm_cache.put(cache_key(**{key: item for key, item in request.items() if key != 'label'}), json.dumps(value))
+
+def generate_topic(topic, topic_prompt):
+    """Generates one topic of the lesson content format.
+
+    Malformed JSON is repaired locally. Subtopics that are still missing or invalid are
+    re-requested on their own, and only a topic without usable content is generated again,
+    for at most STRUCTURED_OUTPUT_RETRIES rounds. A topic that still fails is kept as a
+    placeholder with a generation_error instead of disappearing from the lesson.
+    """
+    request = topic_request(topic_prompt)
+    response = chat_completion(**request)
+    detailed_topic = parse_structured(response, 'topic', structured_output_stats)
+    planned_subtopics = topic.get('subtopics', [])
+    for attempt in range(STRUCTURED_OUTPUT_RETRIES + 1):
+        missing = []
+        if isinstance(detailed_topic, dict):
+            # Titles are known from the plan and can be filled in locally
+            detailed_topic.setdefault('title', topic['title'])
+            subtopics = detailed_topic.setdefault('subtopics', [])
+            if isinstance(subtopics, list):
+                for subtopic_index, subtopic in enumerate(subtopics[:len(planned_subtopics)]):
+                    if isinstance(subtopic, dict):
+                        subtopic.setdefault('title', planned_subtopics[subtopic_index])
+                missing = list(range(len(subtopics), len(planned_subtopics)))
+        errors = validate(detailed_topic, topic_schema)
+        if not errors and not missing:
+            if not parses_to(response, detailed_topic):
+                cache_repaired(request, detailed_topic)
+            return detailed_topic
+        structured_output_stats.record('topic', invalid=1)
+        if attempt == STRUCTURED_OUTPUT_RETRIES:
+            break
+        failed = failed_items(errors, '$.subtopics')
+        if failed is None:
+            # Nothing usable beyond the subtopics: generate the whole topic again
+            structured_output_stats.record('topic', retries=1, discarded_tokens=count_tokens(response))
+            response = chat_completion(bypass_cache=True, **dict(request, label="topic_retry"))
+            detailed_topic = parse_structured(response, 'topic', structured_output_stats)
+            continue
+        for subtopic_index in failed + missing:
+            subtopics = detailed_topic['subtopics']
+            if subtopic_index > len(subtopics):
+                break
+            current = subtopics[subtopic_index] if subtopic_index < len(subtopics) else None
+            if isinstance(current, dict) and current.get('title'):
+                title = current['title']
+            elif subtopic_index < len(planned_subtopics):
+                title = planned_subtopics[subtopic_index]
+            else:
+                title = f"{topic['title']} ({subtopic_index + 1})"
+            structured_output_stats.record('topic', retries=1, discarded_tokens=count_tokens(json.dumps(current)) if current else 0)
+            subtopic = parse_structured(generate_subtopic_content(topic, title, str(detailed_topic.get('content', ''))),
+                                        'topic', structured_output_stats)
+            if validate(subtopic, subtopic_schema):
+                continue
+            if subtopic_index < len(subtopics):
+                subtopics[subtopic_index] = subtopic
+            else:
+                subtopics.append(subtopic)
+    structured_output_stats.record('topic', unrecovered=1)
+    observability.log_warning("topic.unrecovered", topic=topic['title'], errors=errors[:5])
+    return {"title": topic['title'], "content": "", "subtopics": [],
+            "generation_error": "The generated content did not match the lesson format"}
+
+def summarize_content(content, max_words=None):
+    response = chat_completion(
+        label="summary",
+        model=gpt_model,
+        messages=prompts.summary_messages(content, max_words),
         temperature=0.7,
         max_tokens=500,
         top_p=1
     )
-    return response.choices[0].message.content.strip()
+    return response.strip()
 
-def generate_detailed_lesson_content(lesson, previous_lessons_summary):
-    detailed_lesson_content = {
+def new_lesson_content(lesson):
+    return {
         "id": lesson['id'],
         "lesson_title": lesson['lesson_title'],
         "lesson_description": lesson['description'],
@@ -59,337 +374,635 @@ def generate_detailed_lesson_content(lesson, previous_lessons_summary):
         "topics": []
     }
 
-    previous_sections_summary = ""
-    for topic in lesson['topics']:
-        topic_prompt = f"""
-        # Task: 
-        Generate detailed and well-organized content for the given topic and its respective subtopics.
-
-        # Requirements:
-        The following list contains all information you need to consider when writing to help build the lesson:  
-        * Topic: {topic['title']}.
-        * Description: {topic['description']}
-        * Subtopics: {topic['subtopics']}
-        * Previous_topics_summary: {previous_sections_summary}
-        * Previous_lessons_summary: {previous_lessons_summary}
-
-        # Instructions:
-        1. Ensure each section includes sufficient detail and depth. When applicable include examples to provide more explanation.
-        2. Use clear and concise language to ensure understanding.
-        3. Use an academic and formal tone.
-        4. Organize the content logically, with smooth transitions between sections.
-        5. Refer to the Previous_topics_summary {previous_sections_summary} to build continuity within the lesson and the Previous_lessons_summary {previous_lessons_summary} where relevant to build continuity among all of the lessons and reinforce learning.
-        6. Please provide the output in the following JSON format:
-        {{
-            "title": "{topic['title']}",
-            "content": "Provide a thorough and detailed explanation of the main topic. Depending on the topic, include definitions, key concepts, the importance of the topic, and relevant examples. Ensure the content is clear, logical, and easy to understand.",
-            "subtopics": [
-                {{
-                    "title": "Subtopic Title 1",
-                    "content": "Offer an in-depth discussion of Subtopic Title 1. Provide additional details, examples, or explanations that elaborate on how this subtopic relates to the main topic. Make sure the content is well-organized and informative."
-                }},
-                {{
-                    "title": "Subtopic Title 2",
-                    "content": "Offer an in-depth discussion of Subtopic Title 2. Provide additional details, examples, or explanations that elaborate on how this subtopic relates to the main topic. Make sure the content is well-organized and informative."
-                }}
-            ]
-        }}
-        7. The content within topics and subtopics must be formatted in Markdown. Depending on the course the following elements might be needed:
-            * Code snippets: Use Markdown triple backticks for the code block.
-            * Math formulas: 
-            * Bulleted or Numbered Lists:
-            * Tables: """
-
-        detailed_topic_content = generate_topic_content(topic_prompt)
-        previous_sections_summary += summarize_content(detailed_topic_content) + " "
-        
-        # Parse the generated content to ensure it matches the format
-        try:
-            detailed_topic = json.loads(detailed_topic_content)
-        except json.JSONDecodeError as e:
-            print(f"JSON decode error for topic {topic['title']}: {str(e)}")
+# Folds older summary segments into one digest for RollingSummary
+def condense_summary(text, max_tokens):
+    return summarize_content(text, max_words=max_tokens * 3 // 4)
+
+def iter_lesson_topics(lesson, previous_lessons_summary, start_topic=0, sections=None):
+    """Generates the lesson's topics one after another from start_topic on.
+
+    sections is the RollingSummary of the lesson's earlier topics; only each new topic is
+    summarized into it. Yields (topic index, topic, sections) as each topic is ready.
+    """
+    if sections is None:
+        sections = RollingSummary(condense_summary, TOPIC_CONTEXT_TOKENS)
+    for topic_index, topic in enumerate(lesson['topics']):
+        if topic_index < start_topic:
             continue
-        
-        detailed_lesson_content["topics"].append(detailed_topic)
-    
-    return detailed_lesson_content
-
-def get_course_details(course_plan):
-    course_details = []
-
-    for course in course_plan['course']:
-        detail = {
-            'course_id': course['id'],
-            'lesson_title': course['lesson_title'],
-            'lesson_description': course['description'],
-            'learning_objectives': course['learningObjectives'],
-            'topics': course['topics']
-        }
-        course_details.append(detail)
-    
-    return course_details
+        topic_prompt = prompts.topic_prompt(topic, sections.text(), previous_lessons_summary)
+        detailed_topic = generate_topic(topic, topic_prompt)
+        if 'generation_error' not in detailed_topic:
+            sections.add(summarize_content(json.dumps(detailed_topic), TOPIC_SUMMARY_WORDS))
+
+        yield topic_index, detailed_topic, sections
+
+def generate_transition(detailed_topic, previous_lesson, lesson):
+    response = chat_completion(
+        label="transition",
+        model=gpt_model,
+        messages=prompts.transition_messages(previous_lesson, lesson, detailed_topic.get('content', '')[:1500]),
+        temperature=0.7,
+        max_tokens=200,
+        top_p=1
+    )
+    return response.strip()
+
+# Course generation is exposed as a stream of events so /generate_lessons can forward each
+# topic and lesson as soon as it is produced:
+#   {"type": "topic", "lesson_index", "topic_index", "topic"}
+#   {"type": "lesson", "lesson_index", "lesson"}
+# Both generators can resume from a checkpoint ({"lessons": {lesson index: lesson},
+# "topics": {(lesson index, topic index): topic}, "transitions": {lesson index: str},
+# "previous_sections_summary": {lesson index: str}, "previous_lessons_summary": str}, the
+# summaries being RollingSummary states in sequential mode); completed parts are replayed
+# without LLM calls. on_checkpoint(event, previous_sections_summary, previous_lessons_summary)
+# is called for every newly generated topic and lesson, and in parallel mode for every
+# transition ({"type": "transition", "lesson_index", "transition"}, which is not yielded).
+def iter_course_sequential(course_plan, resume=None, on_checkpoint=None):
+    resume = resume or {}
+    completed_lessons = resume.get('lessons', {})
+    completed_topics = resume.get('topics', {})
+    previous_lessons = RollingSummary.restore(resume.get('previous_lessons_summary'), condense_summary, LESSON_CONTEXT_TOKENS)
+    for lesson_index, lesson in enumerate(course_plan['course']):
+        if lesson_index in completed_lessons:
+            yield {"type": "lesson", "lesson_index": lesson_index, "lesson": completed_lessons[lesson_index]}
+            continue
+        lesson_content = new_lesson_content(lesson)
+
+        # Replay the topics finished before an interruption and continue after the last one
+        start_topic = 0
+        for (topic_lesson_index, topic_index), detailed_topic in sorted(completed_topics.items()):
+            if topic_lesson_index == lesson_index:
+                lesson_content["topics"].append(detailed_topic)
+                yield {"type": "topic", "lesson_index": lesson_index, "topic_index": topic_index, "topic": detailed_topic}
+                start_topic = topic_index + 1
+        sections = RollingSummary.restore(resume.get('previous_sections_summary', {}).get(lesson_index),
+                                          condense_summary, TOPIC_CONTEXT_TOKENS)
+
+        for topic_index, detailed_topic, sections in iter_lesson_topics(
+                lesson, previous_lessons.text(), start_topic, sections):
+            lesson_content["topics"].append(detailed_topic)
+            event = {"type": "topic", "lesson_index": lesson_index, "topic_index": topic_index, "topic": detailed_topic}
+            if on_checkpoint:
+                on_checkpoint(event, sections.state(), previous_lessons.state())
+            yield event
+        # The lesson summary is built from its topic summaries rather than the full lesson text
+        previous_lessons.add(summarize_content(sections.text(), LESSON_SUMMARY_WORDS))
+
+        event = {"type": "lesson", "lesson_index": lesson_index, "lesson": lesson_content}
+        if on_checkpoint:
+            on_checkpoint(event, None, previous_lessons.state())
+        yield event
+
+def iter_course_parallel(course_plan, max_concurrency=LLM_MAX_CONCURRENCY, requests_per_minute=LLM_REQUESTS_PER_MINUTE, continuity_pass=True,
+                         resume=None, on_checkpoint=None):
+    """Generates every topic concurrently from the course plan, then links consecutive lessons with a cheap continuity pass.
+
+    Topic prompts take their continuity context from the plan's descriptions of the previous
+    topics and lessons, so no topic waits for another one. The continuity pass writes a short
+    transition for each lesson after the first, once that lesson's first topic is ready.
+    Topics and lessons are yielded in completion order and carry their plan indices.
+    """
+    resume = resume or {}
+    completed_lessons = resume.get('lessons', {})
+    completed_topics = resume.get('topics', {})
+    completed_transitions = resume.get('transitions', {})
+    lessons = course_plan['course']
+    scheduler = TaskScheduler(max_concurrency, requests_per_minute)
+    remaining_tasks = {}
+    for lesson_index, lesson in enumerate(lessons):
+        remaining_tasks[lesson_index] = 0
+        if lesson_index in completed_lessons:
+            continue
+        previous_lessons_summary = prompts.plan_outline(lessons[:lesson_index], 'lesson_title')
+        for topic_index, topic in enumerate(lesson['topics']):
+            if (lesson_index, topic_index) in completed_topics:
+                continue
+            previous_sections_summary = prompts.plan_outline(lesson['topics'][:topic_index], 'title')
+            topic_prompt = prompts.topic_prompt(topic, previous_sections_summary, previous_lessons_summary)
+            scheduler.add(('topic', lesson_index, topic_index), generate_topic, topic, topic_prompt)
+            remaining_tasks[lesson_index] += 1
+        if continuity_pass and lesson_index > 0 and lesson['topics'] and lesson_index not in completed_transitions:
+            if (lesson_index, 0) in completed_topics:
+                scheduler.add(('transition', lesson_index), generate_transition,
+                              completed_topics[(lesson_index, 0)], lessons[lesson_index - 1], lesson)
+            else:
+                scheduler.add(('transition', lesson_index), generate_transition, lessons[lesson_index - 1], lesson,
+                              depends_on=[('topic', lesson_index, 0)])
+            remaining_tasks[lesson_index] += 1
+
+    def assemble_lesson(lesson_index):
+        # Put the lesson together in plan order and release the raw results
+        lesson = lessons[lesson_index]
+        lesson_content = new_lesson_content(lesson)
+        transition = scheduler.results.pop(('transition', lesson_index), None)
+        if continuity_pass and transition is None:
+            transition = completed_transitions.get(lesson_index)
+        for topic_index, topic in enumerate(lesson['topics']):
+            if (lesson_index, topic_index) in completed_topics:
+                detailed_topic = dict(completed_topics[(lesson_index, topic_index)])
+            else:
+                detailed_topic = scheduler.results.pop(('topic', lesson_index, topic_index))
+            if topic_index == 0 and transition:
+                detailed_topic['content'] = transition + "\n\n" + detailed_topic.get('content', '')
+            lesson_content["topics"].append(detailed_topic)
+        event = {"type": "lesson", "lesson_index": lesson_index, "lesson": lesson_content}
+        if on_checkpoint:
+            on_checkpoint(event, None, None)
+        return event
+
+    # Replay finished work; lessons with nothing left to generate are complete right away
+    for lesson_index in range(len(lessons)):
+        if lesson_index in completed_lessons:
+            yield {"type": "lesson", "lesson_index": lesson_index, "lesson": completed_lessons[lesson_index]}
+            continue
+        for (topic_lesson_index, topic_index), detailed_topic in sorted(completed_topics.items()):
+            if topic_lesson_index == lesson_index:
+                yield {"type": "topic", "lesson_index": lesson_index, "topic_index": topic_index, "topic": detailed_topic}
+        if not remaining_tasks[lesson_index]:
+            yield assemble_lesson(lesson_index)
+
+    for key, result in scheduler.iter_results():
+        lesson_index = key[1]
+        if key[0] == 'topic':
+            event = {"type": "topic", "lesson_index": lesson_index, "topic_index": key[2], "topic": result}
+            if on_checkpoint:
+                on_checkpoint(event, None, None)
+            yield event
+        elif on_checkpoint:
+            on_checkpoint({"type": "transition", "lesson_index": lesson_index, "transition": result}, None, None)
+        remaining_tasks[lesson_index] -= 1
+        if not remaining_tasks[lesson_index]:
+            yield assemble_lesson(lesson_index)
+
+def iter_course_events(course_plan, generation_mode=GENERATION_MODE, max_concurrency=LLM_MAX_CONCURRENCY, continuity_pass=True,
+                       resume=None, on_checkpoint=None):
+    """Wraps the generation events with start, progress and done events."""
+    total_topics = sum(len(lesson['topics']) for lesson in course_plan['course'])
+    yield {"type": "start", "mode": generation_mode, "lessons": len(course_plan['course']), "total_topics": total_topics}
+    if generation_mode == 'parallel':
+        events = iter_course_parallel(course_plan, max_concurrency, continuity_pass=continuity_pass,
+                                      resume=resume, on_checkpoint=on_checkpoint)
+    else:
+        events = iter_course_sequential(course_plan, resume, on_checkpoint)
+
+    start = time.perf_counter()
+    completed_topics = 0
+    completed_lessons = 0
+    for event in events:
+        yield event
+        if event['type'] == 'topic':
+            completed_topics += 1
+        elif event['type'] == 'lesson':
+            completed_lessons += 1
+        yield {"type": "progress", "completed_topics": completed_topics, "completed_lessons": completed_lessons,
+               "total_topics": total_topics, "elapsed": round(time.perf_counter() - start, 2)}
+    elapsed = time.perf_counter() - start
+    observability.log_event("lessons.generated", lessons=completed_lessons, topics=completed_topics,
+                            seconds=round(elapsed, 2), mode=generation_mode)
+    yield {"type": "done", "lessons": completed_lessons, "topics": completed_topics, "elapsed": round(elapsed, 2)}
+
+def collect_lessons(events):
+    lessons = {event['lesson_index']: event['lesson'] for event in events if event['type'] == 'lesson'}
+    return [lessons[lesson_index] for lesson_index in sorted(lessons)]
+
+def generate_course_sequential(course_plan):
+    return collect_lessons(iter_course_sequential(course_plan))
+
+def generate_course_parallel(course_plan, max_concurrency=LLM_MAX_CONCURRENCY, requests_per_minute=LLM_REQUESTS_PER_MINUTE, continuity_pass=True):
+    return collect_lessons(iter_course_parallel(course_plan, max_concurrency, requests_per_minute, continuity_pass))
+
+def ndjson_stream(events):
+    try:
+        for event in events:
+            yield json.dumps(event) + "\n"
+    except Exception as e:
+        observability.log_error("stream.error", error=str(e))
+        yield json.dumps({"type": "error", "error": str(e)}) + "\n"
 
-def regenerate_content(content):
-    response = client.chat.completions.create(
+def ndjson_response(events):
+    return Response(stream_with_context(ndjson_stream(events)), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Request parameters of the editor actions and the course plan, shared by the Flask routes and async_server
+def regenerate_request(content):
+    return dict(
+        label="regenerate",
         model="gpt-4o",
-        messages=[
-            {"role": "system", "content": """
-        # Role
-        You are are a skilled academic writer specializing in paraphrasing scholarly content. 
-
-        # Objective
-        Paraphrase the following text to convey the same meaning using different words and sentence structures. Ensure that the paraphrased content is clear, coherent, and suitable for an academic audience.
-
-        # Imprtant
-        Avoid adding new information, the paraphrased text must only contain information from the original text.
-
-        # Paraphrasing Guidelines
-            * Carefully read the original text to fully understand the key concepts and main points.
-            * Break down the text into its main ideas and supporting details.
-            * Use varied vocabulary to replace words with suitable synonyms or phrases when it enhances readabiliy. 
-            * Avoid using overly complex words that might confuse the audience, in such cases it's better to keep the original word. 
-            * Change the structure of sentences where it enhances clarity. You can split complex sentences into simpler ones or combine simple sentences to add depth.
-            * Retain Original Meaning: Ensure that the paraphrased text reflects the original meaning and intent without omitting or distorting key information.
-            * Reorganize Ideas if Necessary: Rearrange the sequence of ideas if it enhances the flow and clarity of the text, but maintain the logical progression of arguments or concepts.
-            * Revise and Edit: Review the paraphrased text for coherence, clarity, and grammatical accuracy.
-
-        # Examples
-            Original text: "A thread of execution is the smallest sequence of instructions that can be independently managed by a scheduler. It is an essential concept in concurrent programming and operating systems. Threads are small components of a process, and multiple threads can run concurrently, effectively sharing the same code, memory, variables, etc. Each thread shares the same code, data, and heap blocks but will have its own stack. This ensures that local variables and function-related data for one thread do not conflict with those of another. Threads are often called lightweight processes because they have their own stack memory and minimal overhead compared to full processes."
-            Paraphrased Text: "An execution thread represents the smallest unit of instruction that a scheduler can manage independently. This concept is crucial in concurrent programming and operating systems. Threads are subsets of a process, allowing multiple threads to execute simultaneously while sharing the same code, memory, variables, and more. All threads operate within the same code, data, and heap regions, but each possesses its own stack. This design prevents conflicts among local variables and function-specific data across different threads. Threads are frequently referred to as lightweight processes due to their separate stack memory and significantly lower overhead compared to complete processes."
-
-        # Output format
-        The response format must be only a string containing the new text.
-                
-        """},
-                    {"role": "user", "content": f"""
-                    The original text: {content}        
-          """}
-        ]
-    ) 
-    return response.choices[0].message.content.strip()
-
-
-def extend_content(content):
-    lower_bound, upper_bound = calculate_bounds_shorten(count_words(content))
+        messages=prompts.regenerate_messages(content)
+    )
 
-    response = client.chat.completions.create(
+# A regenerate request asks for a new paraphrase, so it skips the response cache by default
+def regenerate_content(content, bypass_cache=True):
+    return chat_completion(bypass_cache=bypass_cache, **regenerate_request(content)).strip()
+
+
+def extend_request(content):
+    lower_bound, upper_bound = calculate_bounds_lengthen(count_words(content))
+
+    return dict(
+        label="extend",
         model="gpt-4o",
-        messages=[
-            {"role": "system", "content": """
-        # Role
-        You are a skilled academic writer specializing in expanding and adding depth to academic content. 
-
-        # Task
-        Your task is to expand the given text by developing further the existing concepts and explanations, ensuring that your expansions add depth and detail, while maintaining the original structure and flow of the text.
-
-        # Objective
-        Aim to expand the text to a total of {lower_bound} to {upper_bound} words.
-
-        # Expansion Guidelines:
-
-        1. Detailed Explanations:
-            * Break down each concept clearly and thoroughly, aiming for depth and clarity.
-            * Ensure students can grasp complex ideas more effectively through comprehensive coverage without unnecessary extension.
-        2. Selective Examples:
-            * Use relevant examples and case studies where applicable to clarify complex concepts.
-            * Ensure examples are directly connected to the topic and enhance understanding.
-        3. Preserve Core Ideas:
-            * Focus on expanding the existing material to deepen understanding without deviating from the main points.
-        4. Maintain Original Structure:
-            * Keep the original organization of the content intact.
-            * Ensure the expansion flows naturally within the established framework.
-        5. Avoid Unnecessary Summaries:
-            * Do not add summaries at the end unless they are part of the original text.
-        6. Use a Formal and Academic Tone:
-            * Maintain a formal and academic tone throughout the expanded content.
-        7. Ensure Accuracy of the expansions
-
-        # Output format
-        The response format must be only a string containing the new text
-
-        # Important
-        Ensure the text is expanded only to {lower_bound} till {upper_bound} words in total.           
-
-        """},
-                    {"role": "user", "content": f"""
-                    The original text: {content}
-                    The lower_bound: {lower_bound}: The minimum target for increasing the word count.
-                    The upper_bound: {upper_bound}: The maximum target for increasing the word count
-                
-                """}
-        ]
-    ) 
-    return response.choices[0].message.content.strip()
-
-def shorten_content(content):
+        messages=prompts.extend_messages(content, lower_bound, upper_bound)
+    )
+
+def extend_content(content, bypass_cache=False):
+    return chat_completion(bypass_cache=bypass_cache, **extend_request(content)).strip()
+
+def shorten_request(content):
     lower_bound, upper_bound = calculate_bounds_shorten(count_words(content))
 
-    response = client.chat.completions.create(
+    return dict(
+        label="shorten",
         model="gpt-4o",
-        messages=[
-            {"role": "system", "content": """
-        # Role
-        You are a skilled academic writer specializing in writing concise and clear academic content. 
-
-        # Task
-        Your task is to shorten the given text while preserving its original meaning and essential information, ensuring that no key details are lost or altered.    
-
-        # Objective
-        Aim to condense the text to a total of {lower_bound} to {upper_bound} words.
-
-        # Instructions
-        Follow these steps to achieve the targeted length while maintaining the main goals of the text:
-
-        1. Identify key Concepts
-        * Highlight all essential concepts, information, and explanations that must be retained.
-        * Preserve the structure and sequence of key concepts, information, and important explanations or examples.
-
-        2. Remove Redundancies:
-        * Eliminate repetitive information and redundant phrases.
-        * Condense lengthy explanations without losing important details.
-
-        3. Streamline Content:
-        * Remove non-essential examples or anecdotes while retaining essential examples and data findings.
-        * Focus on retaining the primary message and educational purpose
-
-        4. Ensure Coherence:
-        * Ensure the modified text is coherent and easy to understand.
-        * Keep the logical flow and structure of the original text.
-
-        5. Review and Revise:
-        * Read through the shortened text to ensure it accurately conveys the original meaning.
-        * Verify that all key information and concepts are present.
-        * Make adjustments as needed to improve clarity and flow.  
-        
-        # Examples
-
-        # Output format
-        Return only the shortened text as a string.
-
-    """},
-                {"role": "user", "content": f"""
-                The original text: {content}
-                The lower_bound: {lower_bound}
-                The upper_bound: {upper_bound}                
-                """}
-            ]
-        )
-    return response.choices[0].message.content.strip()
+        messages=prompts.shorten_messages(content, lower_bound, upper_bound)
+    )
 
-@app.route('/generate_course_plan', methods=['POST'])
-def generate_course_plan():
-    data = request.json
+def shorten_content(content, bypass_cache=False):
+    return chat_completion(bypass_cache=bypass_cache, **shorten_request(content)).strip()
+
+def course_plan_request(data):
     course_name = data.get('course_name', '').strip()
     course_description = data.get('course_description', '').strip()
     prerequisites = data.get('prerequisites', '').strip()
     number_of_lessons = data.get('number_of_lessons', '').strip()
+    with observability.span("course_examples") as attrs:
+        examples = course_examples.select(course_name, course_description, prerequisites)
+        attrs['similarities'] = [round(similarity, 3) for similarity, _ in examples]
+    return dict(
+        label="course_plan",
+        response_format={"type": "json_object"},
+        model=gpt_model,
+        messages=prompts.course_plan_messages(course_name, course_description, prerequisites, number_of_lessons,
+                                              [example for _, example in examples]),
+        temperature=0.7,
+        max_tokens=4096,
+        top_p=1
+    )
+
+def lesson_plan_request(data, course_plan, lesson_index):
+    """Asks again for one lesson of a course plan whose JSON was invalid."""
+    outline = "\n".join(
+        f"{index + 1}. {lesson.get('lesson_title', '') if isinstance(lesson, dict) else ''}"
+        for index, lesson in enumerate(course_plan['course']))
+    return dict(
+        label="course_plan_retry",
+        bypass_cache=True,
+        response_format={"type": "json_object"},
+        model=gpt_model,
+        messages=prompts.lesson_plan_messages(data.get('course_name', '').strip(), data.get('course_description', '').strip(),
+                                              data.get('prerequisites', '').strip(), outline, lesson_index),
+        temperature=0.7,
+        max_tokens=2048,
+        top_p=1
+    )
+
+def complete_course_plan(data, response, request=None):
+    """Parses and validates a course plan response.
+
+    Malformed JSON is repaired locally, invalid lessons are re-requested on their own and
+    an unusable plan as a whole, for at most STRUCTURED_OUTPUT_RETRIES rounds.
+    """
+    request = request or course_plan_request(data)
+    course_plan = parse_structured(response, 'course_plan', structured_output_stats)
+    for attempt in range(STRUCTURED_OUTPUT_RETRIES + 1):
+        errors = validate(course_plan, course_plan_schema)
+        if not errors:
+            if not parses_to(response, course_plan):
+                cache_repaired(request, course_plan)
+            return course_plan
+        structured_output_stats.record('course_plan', invalid=1)
+        if attempt == STRUCTURED_OUTPUT_RETRIES:
+            break
+        failed = failed_items(errors, '$.course')
+        if not failed:
+            structured_output_stats.record('course_plan', retries=1, discarded_tokens=count_tokens(response))
+            response = chat_completion(bypass_cache=True, **dict(request, label="course_plan_retry"))
+            course_plan = parse_structured(response, 'course_plan', structured_output_stats)
+            continue
+        for lesson_index in failed:
+            structured_output_stats.record('course_plan', retries=1,
+                                           discarded_tokens=count_tokens(json.dumps(course_plan['course'][lesson_index])))
+            lesson = parse_structured(chat_completion(**lesson_plan_request(data, course_plan, lesson_index)),
+                                      'course_plan', structured_output_stats)
+            if not validate(lesson, lesson_plan_schema):
+                course_plan['course'][lesson_index] = lesson
+    structured_output_stats.record('course_plan', unrecovered=1)
+    raise StructuredOutputError(f"The course plan did not match the expected format: {errors[:5]}")
+
+def create_course_plan(data):
+    request = course_plan_request(data)
+    return complete_course_plan(data, chat_completion(**request), request)
+
+@app.route('/generate_course_plan', methods=['POST'])
+def generate_course_plan():
+    data = request.json
     try:
-        response = client.chat.completions.create(
-            response_format={"type": "json_object"},
-            model=gpt_model,
-            messages=[
-                {"role": "system", "content": "You are a highly experienced academic course designer with expertise in creating comprehensive and detailed course plans for various subjects."},
-                {"role": "user", "content": f"""
-                I need you to create a detailed course plan for the following course:
-                - Course Name: {course_name}
-                - Course Description: {course_description}
-                - Prerequisites: {prerequisites}
-                - Number of Lessons: {number_of_lessons}
-                """},
-                {"role": "assistant", "content": f"""
-                Your task is to generate a structured and detailed course plan in JSON format. The course plan should include a coherent sequence of lessons, each containing a high-level outline with relevant topics, subtopics, and learning objectives. Each lesson should build upon the previous one to ensure a logical progression of knowledge.
-
-                Instructions:
-                1. **Initialization**:
-                   - Define the course structure with the given number of lessons.
-                   - Each lesson should have a unique ID, title, description, topics, subtopics, and learning objectives.
-
-                2. **Lesson Structure**:
-                   - For each lesson, generate a descriptive and engaging title.
-                   - Write a detailed description summarizing the lesson content.
-                   - Identify and list the main topics covered in the lesson.
-                   - For each topic, provide relevant subtopics.
-                   - Provide a detailed description for each topic, including these points if applicable:
-                       - **Definition**: Clearly define the topic.
-                       - **Key Concepts**: Explain the key concepts related to the topic.
-                       - **Historical Context**: Provide historical background if applicable.
-                       - **Importance**: Discuss the importance and relevance of the topic.
-                       - **Real-World Applications**: Describe how the topic is applied in real-world scenarios.
-                       - **Examples**: Provide examples to illustrate the topic.
-                       - **Case Studies**: Include relevant case studies to deepen understanding.
-                   - For each topic, provide relevant subtopics that align with the description of the topic.
-                   - Define clear and measurable learning objectives for each lesson.
-                   - Reference the prerequisites where necessary to ensure each lesson builds upon the assumed prior knowledge.
-                   - Adjust the content length to match the lesson duration provided.
-
-                3. **Content Variability**:
-                   - Ensure that the number of topics and subtopics varies based on the complexity and content of each lesson.
-                   - Avoid having a fixed number of topics or subtopics.
-
-                4. **Coherence and Order**:
-                   - Ensure that each lesson logically follows from the previous one.
-                   - Maintain coherence in the progression of topics.
-
-                5. **Recursive Criticism and Improvement**:
-                   - Generate an initial version of the course plan.
-                   - Critically evaluate the initial version, identifying areas for improvement.
-                   - Refine the course plan iteratively based on the feedback.
-                   - Repeat the evaluation and refinement process until the course plan is comprehensive and well-structured.
-
-                6. **Final Output**:
-                   - Format the entire course plan in JSON as specified in this format: {example_format}
-                
-                Begin generating the initial course plan based on these guidelines, then provide a critical review and subsequent improvements.
-                """}
-            ],
-            temperature=0.7,
-            max_tokens=4096,
-            top_p=1
-        )
-        result = response.choices[0].message.content
-        
-        # Parse JSON response
-        course_plan = json.loads(result)
-        print(course_plan)  # Log the parsed lesson titles
-        return jsonify(course_plan)
-    except json.JSONDecodeError as json_err:
-        print('JSON decode error:', str(json_err))  # Log the JSON decode error
-        return jsonify({"error": "Failed to parse JSON response from OpenAI API"}), 500
+        with observability.trace(kind="course_plan") as trace:
+            course_plan = create_course_plan(data)
+        return jsonify(course_plan), {'X-Trace-Id': trace.id}
+    except StructuredOutputError as format_err:
+        observability.log_error("course_plan.format_error", error=str(format_err))
+        return jsonify({"error": str(format_err)}), 500
     except Exception as e:
-        print('Error:', str(e))  # Log the error
+        observability.log_error("request.error", endpoint=request.path, error=str(e))
         return jsonify({"error": str(e)}), 500
 
 @app.route('/generate_lessons', methods=['POST'])
 def generate_lessons_content():
     data = request.json
-    print(data)
-    course_plan = data.get('course_plan', {})
-    detailed_course_plan = []
+    generation_mode = data.get('generation_mode', GENERATION_MODE)
+    if generation_mode not in ('sequential', 'parallel'):
+        return jsonify({"error": f"Unknown generation mode: {generation_mode}"}), 400
 
     try:
-        # Generate detailed content for each lesson
-        previous_lessons_summary = ""
-        for lesson in course_plan['course']:
-            print(lesson)
-            lesson_details = get_course_details(course_plan)
-            lesson_content = generate_detailed_lesson_content(lesson, previous_lessons_summary)
-            previous_lessons_summary += summarize_content(json.dumps(lesson_content)) + " "
-            lesson['detailed_content'] = lesson_content
-
-            # Print the detailed content for debugging
-            print(f"Lesson ID: {lesson['id']}")
-            print(json.dumps(lesson_content, indent=2))
-
-            detailed_course_plan.append(lesson_content)
-
-        return jsonify(detailed_course_plan)
+        # Generate detailed content for each lesson; the trace report is at /traces/<X-Trace-Id>
+        trace = observability.start_trace(kind="lessons")
+        events = observability.traced_events(trace, lesson_generation_events(data))
+        if course_store is not None and data.get('save_course', True):
+            events = stored_events(uuid.uuid4().hex, data, events)
+
+        # Streaming mode sends every event as one NDJSON line as soon as it is produced
+        if data.get('stream'):
+            response = ndjson_response(events)
+            response.headers['X-Trace-Id'] = trace.id
+            return response
+
+        detailed_course_plan = collect_lessons(events)
+        return jsonify(detailed_course_plan), {'X-Trace-Id': trace.id}
     except json.JSONDecodeError as json_err:
-        print('JSON decode error:', str(json_err))  # Log the JSON decode error
+        observability.log_error("request.json_error", endpoint=request.path, error=str(json_err))
         return jsonify({"error": "Failed to parse JSON response from OpenAI API"}), 500
     except Exception as e:
-        print('Error:', str(e))  # Log the error
+        observability.log_error("request.error", endpoint=request.path, error=str(e))
         return jsonify({"error": str(e)}), 500
 
+def lesson_generation_events(data, resume=None, on_checkpoint=None):
+    return iter_course_events(
+        data.get('course_plan', {}),
+        data.get('generation_mode', GENERATION_MODE),
+        max_concurrency=int(data.get('max_concurrency', LLM_MAX_CONCURRENCY)),
+        continuity_pass=data.get('continuity_pass', True),
+        resume=resume,
+        on_checkpoint=on_checkpoint,
+    )
+
+# Generated courses are saved as they are generated, topic by topic; a stored course is announced
+# to the stream with {"type": "course", "course_id"} and can be read back through /courses
+def stored_events(course_id, data, events):
+    course_store.create(course_id, data.get('course_plan', {}), data.get('course_name'))
+    yield {"type": "course", "course_id": course_id}
+    status, error = 'failed', "Generation was interrupted"
+    try:
+        for event in events:
+            if event['type'] == 'topic':
+                course_store.put_topic(course_id, event['lesson_index'], event['topic_index'], event['topic'])
+            elif event['type'] == 'lesson':
+                course_store.put_lesson(course_id, event['lesson_index'], event['lesson'])
+            yield event
+        status, error = 'completed', None
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        course_store.finish(course_id, status, error)
+
+# Background jobs: the same generation work as /generate_course_plan and /generate_lessons,
+# run on a local worker pool with every finished topic checkpointed to the job store.
+# Each run is traced under the job id.
+def run_course_plan_job(job_id, data, checkpoint):
+    with observability.trace(job_id, kind="course_plan"):
+        return create_course_plan(data)
+
+def run_lessons_job(job_id, data, checkpoint):
+    def save_checkpoint(event, previous_sections_summary, previous_lessons_summary):
+        if event['type'] == 'topic':
+            job_store.checkpoint_topic(job_id, event['lesson_index'], event['topic_index'], event['topic'],
+                                       previous_sections_summary, previous_lessons_summary)
+        elif event['type'] == 'transition':
+            job_store.checkpoint_transition(job_id, event['lesson_index'], event['transition'])
+        else:
+            job_store.checkpoint_lesson(job_id, event['lesson_index'], event['lesson'], previous_lessons_summary)
+    if data.get('previous_job_id'):
+        # The reused topics and transitions become checkpoints of this job, so it (and a resumed run) only generates the rest
+        reuse, _ = plan_incremental(data, job_store.get(data['previous_job_id']))
+        for (lesson_index, topic_index), topic in reuse['topics'].items():
+            job_store.checkpoint_topic(job_id, lesson_index, topic_index, topic, None, None)
+        for lesson_index, transition in reuse['transitions'].items():
+            job_store.checkpoint_transition(job_id, lesson_index, transition)
+        checkpoint = job_store.load_checkpoint(job_id)
+    with observability.trace(job_id, kind="lessons"):
+        events = lesson_generation_events(data, checkpoint, save_checkpoint)
+        # The course of a lessons job is stored under the job id, so a resumed job fills in the same course
+        if course_store is not None and data.get('save_course', True):
+            events = stored_events(job_id, data, events)
+        return collect_lessons(events)
+
+# Incremental regeneration: a lessons job with a previous_job_id takes over every topic and
+# transition of that earlier lessons job whose fingerprints are unchanged (see regeneration.py)
+# and generates only the rest, in parallel mode.
+def previous_lessons_job(data):
+    """The finished lessons job data['previous_job_id'] names, or an error message and status code."""
+    previous = job_store.get(data.get('previous_job_id'))
+    if previous is None or previous['kind'] != 'lessons':
+        return None, "Previous lessons job not found", 404
+    if previous['status'] not in TERMINAL_STATUSES:
+        return None, "The previous lessons job has not finished", 409
+    return previous, None, None
+
+def incremental_request(data, previous):
+    # The continuity pass follows the previous job unless requested otherwise: sequential results have no transitions
+    previous_request = previous['request']
+    continuity_pass = (previous_request.get('generation_mode', GENERATION_MODE) == 'parallel'
+                       and previous_request.get('continuity_pass', True))
+    return dict(data, generation_mode='parallel', continuity_pass=data.get('continuity_pass', continuity_pass))
+
+def plan_incremental(data, previous):
+    """What an incremental run of data reuses from the previous job, and the report of it with the estimated savings."""
+    previous_topics = job_store.topics(previous['id'])
+    course_plan = data.get('course_plan', {})
+    reuse = regeneration.plan_regeneration(previous['request'].get('course_plan', {}), previous_topics,
+                                           job_store.transitions(previous['id']), course_plan,
+                                           data['continuity_pass'], data.get('regenerate_context_changes', True))
+    report = {
+        "previous_job_id": previous['id'],
+        "generation_mode": data['generation_mode'],
+        "continuity_pass": data['continuity_pass'],
+        "topics": len(reuse['changes']),
+        "reused_topics": len(reuse['topics']),
+        "regenerated_topics": len(reuse['changes']) - len(reuse['topics']),
+        "reused_transitions": len(reuse['transitions']),
+        "changes": [change for change in reuse['changes'] if change['status'] != 'unchanged'],
+        "estimate": regeneration.estimate(course_plan, reuse, previous_topics, llm_cost, data['continuity_pass']),
+    }
+    return reuse, report
+
+@app.route('/regeneration_plan', methods=['POST'])
+def regeneration_plan():
+    """What a lessons job with this previous_job_id would regenerate and reuse, before running it."""
+    data = request.json
+    previous, error, status = previous_lessons_job(data)
+    if error:
+        return jsonify({"error": error}), status
+    _, report = plan_incremental(incremental_request(data, previous), previous)
+    return jsonify(report)
+
+job_store = JobStore(JOBS_DB)
+job_manager = JobManager(job_store, {'course_plan': run_course_plan_job, 'lessons': run_lessons_job}, max_workers=JOB_WORKERS,
+                         lease_seconds=JOB_LEASE_SECONDS)
+# Jobs left unfinished by a previous server process are picked up at startup, not on the first request.
+# Under the debug reloader only the child process that serves requests runs jobs.
+if __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    job_manager.start()
+
+def job_status(job):
+    status = {key: job[key] for key in ('id', 'kind', 'status', 'error', 'created', 'updated')}
+    if job['kind'] == 'lessons':
+        course = job['request'].get('course_plan', {}).get('course', [])
+        status.update(job_store.progress(job['id']))
+        status['total_lessons'] = len(course)
+        status['total_topics'] = sum(len(lesson['topics']) for lesson in course)
+        if course_store is not None and job['request'].get('save_course', True):
+            status['course_id'] = job['id']
+    return status
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    data = request.json
+    kind = data.get('kind')
+    if kind not in job_manager.runners:
+        return jsonify({"error": f"Unknown job kind: {kind}"}), 400
+    if kind == 'lessons' and data.get('generation_mode', GENERATION_MODE) not in ('sequential', 'parallel'):
+        return jsonify({"error": f"Unknown generation mode: {data.get('generation_mode')}"}), 400
+    report = None
+    if kind == 'lessons' and data.get('previous_job_id'):
+        previous, error, status = previous_lessons_job(data)
+        if error:
+            return jsonify({"error": error}), status
+        data = incremental_request(data, previous)
+        _, report = plan_incremental(data, previous)
+    job_id = job_manager.submit(kind, data)
+    response = {"job_id": job_id, "status": "queued"}
+    if report is not None:
+        response["regeneration"] = report
+    return jsonify(response), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job_status(job))
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if job['status'] == 'failed':
+        return jsonify({"error": job['error']}), 500
+    if job['status'] != 'completed':
+        return jsonify(job_status(job)), 409
+    return jsonify(job['result'])
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def stream_job_status(job_id):
+    if job_store.get(job_id) is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    # NDJSON status snapshots whenever the job makes progress, until it completes or fails
+    def snapshots():
+        last = None
+        while True:
+            status = job_status(job_store.get(job_id))
+            if status != last:
+                yield status
+                last = status
+            if status['status'] in TERMINAL_STATUSES:
+                return
+            time.sleep(JOB_POLL_INTERVAL)
+    return Response(stream_with_context(ndjson_stream(snapshots())), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Stored courses. The index of a course lists its lessons with their topic and subtopic titles only;
+# topics are read on demand a lesson or a topic at a time, and /export streams the whole course one
+# lesson at a time, so neither side ever holds a whole large course.
+def page_args(default_limit=COURSE_PAGE_SIZE):
+    return max(0, request.args.get('offset', 0, type=int)), request.args.get('limit', default_limit, type=int)
+
+def no_course_store():
+    return jsonify({"error": "The course store is disabled"}), 404
+
+@app.route('/courses', methods=['GET'])
+def list_courses():
+    if course_store is None:
+        return no_course_store()
+    offset, limit = page_args()
+    courses, total = course_store.courses(offset, limit)
+    return jsonify({"courses": courses, "total": total, "offset": offset, "limit": limit})
+
+@app.route('/courses/<course_id>', methods=['GET'])
+def get_course(course_id):
+    if course_store is None:
+        return no_course_store()
+    offset, limit = page_args(-1)
+    course = course_store.index(course_id, offset, limit)
+    if course is None:
+        return jsonify({"error": "Course not found"}), 404
+    return jsonify(course)
+
+@app.route('/courses/<course_id>', methods=['DELETE'])
+def delete_course(course_id):
+    if course_store is None:
+        return no_course_store()
+    if not course_store.delete(course_id):
+        return jsonify({"error": "Course not found"}), 404
+    return jsonify({"deleted": course_id})
+
+@app.route('/courses/<course_id>/plan', methods=['GET'])
+def get_stored_course_plan(course_id):
+    if course_store is None:
+        return no_course_store()
+    course_plan = course_store.course_plan(course_id)
+    if course_plan is None:
+        return jsonify({"error": "Course not found"}), 404
+    return jsonify(course_plan)
+
+@app.route('/courses/<course_id>/lessons/<int:lesson_index>', methods=['GET'])
+def get_stored_lesson(course_id, lesson_index):
+    if course_store is None:
+        return no_course_store()
+    offset, limit = page_args(-1)
+    lesson = course_store.lesson(course_id, lesson_index, offset, limit)
+    if lesson is None:
+        return jsonify({"error": "Lesson not found"}), 404
+    return jsonify(lesson)
+
+@app.route('/courses/<course_id>/lessons/<int:lesson_index>/topics/<int:topic_index>', methods=['GET'])
+def get_stored_topic(course_id, lesson_index, topic_index):
+    if course_store is None:
+        return no_course_store()
+    topic = course_store.topic(course_id, lesson_index, topic_index)
+    if topic is None:
+        return jsonify({"error": "Topic not found"}), 404
+    return jsonify(topic)
+
+@app.route('/courses/<course_id>/export', methods=['GET'])
+def export_course(course_id):
+    if course_store is None:
+        return no_course_store()
+    if course_store.get(course_id) is None:
+        return jsonify({"error": "Course not found"}), 404
+    # NDJSON, one lesson per line in the shape /generate_lessons returns them
+    return Response(stream_with_context(json.dumps(lesson) + "\n" for lesson in course_store.lessons(course_id)),
+                    mimetype='application/x-ndjson')
+
+@app.route('/course_store_stats', methods=['GET'])
+def course_store_stats():
+    if course_store is None:
+        return no_course_store()
+    return jsonify(course_store.stats())
+
 # count words
 def count_words(string):
     words = string.split()
@@ -433,11 +1046,15 @@ def regenerate_topic():
     data = request.json
     content = data.get('content', '').strip()
     
+    if data.get('stream'):
+        return ndjson_response(content_events(
+            stream_chat_completion(bypass_cache=data.get('bypass_cache', True), **regenerate_request(content))))
+
     try:
-        regenerated_content = regenerate_content(content)
+        regenerated_content = regenerate_content(content, bypass_cache=data.get('bypass_cache', True))
         return jsonify({"content": regenerated_content})
     except Exception as e:
-        print('Error:', str(e))  # Log the error
+        observability.log_error("request.error", endpoint=request.path, error=str(e))
         return jsonify({"error": str(e)}), 500
 
 @app.route('/shorten_topic', methods=['POST'])
@@ -445,11 +1062,15 @@ def shorten_topic():
     data = request.json
     content = data.get('content', '').strip()
     
+    if data.get('stream'):
+        return ndjson_response(content_events(
+            stream_chat_completion(bypass_cache=data.get('bypass_cache', False), **shorten_request(content))))
+
     try:
-        shorter_content = shorten_content(content)
+        shorter_content = shorten_content(content, bypass_cache=data.get('bypass_cache', False))
         return jsonify({"content": shorter_content})
     except Exception as e:
-        print('Error:', str(e))  # Log the error
+        observability.log_error("request.error", endpoint=request.path, error=str(e))
         return jsonify({"error": str(e)}), 500
 
 @app.route('/expand_topic', methods=['POST'])
@@ -457,48 +1078,129 @@ def expand_topic():
     data = request.json
     content = data.get('content', '').strip()
     
+    if data.get('stream'):
+        return ndjson_response(content_events(
+            stream_chat_completion(bypass_cache=data.get('bypass_cache', False), **extend_request(content))))
+
     try:
-        extended_content = extend_content(content)
+        extended_content = extend_content(content, bypass_cache=data.get('bypass_cache', False))
         return jsonify({"content": extended_content})
     except Exception as e:
-        print('Error:', str(e))  # Log the error
+        observability.log_error("request.error", endpoint=request.path, error=str(e))
         return jsonify({"error": str(e)}), 500
 
-@app.route('/fact_checking', methods=['POST'])
-def fact_checking():
-    detailed_lesson_content = request.get_json()
-
-    response = client.chat.completions.create(
+def extract_facts(detailed_lesson_content):
+    response = chat_completion(
+            label="fact_extraction",
             response_format={"type": "json_object"},
             model=gpt_model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": """
-                    You are an experienced fact checker. Please perform the following tasks:
-
-                    * Extract only the key facts from the provided lesson data that you believe may require verification. Focus on those facts that are critical to the lesson's accuracy or that could be subject to debate or misinterpretation.
-                    * If a fact is generally accepted, uncontroversial, and highly likely to be correct, do not include it for verification.
-                    * Each fact should be a clear, concise statement that can be independently verified.
-                    * Ensure that the selected facts are directly relevant to the core content and claims made in the text.
-                    * Strictly adhere to the response format.
-                    JSON Response format: {"facts": ["fact1", "fact2", "..."]}
-                """
-                },
-                {"role": "user", "content": f"""{detailed_lesson_content}
-                """},
-            ],
+            messages=prompts.fact_extraction_messages(detailed_lesson_content),
             temperature=0.5,
             max_tokens=4096,
         )
-    facts_json = json.loads(response.choices[0].message.content)
+    facts_json = json.loads(response)
+    return facts_json['facts']
+
+def fact_checking_options():
+    """Evidence mode and retrieval backend from the query string, or an error message."""
+    evidence_mode = request.args.get('evidence_mode', EVIDENCE_MODE)
+    if evidence_mode not in EVIDENCE_MODES:
+        return None, None, f"Unknown evidence mode: {evidence_mode}"
+    retrieval_backend = request.args.get('retrieval_backend', RETRIEVAL_BACKEND)
+    if retrieval_backend not in RETRIEVAL_BACKENDS:
+        return None, None, f"Unknown retrieval backend: {retrieval_backend}"
+    return evidence_mode, retrieval_backend, None
 
-    checked_facts = []
-    for fact in facts_json['facts']:
-        result = verify_fact(fact)
-        checked_facts.append(result)
-    
-    return jsonify(checked_facts)
+@app.route('/fact_checking', methods=['POST'])
+def fact_checking():
+    detailed_lesson_content = request.get_json()
+    evidence_mode, retrieval_backend, error = fact_checking_options()
+    if error:
+        return jsonify({"error": error}), 400
+
+    pool = get_verification_pool()
+    verify = pool.verify_facts if pool else verify_facts
+    with observability.trace(kind="fact_checking") as trace:
+        checked_facts = verify(extract_facts(detailed_lesson_content), mode=evidence_mode, backend=retrieval_backend)
+
+    return jsonify(checked_facts), {'X-Trace-Id': trace.id}
+
+@app.route('/fact_checking/batch', methods=['POST'])
+def fact_checking_batch():
+    """Checks many lessons (or topics) at once: {"lessons": [...]} -> per-lesson results and throughput."""
+    lessons = request.get_json().get('lessons', [])
+    evidence_mode, retrieval_backend, error = fact_checking_options()
+    if error:
+        return jsonify({"error": error}), 400
+
+    pool = get_verification_pool()
+    start = time.perf_counter()
+    with observability.trace(kind="fact_checking") as trace:
+        # One fact extraction call per lesson, run concurrently; verification is one batch over all facts
+        scheduler = TaskScheduler(LLM_MAX_CONCURRENCY, LLM_REQUESTS_PER_MINUTE)
+        for lesson_index, lesson in enumerate(lessons):
+            scheduler.add(lesson_index, extract_facts, lesson)
+        try:
+            extracted = scheduler.run()
+        except json.JSONDecodeError as json_err:
+            observability.log_error("request.json_error", endpoint=request.path, error=str(json_err))
+            return jsonify({"error": "Failed to parse JSON response from OpenAI API"}), 500
+        extraction_seconds = time.perf_counter() - start
+
+        results, stats = verify_fact_groups([extracted[lesson_index] for lesson_index in range(len(lessons))],
+                                            mode=evidence_mode, backend=retrieval_backend,
+                                            verify=pool.verify_deduplicated_facts if pool else None)
+    stats['extraction_seconds'] = round(extraction_seconds, 3)
+    stats['total_seconds'] = round(time.perf_counter() - start, 3)
+    observability.log_event("facts.checked", facts=stats['facts'], lessons=len(lessons),
+                            facts_per_second=stats['facts_per_second'], trace_id=trace.id)
+    return jsonify({"results": results, "stats": stats}), {'X-Trace-Id': trace.id}
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    stats = {"llm": llm_cache.stats()}
+    # Looked up at request time: fact_verification reopens the store in forked workers
+    if fact_verification.embedding_store is not None:
+        stats["embeddings"] = fact_verification.embedding_store.stats()
+    return jsonify(stats)
+
+@app.route('/startup_stats', methods=['GET'])
+def startup_stats():
+    return jsonify({"models": model_stats(), "first_request_seconds": first_request_seconds})
+
+@app.route('/structured_output_stats', methods=['GET'])
+def structured_output_report():
+    stats = structured_output_stats.snapshot()
+    # Tokens spent on re-requests, from the usage report of their own call labels
+    with llm_usage_lock:
+        for kind, counts in stats.items():
+            usage = llm_usage.get(f"{kind}_retry", {})
+            counts["retry_tokens"] = usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0)
+    return jsonify(stats)
+
+@app.route('/token_usage', methods=['GET'])
+def token_usage():
+    with llm_usage_lock:
+        return jsonify(llm_usage)
+
+@app.route('/rate_limit_stats', methods=['GET'])
+def rate_limit_stats():
+    return jsonify(llm_limiter.stats())
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(observability.render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/traces', methods=['GET'])
+def list_traces():
+    return jsonify(observability.list_traces())
+
+@app.route('/traces/<trace_id>', methods=['GET'])
+def get_trace(trace_id):
+    trace = observability.get_trace(trace_id)
+    if trace is None:
+        return jsonify({"error": "Trace not found"}), 404
+    return jsonify(trace.report())
     
 
 
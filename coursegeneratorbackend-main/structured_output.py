@@ -0,0 +1,175 @@
+import json
+import re
+import threading
+
+from observability import log_warning
+
+# Schemas are derived from the example documents the prompts already show the model
+# (courseplan_format.json, lessoncontent_format.json): an object maps its keys to the
+# schemas of their values, a list holds the schema of its items, anything else is a scalar.
+SCALAR = 'scalar'
+
+def schema_from_example(example):
+    if isinstance(example, dict):
+        return {key: schema_from_example(value) for key, value in example.items()}
+    if isinstance(example, list):
+        items = [schema_from_example(item) for item in example]
+        return [merge_schemas(items)] if items else [SCALAR]
+    return SCALAR
+
+def merge_schemas(schemas):
+    """Keys present in every example item are required."""
+    first = schemas[0]
+    if isinstance(first, dict) and all(isinstance(schema, dict) for schema in schemas):
+        keys = [key for key in first if all(key in schema for schema in schemas)]
+        return {key: merge_schemas([schema[key] for schema in schemas]) for key in keys}
+    return first
+
+def validate(value, schema, path="$"):
+    """List of (path, message) for every part of value that does not match schema."""
+    if isinstance(schema, dict):
+        if not isinstance(value, dict):
+            return [(path, "expected an object")]
+        errors = []
+        for key, key_schema in schema.items():
+            if key not in value:
+                errors.append((f"{path}.{key}", "missing"))
+            else:
+                errors.extend(validate(value[key], key_schema, f"{path}.{key}"))
+        return errors
+    if isinstance(schema, list):
+        if not isinstance(value, list):
+            return [(path, "expected a list")]
+        errors = []
+        for index, item in enumerate(value):
+            errors.extend(validate(item, schema[0], f"{path}[{index}]"))
+        return errors
+    if isinstance(value, (dict, list)) or value is None:
+        return [(path, "expected a string")]
+    return []
+
+def failed_items(errors, path):
+    """Indices of the items of the list at path that have errors, or None if the errors are not all inside its items."""
+    pattern = re.compile(re.escape(path) + r"\[(\d+)\]")
+    indices = set()
+    for error_path, _ in errors:
+        match = pattern.match(error_path)
+        if match is None:
+            return None
+        indices.add(int(match.group(1)))
+    return sorted(indices)
+
+def repair_json(text):
+    """Best-effort local repair of malformed or truncated JSON.
+
+    Handles prose or code fences around the value, trailing commas, raw newlines inside
+    strings and a value cut off part-way (e.g. at max_tokens): the incomplete last member
+    is dropped and the open brackets are closed. Returns the parsed value or None.
+    """
+    start = min((index for index in (text.find('{'), text.find('[')) if index >= 0), default=-1)
+    if start < 0:
+        return None
+    out = []
+    stack = []
+    # expect_value[i] is True while the object at stack[i] is between a ':' and the next ','
+    expect_value = []
+    in_string = escape = False
+    # Output length and open brackets right after the last complete member or item
+    safe = (0, [])
+    for char in text[start:]:
+        if in_string:
+            if escape:
+                escape = False
+            elif char == '\\':
+                escape = True
+            elif char == '"':
+                in_string = False
+                out.append(char)
+                if stack and (stack[-1] == '[' or expect_value[-1]):
+                    safe = (len(out), list(stack))
+                continue
+            elif char == '\n':
+                char = '\\n'
+            out.append(char)
+            continue
+        if char == '"':
+            in_string = True
+        elif char in '{[':
+            stack.append(char)
+            expect_value.append(False)
+            out.append(char)
+            safe = (len(out), list(stack))
+            continue
+        elif char in '}]':
+            if not stack:
+                break
+            while out and out[-1] in ' \t\r\n,':
+                out.pop()
+            stack.pop()
+            expect_value.pop()
+            out.append('}' if char == '}' else ']')
+            safe = (len(out), list(stack))
+            if not stack:
+                break
+            continue
+        elif char == ':' and stack:
+            expect_value[-1] = True
+        elif char == ',' and stack:
+            safe = (len(out), list(stack))
+            expect_value[-1] = False
+        out.append(char)
+
+    candidate = ''.join(out)
+    if stack or in_string:
+        length, open_brackets = safe
+        candidate = ''.join(out[:length]).rstrip(' \t\r\n,')
+        candidate += ''.join('}' if bracket == '{' else ']' for bracket in reversed(open_brackets))
+    try:
+        return json.loads(candidate)
+    except json.JSONDecodeError:
+        return None
+
+class OutputStats:
+    """Parse-failure and retry counts per kind of structured response, for /structured_output_stats."""
+    FIELDS = ("responses", "parse_failures", "repaired", "invalid", "retries", "unrecovered", "discarded_tokens")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def record(self, kind, **counts):
+        with self._lock:
+            kind_counts = self._counts.setdefault(kind, dict.fromkeys(self.FIELDS, 0))
+            for field, count in counts.items():
+                kind_counts[field] += count
+
+    def snapshot(self):
+        with self._lock:
+            stats = {kind: dict(counts) for kind, counts in self._counts.items()}
+        for counts in stats.values():
+            counts["parse_failure_rate"] = counts["parse_failures"] / counts["responses"] if counts["responses"] else 0.0
+        return stats
+
+def parse_structured(text, kind, stats=None):
+    """json.loads with local repair as the fallback; returns the value or None and records the outcome."""
+    try:
+        value = json.loads(text)
+        if stats is not None:
+            stats.record(kind, responses=1)
+        return value
+    except json.JSONDecodeError as e:
+        log_warning("structured_output.parse_failure", kind=kind, error=str(e))
+    value = repair_json(text)
+    if stats is not None:
+        stats.record(kind, responses=1, parse_failures=1, repaired=value is not None)
+    return value
+
+def parses_to(text, value):
+    """Whether text is valid JSON for exactly value, i.e. value needed no repairs."""
+    try:
+        return json.loads(text) == value
+    except json.JSONDecodeError:
+        return False
+
+class StructuredOutputError(ValueError):
+    pass
@@ -0,0 +1,70 @@
+import gc
+import multiprocessing
+import os
+
+import fact_verification
+import observability
+
+def init_worker(threads_per_worker):
+    fact_verification.reset_after_fork()
+    try:
+        import torch
+        # One worker per core: extra intra-op threads would only compete with the other workers
+        torch.set_num_threads(threads_per_worker)
+    except ImportError:
+        pass
+
+def embedding_counters():
+    store = fact_verification.embedding_store
+    return store.counters() if store is not None else (0, 0, 0)
+
+def verify_chunk(facts, max_text_length, mode, evidence_budget, backend):
+    """Verifies facts in a worker; returns the results with the stage spans and embedding store lookups recorded on the way."""
+    before = embedding_counters()
+    with observability.collect_spans() as spans:
+        verified = fact_verification.verify_deduplicated_facts(facts, max_text_length, mode, evidence_budget, backend)
+    return verified, spans, [after - start for after, start in zip(embedding_counters(), before)]
+
+# Process pool for fact verification. The models are loaded once in the parent and the
+# workers are forked from it, so they share the model weights copy-on-write instead of
+# each loading its own ~400MB copy; model inference then runs outside the server's GIL.
+# Facts are spread over the workers in chunks through the pool's task queue.
+class VerificationPool:
+    def __init__(self, processes=None, threads_per_worker=1):
+        self.processes = processes or os.cpu_count()
+        fact_verification.warm_up()
+        # Without fork (e.g. macOS, Windows) every worker loads its own models on first use
+        start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+        self.shared_models = start_method == 'fork'
+        context = multiprocessing.get_context(start_method)
+        # Move the loaded objects out of the collector's reach so that garbage collections in
+        # the workers do not write to, and thereby copy, the pages they share with the parent
+        gc.collect()
+        gc.freeze()
+        try:
+            self._pool = context.Pool(self.processes, initializer=init_worker, initargs=(threads_per_worker,))
+        finally:
+            gc.unfreeze()
+
+    def verify_deduplicated_facts(self, facts, max_text_length=300, mode=None, evidence_budget=None, backend=None):
+        """Same contract as fact_verification.verify_deduplicated_facts, spread over the worker processes."""
+        unique = list(dict.fromkeys(facts))
+        if not unique:
+            return [], 0
+        chunk_size = -(-len(unique) // self.processes)
+        chunks = [unique[start:start + chunk_size] for start in range(0, len(unique), chunk_size)]
+        verified = self._pool.starmap(verify_chunk, [(chunk, max_text_length, mode, evidence_budget, backend) for chunk in chunks])
+        by_fact = {}
+        for chunk, ((results, _), spans, counters) in zip(chunks, verified):
+            by_fact.update(zip(chunk, results))
+            observability.replay_spans(spans)
+            if fact_verification.embedding_store is not None:
+                fact_verification.embedding_store.add_counters(*counters)
+        return [dict(by_fact[fact]) for fact in facts], sum(unique_count for (_, unique_count), _, _ in verified)
+
+    def verify_facts(self, facts, max_text_length=300, mode=None, evidence_budget=None, backend=None):
+        return self.verify_deduplicated_facts(facts, max_text_length, mode, evidence_budget, backend)[0]
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
@@ -2,7 +2,6 @@ import React, { useState } from 'react';
 import { useLocation } from 'react-router-dom';
 import { DndProvider, useDrag, useDrop } from 'react-dnd';
 import { HTML5Backend } from 'react-dnd-html5-backend';
-import axios from 'axios';
 import { v4 as uuidv4 } from 'uuid';
 import { useNavigate } from 'react-router-dom';
 
@@ -150,7 +149,7 @@ function Topic({ topic, index, moveTopic, moveSubtopic }) {
 
 function CourseContent() {
   const location = useLocation();
-  const { course } = location.state || {};
+  const { course, courseName } = location.state || {};
   const [loading, setLoading] = useState(false);
   const [selectedLesson, setSelectedLesson] = useState(course ? course[0] : null);
   const navigate = useNavigate();
@@ -187,7 +186,7 @@ function CourseContent() {
 
     setSelectedLesson({ ...selectedLesson, topics: updatedTopics });
   };
-  const handleGenerateContent = async () => {
+  const handleGenerateContent = () => {
     setLoading(true);
 
     const coursePlan = course.map((lesson) => ({
@@ -204,15 +203,8 @@ function CourseContent() {
         }
     };
 
-    try {
-      const response = await axios.post('http://127.0.0.1:5000/generate_lessons', data);
-      console.log('Response:', response.data);
-      navigate('/lesson-content', { state: { lessons: response.data } });
-    } catch (error) {
-      console.error('Error generating content:', error);
-    } finally {
-      setLoading(false);
-    }
+    // The lesson view streams the generated content and shows each topic as soon as it is ready
+    navigate('/lesson-content', { state: { coursePlan: data.course_plan, courseName } });
   };
 
   if (!course) {
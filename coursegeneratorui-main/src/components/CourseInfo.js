@@ -28,7 +28,7 @@ function CourseInfo() {
       const response = await axios.post('http://127.0.0.1:5000/generate_course_plan', data);
       console.log('Response:', response.data);
 
-      navigate('/course-content', { state: { course: response.data.course } });
+      navigate('/course-content', { state: { course: response.data.course, courseName: data.course_name } });
     } catch (err) {
       setError('Failed to submit the form. Please try again.');
       console.error('Error:', err);
@@ -1,8 +1,17 @@
-import React from 'react';
+import React, { useEffect, useState } from 'react';
 import { useNavigate } from 'react-router-dom';
 
 function HomePage() {
   const navigate = useNavigate();
+  const [courses, setCourses] = useState([]);
+
+  // Courses generated before, newest first; opening one loads it lesson by lesson
+  useEffect(() => {
+    fetch('http://127.0.0.1:5000/courses')
+      .then(response => response.json())
+      .then(data => setCourses(data.courses || []))
+      .catch(error => console.error('Loading saved courses failed:', error));
+  }, []);
 
   return (
     <div className="min-h-screen bg-blue-100 flex items-center justify-center">
@@ -15,6 +24,27 @@ function HomePage() {
         >
           Get Started
         </button>
+        {courses.length > 0 && (
+          <div className="mt-10 text-left">
+            <h2 className="text-xl font-semibold text-gray-800 mb-3">Saved courses</h2>
+            <ul className="space-y-2">
+              {courses.map(course => (
+                <li key={course.id}>
+                  <button
+                    onClick={() => navigate('/lesson-content', { state: { courseId: course.id } })}
+                    className="w-full text-left p-3 rounded-lg hover:bg-gray-100 transition duration-200"
+                  >
+                    <span className="font-semibold text-gray-700">{course.title}</span>
+                    <span className="text-sm text-gray-500 ml-2">
+                      {course.lessons} lessons, {course.generated_topics}/{course.topics} topics
+                      {course.status !== 'completed' && ` (${course.status})`}
+                    </span>
+                  </button>
+                </li>
+              ))}
+            </ul>
+          </div>
+        )}
       </div>
     </div>
   );
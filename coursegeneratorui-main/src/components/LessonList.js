@@ -1,5 +1,5 @@
-import React, { useState } from 'react';
-import { useLocation } from 'react-router-dom';
+import React, { useEffect, useState } from 'react';
+import { useLocation, useNavigate } from 'react-router-dom';
 import ReactMarkdown from 'react-markdown';
 import remarkGfm from 'remark-gfm';
 import rehypeKatex from 'rehype-katex';
@@ -27,6 +27,52 @@ const convertLessonToMarkdown = (lesson) => {
     return markdownContent;
 };
 
+// Placeholder for a topic of the course plan that has not been generated yet, in the shape the course store uses
+const topicShell = (topic) => ({
+    title: topic.title,
+    subtopics: (topic.subtopics || []).map(subtopic => ({ title: typeof subtopic === 'string' ? subtopic : subtopic.title })),
+    generated: false,
+});
+
+// Placeholder for a lesson of the course plan whose content is still being generated. Its topics
+// keep the positions of the plan, so a topic streamed out of order lands at its topic_index.
+const lessonShell = (lesson) => ({
+    id: lesson.id,
+    lesson_title: lesson.lesson_title,
+    lesson_description: lesson.description,
+    learning_objectives: lesson.learningObjectives,
+    topics: lesson.topics.map(topicShell),
+    streaming: true,
+});
+
+// Reads an NDJSON event stream and hands every event to onEvent as it arrives
+const readEvents = async (response, onEvent) => {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        lines.filter(line => line.trim()).forEach(line => onEvent(JSON.parse(line)));
+    }
+};
+
+// Streams the lessons generated by /generate_lessons
+const streamLessons = async (coursePlan, courseName, signal, onEvent) => {
+    const response = await fetch('http://127.0.0.1:5000/generate_lessons', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ course_plan: coursePlan, course_name: courseName, stream: true }),
+        signal,
+    });
+    await readEvents(response, onEvent);
+};
+
 const downloadMarkdown = (lesson) => {
     const markdownContent = convertLessonToMarkdown(lesson);
     const blob = new Blob([markdownContent], { type: 'text/markdown' });
@@ -102,8 +148,15 @@ const LessonContent = ({ lesson, updateContent }) => {
     const [loadingState, setLoadingState] = useState({});
     const [factCheckResults, setFactCheckResults] = useState({});
     const [isPopupOpen, setIsPopupOpen] = useState({});
+    const [lessonFactCheck, setLessonFactCheck] = useState(null);
+
+    // Topics can only be edited or fact-checked once the whole lesson has arrived: until then the
+    // final lesson event would overwrite any edit
+    const lessonReady = !lesson.streaming && lesson.loaded !== false;
+    const topicReady = (topicIndex) => lessonReady && lesson.topics[topicIndex].generated !== false;
 
     const handleAction = (actionType, topicIndex, subtopicIndex = null) => {
+        if (!topicReady(topicIndex)) return;
         const key = subtopicIndex !== null ? `${topicIndex}-${subtopicIndex}-${actionType}` : `${topicIndex}-${actionType}`;
         setLoadingState(prev => ({ ...prev, [key]: true }));
 
@@ -115,18 +168,27 @@ const LessonContent = ({ lesson, updateContent }) => {
             shorten: 'http://127.0.0.1:5000/shorten_topic',
         };
 
+        // The new text streams in token by token and replaces the old text as it arrives
+        let streamedContent = '';
         fetch(endpointMap[actionType], {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({ content: contentToSend }),
+            body: JSON.stringify({ content: contentToSend, stream: true }),
         })
-            .then(response => response.json())
-            .then(data => {
-                console.log(`${actionType} action successful:`, data);
-                updateContent(lesson.id, topicIndex, subtopicIndex, data.content);
-            })
+            .then(response => readEvents(response, (event) => {
+                if (event.type === 'delta') {
+                    streamedContent += event.content;
+                    updateContent(lesson.id, topicIndex, subtopicIndex, streamedContent.trimStart());
+                } else if (event.type === 'done') {
+                    console.log(`${actionType} action successful`);
+                    updateContent(lesson.id, topicIndex, subtopicIndex, event.content);
+                } else if (event.type === 'error') {
+                    console.error(`${actionType} action failed:`, event.error);
+                    updateContent(lesson.id, topicIndex, subtopicIndex, contentToSend);
+                }
+            }))
             .catch(error => {
                 console.error(`${actionType} action failed:`, error);
             })
@@ -136,6 +198,7 @@ const LessonContent = ({ lesson, updateContent }) => {
     };
 
     const handleCheckFacts = (topicIndex) => {
+        if (!topicReady(topicIndex)) return;
         const key = `${topicIndex}-fact_check`;
         setLoadingState(prev => ({ ...prev, [key]: true }));
 
@@ -162,6 +225,37 @@ const LessonContent = ({ lesson, updateContent }) => {
             });
     };
 
+    // Check every topic of the lesson in one batch request and show all facts together
+    const handleCheckAllFacts = () => {
+        if (!lessonReady) return;
+        const key = 'lesson-fact_check';
+        setLoadingState(prev => ({ ...prev, [key]: true }));
+
+        fetch('http://127.0.0.1:5000/fact_checking/batch', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ lessons: lesson.topics }),
+        })
+            .then(response => response.json())
+            .then(data => {
+                console.log(`Fact check for lesson ${lesson.id} successful:`, data.stats);
+                const results = {};
+                data.results.forEach((facts, topicIndex) => {
+                    results[topicIndex] = facts;
+                });
+                setFactCheckResults(prev => ({ ...prev, ...results }));
+                setLessonFactCheck(data.results.flat());
+            })
+            .catch(error => {
+                console.error(`Fact check for lesson ${lesson.id} failed:`, error);
+            })
+            .finally(() => {
+                setLoadingState(prev => ({ ...prev, [key]: false }));
+            });
+    };
+
     const togglePopup = (topicIndex) => {
         setIsPopupOpen(prev => ({ ...prev, [topicIndex]: !prev[topicIndex] }));
     };
@@ -198,7 +292,15 @@ const LessonContent = ({ lesson, updateContent }) => {
             </section>
 
             <section>
-                <h2 className="text-2xl font-semibold text-gray-800 mb-4">Topics</h2>
+                <div className="flex items-center justify-between mb-4">
+                    <h2 className="text-2xl font-semibold text-gray-800">Topics</h2>
+                    <CheckFactsButton
+                        label="Check All Facts"
+                        onClick={handleCheckAllFacts}
+                        isLoading={loadingState['lesson-fact_check']}
+                        disabled={!lessonReady}
+                    />
+                </div>
                 {lesson.topics.map((topic, index) => (
                     <div key={index} className="mb-8 relative" id={`topic-${index}`}>
                         <div className="bg-blue-50 p-6 rounded-lg shadow-md relative">
@@ -209,6 +311,7 @@ const LessonContent = ({ lesson, updateContent }) => {
                                 <CheckFactsButton
                                     onClick={() => handleCheckFacts(index)}
                                     isLoading={loadingState[`${index}-fact_check`]}
+                                    disabled={!topicReady(index)}
                                 />
                             </div>
                             <div className="flex space-x-4">
@@ -217,18 +320,21 @@ const LessonContent = ({ lesson, updateContent }) => {
                                     label="Regenerate Text"
                                     onClick={() => handleAction('regenerate', index)}
                                     isLoading={loadingState[`${index}-regenerate`]}
+                                    disabled={!topicReady(index)}
                                 />
                                 <ActionButton
                                     icon={loadingState[`${index}-expand`] ? FaSpinner : FaExpandAlt}
                                     label="Expand Text"
                                     onClick={() => handleAction('expand', index)}
                                     isLoading={loadingState[`${index}-expand`]}
+                                    disabled={!topicReady(index)}
                                 />
                                 <ActionButton
                                     icon={loadingState[`${index}-shorten`] ? FaSpinner : FaCompressAlt}
                                     label="Shorten Text"
                                     onClick={() => handleAction('shorten', index)}
                                     isLoading={loadingState[`${index}-shorten`]}
+                                    disabled={!topicReady(index)}
                                 />
                                 <button
                                     onClick={() => togglePopup(index)}
@@ -242,7 +348,7 @@ const LessonContent = ({ lesson, updateContent }) => {
                                 remarkPlugins={[remarkGfm]}
                                 rehypePlugins={[rehypeKatex]}
                             >
-                                {topic.content}
+                                {topic.generated === false ? '*Not generated yet.*' : topic.content}
                             </ReactMarkdown>
 
                             {topic.subtopics && topic.subtopics.length > 0 && (
@@ -261,18 +367,21 @@ const LessonContent = ({ lesson, updateContent }) => {
                                                             label="Regenerate Text"
                                                             onClick={() => handleAction('regenerate', index, subIndex)}
                                                             isLoading={loadingState[`${index}-${subIndex}-regenerate`]}
+                                                            disabled={!topicReady(index)}
                                                         />
                                                         <ActionButton
                                                             icon={loadingState[`${index}-${subIndex}-expand`] ? FaSpinner : FaExpandAlt}
                                                             label="Expand Text"
                                                             onClick={() => handleAction('expand', index, subIndex)}
                                                             isLoading={loadingState[`${index}-${subIndex}-expand`]}
+                                                            disabled={!topicReady(index)}
                                                         />
                                                         <ActionButton
                                                             icon={loadingState[`${index}-${subIndex}-shorten`] ? FaSpinner : FaCompressAlt}
                                                             label="Shorten Text"
                                                             onClick={() => handleAction('shorten', index, subIndex)}
                                                             isLoading={loadingState[`${index}-${subIndex}-shorten`]}
+                                                            disabled={!topicReady(index)}
                                                         />
                                                     </div>
                                                 </div>
@@ -298,6 +407,12 @@ const LessonContent = ({ lesson, updateContent }) => {
                     </div>
                 ))}
             </section>
+            {lessonFactCheck && (
+                <FactCheckPopup
+                    facts={lessonFactCheck}
+                    onClose={() => setLessonFactCheck(null)}
+                />
+            )}
         </div>
     );
 };
@@ -358,23 +473,26 @@ const FactCheckPopup = ({ facts, onClose }) => (
     </div>
 );
 
-const CheckFactsButton = ({ onClick, isLoading }) => (
+const CheckFactsButton = ({ onClick, isLoading, disabled = false, label = "Check Facts" }) => (
     <button
         onClick={onClick}
-        className={`bg-blue-600 text-white text-xs font-semibold px-4 py-2 rounded-md hover:bg-blue-700 transition-colors ${isLoading ? 'cursor-wait' : 'cursor-pointer'}`}
-        disabled={isLoading}
+        className={`bg-blue-600 text-white text-xs font-semibold px-4 py-2 rounded-md hover:bg-blue-700 transition-colors ${isLoading ? 'cursor-wait' : disabled ? 'opacity-50 cursor-not-allowed' : 'cursor-pointer'}`}
+        disabled={isLoading || disabled}
     >
         {isLoading ? (
             <FaSpinner className="animate-spin" />
         ) : (
-            "Check Facts"
+            label
         )}
     </button>
 );
 
-const ActionButton = ({ icon: Icon, label, onClick, isLoading }) => (
+const ActionButton = ({ icon: Icon, label, onClick, isLoading, disabled = false }) => (
     <div className="relative group">
-        <Icon className={`text-gray-500 cursor-pointer ${isLoading ? 'animate-spin' : ''}`} onClick={onClick} />
+        <Icon
+            className={`text-gray-500 ${disabled ? 'opacity-50 cursor-not-allowed' : 'cursor-pointer'} ${isLoading ? 'animate-spin' : ''}`}
+            onClick={disabled ? undefined : onClick}
+        />
         <span className="absolute left-1/2 transform -translate-x-1/2 translate-y-full mt-1 bg-gray-800 text-white text-xs rounded-md px-2 py-1 opacity-0 group-hover:opacity-100 transition-opacity">
             {label}
         </span>
@@ -385,20 +503,82 @@ const ActionButton = ({ icon: Icon, label, onClick, isLoading }) => (
 function LessonList() {
   
 const location = useLocation();
-const lessonsData = location.state?.lessons || [];
-const [lessons, setLessons] = useState(lessonsData);
+const navigate = useNavigate();
+// Read once: the history entry is rewritten to point at the stored course while it is generated
+const [{ lessons: lessonsData = [], coursePlan, courseName, courseId }] = useState(location.state || {});
+const [lessons, setLessons] = useState(lessonsData.length > 0 || !coursePlan ? lessonsData : coursePlan.course.map(lessonShell));
 const [selectedLesson, setSelectedLesson] = useState(lessons[0] || null);
+const [progress, setProgress] = useState(null);
+
+// Generate the lessons of a course plan, rendering topics and lessons as soon as they are streamed
+useEffect(() => {
+    if (!coursePlan) return;
+    const controller = new AbortController();
+    const replaceLesson = (lessonIndex, update) => {
+        setLessons(prev => prev.map((lesson, index) => (index === lessonIndex ? update(lesson) : lesson)));
+    };
+
+    streamLessons(coursePlan, courseName, controller.signal, (event) => {
+        if (event.type === 'topic') {
+            // Parallel mode streams topics out of order; each replaces the placeholder at its topic_index
+            replaceLesson(event.lesson_index, lesson => ({
+                ...lesson,
+                topics: lesson.topics.map((topic, topicIndex) => (topicIndex === event.topic_index ? event.topic : topic)),
+            }));
+        } else if (event.type === 'lesson') {
+            replaceLesson(event.lesson_index, () => event.lesson);
+        } else if (event.type === 'course') {
+            // A refresh or a back/forward visit opens the stored course instead of paying for a new run
+            navigate(location.pathname, { replace: true, state: { courseId: event.course_id, courseName } });
+        } else if (event.type === 'error') {
+            console.error('Lesson generation failed:', event.error);
+            setProgress(prev => ({ ...prev, error: event.error }));
+        } else {
+            setProgress(prev => ({ ...prev, ...event }));
+        }
+    }).catch(error => {
+        if (error.name !== 'AbortError') {
+            console.error('Streaming lessons failed:', error);
+        }
+    });
+    return () => controller.abort();
+}, [coursePlan, courseName]);
+
+// Open a stored course: its index lists every lesson with the titles of its topics, and the
+// topics of a lesson are fetched the first time it is selected
+useEffect(() => {
+    if (!courseId) return;
+    fetch(`http://127.0.0.1:5000/courses/${courseId}`)
+        .then(response => response.json())
+        .then(course => setLessons(course.lessons.map(lesson => ({ ...lesson, loaded: false }))))
+        .catch(error => console.error('Loading the course failed:', error));
+}, [courseId]);
+
+useEffect(() => {
+    if (!courseId || !selectedLesson || selectedLesson.loaded !== false) return;
+    const lessonIndex = selectedLesson.lesson_index;
+    fetch(`http://127.0.0.1:5000/courses/${courseId}/lessons/${lessonIndex}`)
+        .then(response => response.json())
+        .then(lesson => setLessons(prev => prev.map(item => (item.lesson_index === lessonIndex ? lesson : item))))
+        .catch(error => console.error('Loading the lesson failed:', error));
+}, [courseId, selectedLesson]);
+
+// Keep the selected lesson in sync with streamed updates
+useEffect(() => {
+    setSelectedLesson(prev => (prev && lessons.find(lesson => lesson.id === prev.id)) || lessons[0] || null);
+}, [lessons]);
 
 if (!lessons || lessons.length === 0) {
     return (
         <div className="min-h-screen flex items-center justify-center bg-gray-100">
-            <p className="text-xl text-gray-600">No lessons available.</p>
+            <p className="text-xl text-gray-600">{courseId ? 'Loading course…' : 'No lessons available.'}</p>
         </div>
     );
 }
 
+// Functional update, so that the many updates of a streamed edit each apply to the latest lessons
 const updateContent = (lessonId, topicIndex, subtopicIndex, newContent) => {
-    const updatedLessons = lessons.map(lesson => {
+    setLessons(prev => prev.map(lesson => {
         if (lesson.id === lessonId) {
             const updatedTopics = lesson.topics.map((topic, tIndex) => {
                 if (tIndex === topicIndex) {
@@ -419,12 +599,7 @@ const updateContent = (lessonId, topicIndex, subtopicIndex, newContent) => {
             return { ...lesson, topics: updatedTopics };
         }
         return lesson;
-    });
-
-    setLessons(updatedLessons);
-
-    const updatedSelectedLesson = updatedLessons.find(lesson => lesson.id === lessonId);
-    setSelectedLesson(updatedSelectedLesson);
+    }));
 };
 
 return (
@@ -435,6 +610,18 @@ return (
             setSelectedLesson={setSelectedLesson}
         />
         <main className="w-3/4 p-8 overflow-y-auto h-screen">
+            {progress && progress.type !== 'done' && (
+                <div className="mb-6 p-3 rounded-md bg-blue-50 text-blue-700 text-sm flex items-center">
+                    {progress.error ? (
+                        <span>Generation stopped: {progress.error}</span>
+                    ) : (
+                        <>
+                            <FaSpinner className="animate-spin mr-2" />
+                            <span>Generating content… {progress.completed_topics || 0}/{progress.total_topics} topics</span>
+                        </>
+                    )}
+                </div>
+            )}
             {selectedLesson ? (
                 <LessonContent lesson={selectedLesson} updateContent={updateContent} />
             ) : (